@@ -1,35 +1,59 @@
 # detector/admin.py
 from django.contrib import admin
-from .models import DetectionRecord, BatchDetectionJob # 確保匯入模型
+from .models import DetectionRecord, BatchDetectionJob, BatchClassStatistic, DetectionBox # 確保匯入模型
+
+class DetectionBoxInline(admin.TabularInline):
+    model = DetectionBox
+    extra = 0
+    can_delete = False
+    readonly_fields = ('class_id', 'class_name', 'confidence', 'x1', 'y1', 'x2', 'y2')
 
 @admin.register(DetectionRecord)
 class DetectionRecordAdmin(admin.ModelAdmin):
     list_display = ('id', 'batch_job', 'uploaded_at', 'severity_score', 'original_image_preview', 'annotated_image_preview') # 您想在列表頁看到的欄位
     list_filter = ('batch_job', 'uploaded_at', 'severity_score') # 可以用來篩選的欄位
-    search_fields = ('id', 'batch_job__id', 'results_data') # 可以搜尋的欄位
+    # 類別以檢測框資料表 (有索引) 搜尋，不再掃描 results_data JSON
+    search_fields = ('id', 'batch_job__id', '=boxes__class_name') # 可以搜尋的欄位
     readonly_fields = ('uploaded_at', 'id', 'original_image_preview', 'annotated_image_preview') # 通常這些欄位是唯讀的
+    inlines = [DetectionBoxInline]
     # date_hierarchy = 'uploaded_at' # 增加日期層級導覽
 
     # 為了在 Admin 中預覽圖片 (可選，但很方便)
     def original_image_preview(self, obj):
         from django.utils.html import format_html
         if obj.original_image:
-            return format_html('<a href="{0}" target="_blank"><img src="{0}" width="100" /></a>', obj.original_image.url)
+            # 連結開啟完整圖片，預覽使用縮圖 (舊紀錄沒有縮圖時退回完整圖片)
+            preview = obj.original_thumbnail or obj.original_image
+            return format_html('<a href="{0}" target="_blank"><img src="{1}" width="100" loading="lazy" /></a>', obj.original_image.url, preview.url)
         return "(No image)"
     original_image_preview.short_description = '原始圖片預覽'
 
     def annotated_image_preview(self, obj):
         from django.utils.html import format_html
         if obj.annotated_image:
-            return format_html('<a href="{0}" target="_blank"><img src="{0}" width="100" /></a>', obj.annotated_image.url)
+            preview = obj.annotated_thumbnail or obj.annotated_image
+            return format_html('<a href="{0}" target="_blank"><img src="{1}" width="100" loading="lazy" /></a>', obj.annotated_image.url, preview.url)
         return "(No image)"
     annotated_image_preview.short_description = '標註圖片預覽'
 
+class BatchClassStatisticInline(admin.TabularInline):
+    model = BatchClassStatistic
+    extra = 0
+    can_delete = False
+    readonly_fields = ('class_name', 'detection_count', 'severity_sum', 'image_count')
+
 @admin.register(BatchDetectionJob)
 class BatchDetectionJobAdmin(admin.ModelAdmin):
     list_display = ('id', 's3_folder_prefix', 'status', 'total_images_found', 'images_processed_successfully', 'created_at', 'updated_at')
     list_filter = ('status', 'created_at', 's3_bucket_name')
     search_fields = ('id', 's3_folder_prefix', 'celery_task_id')
     readonly_fields = ('id', 'celery_task_id', 'created_at', 'updated_at')
+    inlines = [BatchClassStatisticInline]
     # date_hierarchy = 'created_at'
-    
\ No newline at end of file
+    
+@admin.register(DetectionBox)
+class DetectionBoxAdmin(admin.ModelAdmin):
+    list_display = ('record', 'class_name', 'confidence', 'x1', 'y1', 'x2', 'y2')
+    list_filter = ('class_name',)
+    search_fields = ('=class_name', '=record__id')
+    raw_id_fields = ('record',)
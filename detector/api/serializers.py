@@ -1,4 +1,6 @@
 # detector/api/serializers.py
+import base64
+import binascii
 from rest_framework import serializers
 
 class S3FolderProcessRequestSerializer(serializers.Serializer):
@@ -27,4 +29,20 @@ class S3FolderProcessRequestSerializer(serializers.Serializer):
             # 可以在此處附加 '/' 或在 task 中處理
             # return value + '/'
             pass # 我們的 task 會自動處理結尾的 '/'
-        return value
\ No newline at end of file
+        return value
+
+class Base64ImageProcessRequestSerializer(serializers.Serializer):
+    """
+    舊版 JSON 格式的單張圖片推論請求 ({"image_base64": "..."})。
+    新的用戶端應直接上傳圖片 bytes 或 multipart (見 DetectionViewSet.process)。
+    """
+    image_base64 = serializers.CharField(required=True, help_text="base64 編碼的圖片內容。")
+
+    def validate_image_base64(self, value):
+        try:
+            image_bytes = base64.b64decode(value)
+        except (binascii.Error, ValueError):
+            raise serializers.ValidationError("image_base64 不是有效的 base64 字串。")
+        if not image_bytes:
+            raise serializers.ValidationError("image_base64 解碼後沒有內容。")
+        return image_bytes
@@ -1,19 +1,132 @@
 # detector/api/views.py
 # import base64 # 這個 view action 不直接用 base64
+import os
+from django.conf import settings
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser, MultiPartParser
 from rest_framework.response import Response
 import logging
-from ..tasks import process_s3_folder_task # <-- 匯入的是我們修改過的 task
-from .serializers import S3FolderProcessRequestSerializer
+from ..models import DetectionRecord
+from ..services import process_image_batch, ImageDecodeError
+from ..tasks import process_s3_folder_task, schedule_manual_cleanup # <-- 匯入的是我們修改過的 task
+from .parsers import RawImageParser
+from .serializers import S3FolderProcessRequestSerializer, Base64ImageProcessRequestSerializer
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_API_MAX_IMAGES_PER_REQUEST = 32
+DEFAULT_API_INFERENCE_CHUNK_SIZE = 8
+
+
+def _record_payload(record, error=None, filename=None):
+    """單張圖片的回應內容 (與舊版 api_process_view 相同的欄位，另加 severity_score / error)。"""
+    payload = {'record_id': str(record.id) if record is not None and not record._state.adding else None}
+    if filename is not None:
+        payload['filename'] = filename
+    if error is not None:
+        payload['error'] = str(error)
+        return payload
+    payload.update({
+        'orig_url': record.original_image.url if record.original_image else None,
+        'annotated_url': record.annotated_image.url if record.annotated_image else None,
+        'results': record.results_data,
+        'severity_score': record.severity_score,
+    })
+    return payload
+
 class DetectionViewSet(viewsets.ViewSet):
     """
     使用 ViewSet，把多個 related actions 都放一起。
     """
 
+    @action(detail=False, methods=['post'], url_path='process',
+            parser_classes=[RawImageParser, MultiPartParser, JSONParser])
+    def process(self, request):
+        """
+        POST /api/process/process/[?confidence=0.5]
+        同步辨識手動上傳的圖片，支援三種格式：
+          - Content-Type: image/* ，body 為單張圖片的 bytes (建議，邊緣裝置不需 base64 編碼)
+          - multipart/form-data，一次上傳多個檔案 (任意欄位名稱)，回傳每張圖片的結果
+          - application/json {"image_base64": "..."} (舊版格式)
+        單張圖片回傳 {record_id, orig_url, annotated_url, results, severity_score}；
+        multipart 回傳 {"images": [...]}，每張圖片各自成功或失敗。
+        """
+        try:
+            confidence = float(request.query_params.get('confidence', 0.5))
+        except ValueError:
+            confidence = -1
+        if not 0 < confidence <= 1:
+            return Response({'error': 'confidence 必須介於 0 與 1 之間。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.content_type.startswith('multipart/'):
+            return self._process_multipart(request, confidence)
+
+        if request.content_type.startswith('image/'):
+            if 'image_bytes' not in request.data:  # 空 body 時 DRF 不會呼叫 parser
+                return Response({'error': 'Request body 沒有圖片內容。'}, status=status.HTTP_400_BAD_REQUEST)
+            image_bytes, file_ext = request.data['image_bytes'], request.data['file_ext']
+        else:
+            serializer = Base64ImageProcessRequestSerializer(data=request.data)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            image_bytes, file_ext = serializer.validated_data['image_base64'], '.jpg'
+
+        try:
+            [(record, error)] = process_image_batch([(image_bytes, file_ext, DetectionRecord())], confidence)
+        except RuntimeError as e:
+            logger.error(f"API 推論失敗: {e}", exc_info=True)
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        if error is not None:
+            logger.warning(f"API 圖片處理失敗 (Record ID={record.id}): {error}")
+            error_status = (status.HTTP_400_BAD_REQUEST if isinstance(error, ImageDecodeError)
+                            else status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response(_record_payload(record, error), status=error_status)
+        schedule_manual_cleanup()  # 與網頁上傳相同的手動紀錄保留規則 (背景 debounce 清理)
+        return Response(_record_payload(record), status=status.HTTP_201_CREATED)
+
+    def _process_multipart(self, request, confidence):
+        """
+        multipart 的多張圖片：每次只讀入一小批 (API_INFERENCE_CHUNK_SIZE 張) 的 bytes 並做一次批次推論，
+        處理完即釋放，記憶體用量不隨檔案數增加 (檔案本身由 Django 的 upload handler 暫存)。
+        """
+        uploaded_files = [f for field_name in request.FILES for f in request.FILES.getlist(field_name)]
+        if not uploaded_files:
+            return Response({'error': '請求中沒有圖片檔案。'}, status=status.HTTP_400_BAD_REQUEST)
+        max_images = getattr(settings, 'API_MAX_IMAGES_PER_REQUEST', DEFAULT_API_MAX_IMAGES_PER_REQUEST)
+        if len(uploaded_files) > max_images:
+            return Response({'error': f'每次最多上傳 {max_images} 張圖片。'}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunk_size = max(1, getattr(settings, 'API_INFERENCE_CHUNK_SIZE', DEFAULT_API_INFERENCE_CHUNK_SIZE))
+        payloads = [None] * len(uploaded_files)
+        for start in range(0, len(uploaded_files), chunk_size):
+            image_items, indices = [], []
+            for idx in range(start, min(start + chunk_size, len(uploaded_files))):
+                uploaded_file = uploaded_files[idx]
+                if not (uploaded_file.content_type or '').startswith('image/'):
+                    payloads[idx] = _record_payload(None, f'不是圖片檔案 ({uploaded_file.content_type})', uploaded_file.name)
+                    continue
+                file_ext = os.path.splitext(uploaded_file.name)[1].lower() or '.jpg'
+                image_items.append((uploaded_file.read(), file_ext, DetectionRecord()))
+                indices.append(idx)
+            if not image_items:
+                continue
+            try:
+                processed = process_image_batch(image_items, confidence)
+            except RuntimeError as e:
+                logger.error(f"API 批次推論失敗: {e}", exc_info=True)
+                return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            del image_items
+            for idx, (record, error) in zip(indices, processed):
+                payloads[idx] = _record_payload(record, error, uploaded_files[idx].name)
+
+        succeeded = sum(1 for payload in payloads if 'error' not in payload)
+        if succeeded:
+            schedule_manual_cleanup()
+        logger.info(f"API multipart 請求處理完成: 成功 {succeeded} / {len(payloads)} 張")
+        return Response({'images': payloads},
+                        status=status.HTTP_201_CREATED if succeeded else status.HTTP_400_BAD_REQUEST)
+
     @action(detail=False, methods=['post'], url_path='process_s3_folder')
     def process_s3_folder(self, request):
         """
@@ -1,50 +1,167 @@
 from django.apps import AppConfig
-from ultralytics import YOLO
 import os
+import sys
+import threading
+import time
 from django.conf import settings # 匯入 Django settings 以便獲取 BASE_DIR
 
 # 定義一個全局變數來儲存載入後的模型實例
+# 注意：請透過 get_yolo_model() 取得模型，模型可能是延遲載入的
 yolo_model = None
+# 目前載入模型的權重檔 sha256 與實際使用的推論後端 (pytorch / onnx / openvino)
+yolo_model_weights_hash = None
+yolo_model_backend = None
+# 模型載入與暖機耗時 (秒)，例如 {'role': 'web', 'load_seconds': 1.8, 'warmup_seconds': 0.4}
+yolo_model_load_stats = {}
 
-class DetectorConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'detector'
-    
-    def ready(self):
-        """
-        Django App 準備就緒時會執行的函數。
-        我們在這裡載入模型。
-        """
-        global yolo_model # 宣告我們要修改的是全局變數
+_model_lock = threading.Lock()
+_model_load_attempted = False
+
+
+def detect_process_role(argv=None):
+    """
+    判斷目前 process 的角色，用來決定是否在啟動時載入模型。
+
+    可用環境變數或 settings 的 DETECTOR_PROCESS_ROLE 明確指定，否則依啟動指令推斷：
+      - 'web':        gunicorn / uwsgi / runserver (實際服務請求的子 process)
+      - 'worker':     celery worker
+      - 'beat':       celery beat
+      - 'management': 其他 manage.py 指令 (migrate, collectstatic, shell ...)
+      - 'other':      無法判斷
+    """
+    role = os.environ.get('DETECTOR_PROCESS_ROLE') or getattr(settings, 'DETECTOR_PROCESS_ROLE', None)
+    if role:
+        return role.lower()
+
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return 'other'
+    prog = os.path.basename(argv[0])
+    args = argv[1:]
+
+    if 'gunicorn' in prog or 'uwsgi' in prog:
+        return 'web'
+    if 'celery' in prog or 'celery' in args[:2]:
+        if 'worker' in args:
+            return 'worker'
+        if 'beat' in args:
+            return 'beat'
+        return 'other'
+    if prog == 'manage.py' or prog == 'django-admin':
+        if args and args[0] == 'runserver':
+            # 開發伺服器的 autoreloader 父 process 只負責監看檔案，不處理請求
+            if os.environ.get('RUN_MAIN') == 'true' or '--noreload' in args:
+                return 'web'
+        return 'management'
+    return 'other'
+
+
+def _warm_up_model(model):
+    """以一張空白影像執行一次推論，避免第一個實際請求承擔冷啟動成本。"""
+    import numpy as np
+    imgsz = getattr(settings, 'YOLO_MODEL_IMGSZ', 640)
+    dummy_frame = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    model(dummy_frame, verbose=False)
+
+
+def ensure_yolo_model_loaded(role=None):
+    """
+    載入 YOLO 模型 (每個 process 只嘗試一次，執行緒安全)。
+    載入成功後若 YOLO_WARMUP_ON_LOAD 為 True，會執行一次暖機推論。
+    """
+    global yolo_model, yolo_model_weights_hash, yolo_model_backend, yolo_model_load_stats # 宣告我們要修改的是全局變數
+    global _model_load_attempted
 
-        # 這個檢查是為了避免在開發伺服器自動重載時重複執行載入程式碼
-        if yolo_model is None:
-            # --- 重要：設定你的模型檔案路徑 ---
-            # 務必將下面的路徑換成你 'best.pt' 檔案的 **實際存放路徑**
-            # 建議將模型檔案放在專案內的某個資料夾（例如根目錄下的 'ml_models' 資料夾）
-            # 或者提供絕對路徑。
+    if yolo_model is not None or _model_load_attempted:
+        return yolo_model
 
-            # 範例 1: 模型放在專案根目錄下的 'ml_models' 資料夾中
-            model_path = os.path.join(settings.BASE_DIR, 'yolo', 'best.pt')
+    with _model_lock:
+        if yolo_model is not None or _model_load_attempted:
+            return yolo_model
+        _model_load_attempted = True
 
-            # --- 模型載入 ---
+        role = role or detect_process_role()
+
+        # 模型放在專案根目錄下的 'yolo' 資料夾中
+        model_path = os.path.join(settings.BASE_DIR, 'yolo', 'best.pt')
+        backend = getattr(settings, 'YOLO_INFERENCE_BACKEND', 'pytorch')
+
+        # --- 模型載入 ---
+        print(f"------------------------------------")
+        print(f"準備載入 YOLO 模型於: {model_path} (backend={backend}, role={role}, pid={os.getpid()})")
+
+        if not os.path.exists(model_path):
+            print(f">>> 錯誤：模型檔案未找到於 {model_path}")
+            print(f">>> 請確認 'detector/apps.py' 中的 'model_path' 設定是否正確。")
             print(f"------------------------------------")
-            print(f"準備載入 YOLO 模型於: {model_path}")
-
-            if os.path.exists(model_path):
-                try:
-                    # 載入 YOLO 模型
-                    yolo_model = YOLO(model_path)
-                    print(f">>> YOLO 模型載入成功! ({model_path})")
-                except Exception as e:
-                    print(f">>> 載入 YOLO 模型時發生嚴重錯誤: {e}")
-                    yolo_model = None # 載入失敗，設為 None
-            else:
-                print(f">>> 錯誤：模型檔案未找到於 {model_path}")
-                print(f">>> 請確認 'detector/apps.py' 中的 'model_path' 設定是否正確。")
-                yolo_model = None # 檔案不存在，設為 None
+            return None
 
+        try:
+            # 載入 YOLO 模型 (非 PyTorch 後端會使用/建立快取的匯出檔)
+            from .model_backends import load_yolo_model
+            load_started = time.perf_counter()
+            model, weights_hash, backend_in_use = load_yolo_model(
+                model_path,
+                backend=backend,
+                imgsz=getattr(settings, 'YOLO_MODEL_IMGSZ', 640),
+            )
+            load_seconds = time.perf_counter() - load_started
+            print(f">>> YOLO 模型載入成功! ({model_path}, backend={backend_in_use}, {load_seconds:.2f}s)")
+        except Exception as e:
+            print(f">>> 載入 YOLO 模型時發生嚴重錯誤: {e}")
             print(f"------------------------------------")
+            return None
+
+        warmup_seconds = None
+        if getattr(settings, 'YOLO_WARMUP_ON_LOAD', True):
+            try:
+                warmup_started = time.perf_counter()
+                _warm_up_model(model)
+                warmup_seconds = time.perf_counter() - warmup_started
+                print(f">>> YOLO 模型暖機完成 ({warmup_seconds:.2f}s)")
+            except Exception as e:
+                # 暖機失敗不影響模型可用性，實際推論時仍會再嘗試
+                print(f">>> YOLO 模型暖機失敗 (略過): {e}")
+
+        yolo_model_weights_hash = weights_hash
+        yolo_model_backend = backend_in_use
+        yolo_model_load_stats = {
+            'role': role,
+            'pid': os.getpid(),
+            'backend': backend_in_use,
+            'load_seconds': round(load_seconds, 3),
+            'warmup_seconds': round(warmup_seconds, 3) if warmup_seconds is not None else None,
+        }
+        yolo_model = model
+        print(f"------------------------------------")
+        return yolo_model
+
+
+def get_yolo_model():
+    """取得 YOLO 模型；若此 process 尚未載入，會在第一次呼叫時延遲載入。"""
+    if yolo_model is not None:
+        return yolo_model
+    return ensure_yolo_model_loaded()
+
 
-        # else: # 可選：如果 yolo_model 不是 None，表示已載入或在另一個進程載入
-        #     print("YOLO model already loaded or loading in another process.")
\ No newline at end of file
+class DetectorConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'detector'
+
+    def ready(self):
+        """
+        Django App 準備就緒時會執行的函數。
+        只有實際處理推論的 web process 會在這裡預先載入模型 (DETECTOR_ASYNC_UPLOADS 開啟時不載入)；
+        celery worker 由 detector_project/celery.py 的 worker_process_init 在每個子 process 載入
+        (避免在 fork 前初始化 torch 執行緒池)；
+        migrate、celery beat 等其他 process 則完全不載入 (需要時由 get_yolo_model() 延遲載入)。
+        載入前先依 process 並行數設定推論執行緒數 (見 cpu_scheduler.py)。
+        """
+        role = detect_process_role()
+        if role == 'web':
+            from .cpu_scheduler import configure_inference_process
+            configure_inference_process(role)
+            # 非同步上傳時網頁上傳由 worker 推論，web 不預先載入模型
+            # (/api/process/ 仍在 web 同步推論，第一次呼叫時由 get_yolo_model() 延遲載入)
+            if not getattr(settings, 'DETECTOR_ASYNC_UPLOADS', False):
+                ensure_yolo_model_loaded(role=role)
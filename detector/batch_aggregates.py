@@ -0,0 +1,181 @@
+# detector/batch_aggregates.py
+# ------------------------------------------------
+# 批次統計的增量彙總：子任務完成時把結果以原子遞增累加到資料庫，
+# 彙總任務與批次詳情頁只需讀取這些累計值 (處理中也能看到即時摘要)。
+# ------------------------------------------------
+import logging
+from django.db import IntegrityError, transaction
+from django.db.models import F, Count, Q, Sum
+from .models import BatchDetectionJob, BatchClassStatistic, DetectionRecord, DetectionBox
+
+logger = logging.getLogger(__name__)
+
+HEALTHY_CLASS = 'healthy'
+
+
+def fold_batch_results(batch_job_id, succeeded_records=(), failed_count=0):
+    """
+    將一組已成功儲存的 DetectionRecord 與失敗數累加到批次統計。
+
+    先在記憶體中合併這一組的增量，再以少量 UPDATE ... SET x = x + n 寫入，
+    多個 worker 同時更新同一批次也不會互相覆蓋。
+    批次計數與類別統計在同一個交易內寫入：任何一步失敗都不會留下只加了一半的統計
+    (呼叫端可以安全地重新累加)。
+    """
+    succeeded_records = list(succeeded_records)
+    severity_sum, severity_count = 0.0, 0
+    total_boxes, healthy_boxes = 0, 0
+    class_deltas = {}  # class_name -> [detection_count, severity_sum, image_count]
+
+    for record in succeeded_records:
+        detections = record.results_data if isinstance(record.results_data, list) else []
+        if record.severity_score is not None:
+            severity_sum += float(record.severity_score)
+            severity_count += 1
+
+        counts = {}
+        for item in detections:
+            cls = item.get('class', 'unknown')
+            counts[cls] = counts.get(cls, 0) + 1
+        for cls, count in counts.items():
+            delta = class_deltas.setdefault(cls, [0, 0.0, 0])
+            delta[0] += count
+            if record.severity_score is not None:
+                delta[1] += float(record.severity_score)
+                delta[2] += 1
+        total_boxes += len(detections)
+        healthy_boxes += counts.get(HEALTHY_CLASS, 0)
+
+    with transaction.atomic():
+        for cls, (count, cls_severity_sum, image_count) in class_deltas.items():
+            _increment_class_statistic(batch_job_id, cls, count, cls_severity_sum, image_count)
+        # 完成計數最後寫入：_maybe_finalize_batch 以這些計數判斷批次是否完成
+        BatchDetectionJob.objects.filter(id=batch_job_id).update(
+            images_processed_successfully=F('images_processed_successfully') + len(succeeded_records),
+            images_failed_to_process=F('images_failed_to_process') + failed_count,
+            severity_score_sum=F('severity_score_sum') + severity_sum,
+            severity_score_count=F('severity_score_count') + severity_count,
+            total_boxes=F('total_boxes') + total_boxes,
+            healthy_boxes=F('healthy_boxes') + healthy_boxes,
+        )
+
+
+def _increment_class_statistic(batch_job_id, class_name, count, severity_sum, image_count):
+    """原子遞增單一類別的統計；第一次出現時建立資料列 (處理併發建立的唯一鍵衝突)。"""
+    increments = dict(
+        detection_count=F('detection_count') + count,
+        severity_sum=F('severity_sum') + severity_sum,
+        image_count=F('image_count') + image_count,
+    )
+    qs = BatchClassStatistic.objects.filter(batch_job_id=batch_job_id, class_name=class_name)
+    if qs.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            BatchClassStatistic.objects.create(
+                batch_job_id=batch_job_id, class_name=class_name,
+                detection_count=count, severity_sum=severity_sum, image_count=image_count,
+            )
+    except IntegrityError:
+        # 其他 worker 剛建立了同一列，改為遞增
+        qs.update(**increments)
+
+
+def compute_batch_statistics_sql(batch_job_id):
+    """
+    以 SQL 彙總 DetectionBox 計算批次的框數、類別與嚴重程度統計 (不需在 Python 中掃描 results_data)。
+    每個類別的嚴重程度只計算一次含有該類別的圖片，與 fold_batch_results 的定義相同。
+
+    Returns:
+        dict: total_boxes, healthy_boxes, severity_score_sum, severity_score_count,
+              classes (class_name -> {'detection_count', 'severity_sum', 'image_count'})。
+    """
+    boxes = DetectionBox.objects.filter(record__batch_job_id=batch_job_id)
+    box_totals = boxes.aggregate(
+        total_boxes=Count('id'),
+        healthy_boxes=Count('id', filter=Q(class_name=HEALTHY_CLASS)),
+    )
+
+    # 成功且有檢測結果的紀錄都會有檢測框；錯誤紀錄沒有檢測框，不列入嚴重程度統計
+    scored_records = DetectionRecord.objects.filter(batch_job_id=batch_job_id, severity_score__isnull=False)
+    severity = scored_records.filter(id__in=boxes.values('record_id')).aggregate(
+        severity_score_sum=Sum('severity_score'), severity_score_count=Count('id'),
+    )
+
+    classes = {}
+    for row in boxes.values('class_name').annotate(detection_count=Count('id')).order_by('-detection_count'):
+        class_severity = scored_records.filter(
+            id__in=boxes.filter(class_name=row['class_name']).values('record_id')
+        ).aggregate(severity_sum=Sum('severity_score'), image_count=Count('id'))
+        classes[row['class_name']] = {
+            'detection_count': row['detection_count'],
+            'severity_sum': class_severity['severity_sum'] or 0.0,
+            'image_count': class_severity['image_count'],
+        }
+
+    return {
+        'total_boxes': box_totals['total_boxes'],
+        'healthy_boxes': box_totals['healthy_boxes'],
+        'severity_score_sum': severity['severity_score_sum'] or 0.0,
+        'severity_score_count': severity['severity_score_count'],
+        'classes': classes,
+    }
+
+
+def rebuild_batch_aggregates(batch_job_id):
+    """
+    以 compute_batch_statistics_sql 的結果覆寫批次的框數 / 嚴重程度 / 類別統計
+    (成功與失敗圖片數不受影響)。用於彙總時校正增量統計，或補算舊批次。
+    """
+    stats = compute_batch_statistics_sql(batch_job_id)
+    with transaction.atomic():
+        BatchDetectionJob.objects.filter(id=batch_job_id).update(
+            total_boxes=stats['total_boxes'],
+            healthy_boxes=stats['healthy_boxes'],
+            severity_score_sum=stats['severity_score_sum'],
+            severity_score_count=stats['severity_score_count'],
+        )
+        BatchClassStatistic.objects.filter(batch_job_id=batch_job_id).exclude(class_name__in=stats['classes']).delete()
+        for class_name, values in stats['classes'].items():
+            BatchClassStatistic.objects.update_or_create(
+                batch_job_id=batch_job_id, class_name=class_name, defaults=values,
+            )
+    return stats
+
+
+def build_batch_summary(batch):
+    """
+    由批次的累計統計產生摘要 dict (不需讀取任何辨識紀錄)。
+    """
+    success = batch.images_processed_successfully
+    fail = batch.images_failed_to_process
+    total_boxes = batch.total_boxes
+    healthy_boxes = batch.healthy_boxes
+
+    avg_score = round(batch.severity_score_sum / batch.severity_score_count, 3) if batch.severity_score_count else None
+    disease_statistics = {}
+    for stat in batch.class_statistics.all().order_by('-detection_count'):
+        avg_sev = round(stat.severity_sum / stat.image_count, 2) if stat.image_count else None
+        disease_statistics[stat.class_name] = {"count": stat.detection_count, "average_severity": avg_sev}
+
+    healthy_ratio = round(healthy_boxes / total_boxes, 2) if total_boxes else None
+    if disease_statistics.get('angular leaf spot', {}).get('count', 0) > 0:
+        recommendations = "建議對檢測到角斑病的區域進行觀察，並考慮預防性措施。"
+    else:
+        recommendations = "田區狀況良好，持續觀察即可。"
+    overall_status_guess = "多數健康" if healthy_boxes > (total_boxes - healthy_boxes) else "需注意病害情況"
+
+    summary = {
+        "stats": {
+            "檢測到健康植株的框數": healthy_boxes,
+            "總檢測框數": total_boxes,
+            "成功處理圖片數": success,
+            "處理失敗圖片數": fail,
+        },
+        "overall_status_guess": overall_status_guess,
+        "disease_statistics": disease_statistics,
+        "healthy_plants_ratio": healthy_ratio,
+        "average_severity_score": avg_score,
+        "recommendations": recommendations,
+    }
+    return summary
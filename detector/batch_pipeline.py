@@ -0,0 +1,133 @@
+# detector/batch_pipeline.py
+# ------------------------------------------------
+# 批次任務的管線化 (pipelined) 處理：
+#   下載 (背景執行緒預取) -> 推論 (主執行緒) -> 上傳 (背景執行緒) -> 寫入資料庫 (主執行緒)
+# 讓 CPU 在等待 S3 網路 I/O 時仍能持續推論。
+# 預取與待上傳的數量皆有上限，確保記憶體用量有界。
+# ------------------------------------------------
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from django.conf import settings
+from .services import prepare_image_batch, upload_record_images, save_detection_record
+
+pipeline_logger = logging.getLogger(__name__)
+
+
+def get_pipeline_options():
+    """從 settings 讀取管線參數。"""
+    return {
+        'micro_batch_size': max(1, getattr(settings, 'BATCH_PIPELINE_MICRO_BATCH_SIZE', 4)),
+        'prefetch_workers': max(1, getattr(settings, 'BATCH_PIPELINE_PREFETCH_WORKERS', 4)),
+        'max_prefetched': max(0, getattr(settings, 'BATCH_PIPELINE_MAX_PREFETCHED', 8)),
+        'upload_workers': max(1, getattr(settings, 'BATCH_PIPELINE_UPLOAD_WORKERS', 4)),
+        'max_pending_uploads': max(1, getattr(settings, 'BATCH_PIPELINE_MAX_PENDING_UPLOADS', 8)),
+    }
+
+
+def run_pipelined_batch(s3_keys, fetch_image, build_item, confidence=0.5,
+                        micro_batch_size=4, prefetch_workers=4, max_prefetched=8,
+                        upload_workers=4, max_pending_uploads=8, log_label='', outcomes=None):
+    """
+    以管線方式處理一組圖片。
+
+    Args:
+        s3_keys: 要處理的 key 列表 (依序處理)。
+        fetch_image: callable(key) -> image_bytes；下載或驗證失敗時拋出例外。
+                     會在背景執行緒中執行，不可存取資料庫。
+        build_item: callable(key, image_bytes) -> (image_bytes, file_ext, DetectionRecord)。
+        confidence: YOLO 推論的信心水準閾值。
+        micro_batch_size: 每次送入模型的圖片數。
+        prefetch_workers: 下載執行緒數。
+        max_prefetched: 除了目前的 micro-batch 之外，最多預先下載的圖片數。
+        upload_workers: 上傳執行緒數。
+        max_pending_uploads: 最多同時等待上傳完成的圖片數，超過時主執行緒會等待。
+        outcomes: 選填，結果寫入此 dict (中途拋出例外時呼叫端仍可取得已完成的圖片)。
+
+    Returns:
+        dict: key -> (record 或 None, error 或 None)。
+        record 為 None 代表下載/驗證失敗；error 為 None 代表成功儲存。
+    """
+    outcomes = {} if outcomes is None else outcomes
+    if not s3_keys:
+        return outcomes
+
+    prefetch_limit = micro_batch_size + max_prefetched
+
+    with ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='pipeline-fetch') as fetch_pool, \
+            ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='pipeline-upload') as upload_pool:
+
+        download_futures = {}   # key -> Future[image_bytes]，尚未被推論階段取用
+        pending_uploads = {}    # Future -> (key, record)
+        next_to_submit = 0
+
+        def top_up_prefetch():
+            nonlocal next_to_submit
+            while next_to_submit < len(s3_keys) and len(download_futures) < prefetch_limit:
+                key = s3_keys[next_to_submit]
+                download_futures[key] = fetch_pool.submit(fetch_image, key)
+                next_to_submit += 1
+
+        def finish_uploads(done):
+            # 上傳完成後在主執行緒寫入資料庫
+            for future in done:
+                key, record = pending_uploads.pop(future)
+                try:
+                    future.result()
+                    outcomes[key] = (save_detection_record(record), None)
+                except Exception as e:
+                    pipeline_logger.error(f"{log_label}: 上傳/儲存失敗 ({key}): {e}", exc_info=True)
+                    outcomes[key] = (record, e)
+
+        for start in range(0, len(s3_keys), micro_batch_size):
+            batch_keys = s3_keys[start:start + micro_batch_size]
+            top_up_prefetch()
+
+            # 1) 取得此 micro-batch 的下載結果
+            image_items, item_keys = [], []
+            for key in batch_keys:
+                future = download_futures.pop(key)
+                try:
+                    image_bytes = future.result()
+                except Exception as e:
+                    outcomes[key] = (None, e)
+                    continue
+                image_items.append(build_item(key, image_bytes))
+                item_keys.append(key)
+            # 立即補上預取，讓下載與推論重疊
+            top_up_prefetch()
+
+            if not image_items:
+                continue
+
+            # 2) 推論 (主執行緒)
+            try:
+                prepared = prepare_image_batch(image_items, confidence)
+            except Exception as e:
+                pipeline_logger.error(f"{log_label}: 批次推論錯誤: {e}", exc_info=True)
+                for key, (_, _, record) in zip(item_keys, image_items):
+                    if record._state.adding:
+                        record.results_data = {'error': f'YOLO inference runtime error: {str(e)}'}
+                        record.save()
+                    outcomes[key] = (record, e)
+                continue
+
+            # 3) 上傳交給背景執行緒；待上傳數量達上限時先等待完成
+            for key, (image_bytes, file_ext, _), (record, error, annotated_bytes, annotated_ext, thumbnails) in zip(
+                    item_keys, image_items, prepared):
+                if error is not None:
+                    record.save()
+                    outcomes[key] = (record, error)
+                    continue
+                while len(pending_uploads) >= max_pending_uploads:
+                    finish_uploads(wait(list(pending_uploads), return_when=FIRST_COMPLETED).done)
+                future = upload_pool.submit(upload_record_images, record, image_bytes, file_ext,
+                                            annotated_bytes, annotated_ext, thumbnails)
+                pending_uploads[future] = (key, record)
+
+            # 順手收集已完成的上傳，盡早寫入資料庫並釋放記憶體
+            finish_uploads([f for f in pending_uploads if f.done()])
+
+        # 4) 等待剩餘上傳完成
+        finish_uploads(wait(list(pending_uploads)).done)
+
+    return outcomes
@@ -0,0 +1,492 @@
+# detector/benchmarking.py
+# ------------------------------------------------
+# 離線端到端基準測試 (python manage.py benchmark_pipeline，設定見 detector_project/settings_benchmark.py)：
+#   - DirectoryS3Client: 以本機目錄模擬批次任務讀取的來源 S3 (可設定每次 GET 的延遲)
+#   - StubYOLOModel:     回傳固定檢測框的假模型 (可設定每張圖片的推論延遲)；也可改用實際的 yolo/best.pt
+#   - synthetic_frame:   合成的 rover 解析度畫面
+#   - StageSampler:      經由 metrics.stage_timer 收集各階段的原始耗時樣本，並在背景取樣該情境期間的 RSS
+# 各情境的結果 (img/s、p50/p95、peak RSS) 輸出為 JSON，可與先前 commit 的結果比較 (compare_reports：
+# 吞吐量、p95 延遲與 peak RSS)。
+# ------------------------------------------------
+import io
+import os
+import platform
+import shutil
+import subprocess
+import threading
+import time
+from collections import defaultdict
+import cv2
+import numpy as np
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.test import override_settings
+from . import apps as detector_apps
+from . import tasks as detector_tasks
+from .metrics import add_stage_observer, remove_stage_observer
+from .models import BatchDetectionJob, DetectionRecord
+from .retention_manager import DataRetentionManager
+from .services import process_image_bytes
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPORT_SCHEMA_VERSION = 2  # 2: 各情境的 peak_rss_mb 改為該情境期間的取樣值 (1 為 process 累計最大值)
+BENCHMARK_BUCKET = 'detector-benchmark'
+# 各情境用於比較的吞吐量欄位 (數值越大越好)
+THROUGHPUT_KEYS = {
+    'process_image_bytes': 'images_per_second',
+    'process_s3_folder_task': 'images_per_second',
+    'retention': 'records_per_second',
+}
+RSS_SAMPLE_INTERVAL = 0.01  # StageSampler 背景取樣 RSS 的間隔 (秒)
+MIN_COMPARED_P95_MS = 1.0  # 基準 p95 低於此值的階段不比較 (計時雜訊大於差異)
+
+
+# ====== 合成圖片 ======
+def synthetic_frame(width, height, seed=0):
+    """產生帶有紋理與標註框的合成畫面 (純雜訊無法代表實際的壓縮率)。"""
+    rng = np.random.default_rng(seed)
+    # 低頻色塊 (放大的小型雜訊) + 細部雜訊，近似葉片與土壤的紋理
+    coarse = rng.integers(0, 255, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    frame = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    frame = cv2.add(frame, rng.integers(0, 24, size=frame.shape, dtype=np.uint8))
+    for _ in range(12):
+        x1, y1 = int(rng.integers(0, width - 200)), int(rng.integers(0, height - 200))
+        cv2.rectangle(frame, (x1, y1), (x1 + 180, y1 + 160), (0, 0, 255), 3)
+        cv2.putText(frame, 'angular leaf spot 0.87', (x1, y1 - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    return frame
+
+
+def synthetic_jpegs(count, width, height, quality=90):
+    """產生 count 張內容各不相同的 JPEG bytes (與 rover 上傳的格式相同)。"""
+    return [cv2.imencode('.jpg', synthetic_frame(width, height, seed=seed),
+                         [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            for seed in range(count)]
+
+
+# ====== 來源 S3 ======
+class DirectoryS3Client:
+    """
+    以本機目錄模擬 boto3 S3 client (root/<bucket>/<key>)。
+    只實作批次任務用到的 put_object / get_object / get_paginator('list_objects_v2')。
+    """
+
+    def __init__(self, root, get_latency_ms=0.0):
+        self.root = root
+        self.get_latency = max(0.0, get_latency_ms) / 1000
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body)
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if self.get_latency:
+            time.sleep(self.get_latency)
+        try:
+            with open(self._path(Bucket, Key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': Key}}, 'GetObject')
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'ContentType': 'image/jpeg'}
+
+    def list_keys(self, bucket, prefix):
+        bucket_root = os.path.join(self.root, bucket)
+        keys = []
+        for dirpath, _, filenames in os.walk(bucket_root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, bucket_root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append((key, os.path.getsize(path)))
+        return sorted(keys)
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(operation_name)
+        return _DirectoryPaginator(self)
+
+
+class _DirectoryPaginator:
+    PAGE_SIZE = 1000  # 與 ListObjectsV2 每頁上限相同
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix='', **kwargs):
+        keys = self.client.list_keys(Bucket, Prefix)
+        for start in range(0, len(keys), self.PAGE_SIZE):
+            yield {'Contents': [{'Key': key, 'Size': size} for key, size in keys[start:start + self.PAGE_SIZE]]}
+
+
+# ====== 假模型 ======
+class _StubTensor:
+    """_collect_detections 用到的 torch.Tensor 介面 (item / tolist / 索引)。"""
+
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def item(self):
+        return float(self.values.reshape(-1)[0])
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def __getitem__(self, index):
+        return _StubTensor(self.values[index])
+
+
+class _StubBox:
+    def __init__(self, class_id, confidence, xyxy):
+        self.cls = _StubTensor([class_id])
+        self.conf = _StubTensor([confidence])
+        self.xyxy = _StubTensor([xyxy])
+
+
+class _StubResult:
+    def __init__(self, image, boxes, names):
+        self.orig_img = image
+        self.boxes = boxes
+        self.names = names
+
+    def plot(self):
+        """與 ultralytics Results.plot() 相同：回傳畫上框與標籤的 BGR 影像複本。"""
+        annotated = self.orig_img.copy()
+        for box in self.boxes:
+            x1, y1, x2, y2 = (int(v) for v in box.xyxy[0].tolist())
+            label = f"{self.names[int(box.cls.item())]} {box.conf.item():.2f}"
+            cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 0, 255), 3)
+            cv2.putText(annotated, label, (x1, max(0, y1 - 6)), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        return annotated
+
+
+class StubYOLOModel:
+    """
+    不需要 ultralytics 的假模型：每張圖片回傳固定數量的檢測框，並以 sleep 模擬推論耗時
+    (批次呼叫時為 latency_ms * 圖片數)。
+    """
+    names = {0: 'angular leaf spot', 1: 'healthy'}
+
+    def __init__(self, latency_ms=50.0, boxes_per_image=3):
+        self.latency = max(0.0, latency_ms) / 1000
+        self.boxes_per_image = boxes_per_image
+
+    def _boxes(self, image):
+        height, width = image.shape[:2]
+        boxes = []
+        for i in range(self.boxes_per_image):
+            x1, y1 = width * (i + 1) // (self.boxes_per_image + 2), height // 4
+            boxes.append(_StubBox(i % len(self.names), 0.9 - 0.1 * i,
+                                  [x1, y1, x1 + width // 10, y1 + height // 8]))
+        return boxes
+
+    def __call__(self, source, conf=0.25, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        if self.latency:
+            time.sleep(self.latency * len(frames))
+        return [_StubResult(frame, [box for box in self._boxes(frame) if box.conf.item() >= conf], self.names)
+                for frame in frames]
+
+
+def install_model(model, backend_name):
+    """以指定的模型取代此 process 的 YOLO 模型 (detector.apps 的全域變數)。"""
+    detector_apps.yolo_model = model
+    detector_apps.yolo_model_backend = backend_name
+    detector_apps.yolo_model_weights_hash = f"benchmark-{backend_name}"
+
+
+# ====== 樣本收集 ======
+def current_rss_bytes():
+    """目前的 RSS (Linux 讀取 /proc/self/statm)；無法取得時回傳 None。"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss_bytes():
+    """此 process 至今的最大 RSS (不會下降；各情境的 peak 請用 StageSampler)。"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if platform.system() == 'Darwin' else max_rss * 1024  # Linux 單位為 KB
+
+
+def _mb(num_bytes):
+    return round(num_bytes / (1024 * 1024), 1) if num_bytes is not None else None
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def latency_summary(seconds_list):
+    """耗時樣本 (秒) -> {count, mean_ms, p50_ms, p95_ms, total_ms}。"""
+    if not seconds_list:
+        return {'count': 0}
+    return {
+        'count': len(seconds_list),
+        'mean_ms': round(1000 * sum(seconds_list) / len(seconds_list), 2),
+        'p50_ms': round(1000 * _percentile(seconds_list, 0.50), 2),
+        'p95_ms': round(1000 * _percentile(seconds_list, 0.95), 2),
+        'total_ms': round(1000 * sum(seconds_list), 1),
+    }
+
+
+class StageSampler:
+    """
+    在 with 區塊內收集 stage_timer 的每一筆耗時，以及各階段結束時的 RSS 最大值
+    (上傳等階段可能在背景執行緒中結束，因此以 lock 保護)。
+    另有背景執行緒每 RSS_SAMPLE_INTERVAL 秒取樣一次 RSS，peak_rss / start_rss 只反映這個區塊，
+    不受先前情境的記憶體高峰影響 (ru_maxrss 是整個 process 的累計最大值)。
+    """
+
+    def __init__(self, rss_interval=RSS_SAMPLE_INTERVAL):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.stage_peak_rss = {}
+        self.start_rss = None
+        self.peak_rss = None
+        self._rss_interval = rss_interval
+        self._stop = threading.Event()
+        self._poller = None
+
+    def _record_rss(self, rss):
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def _poll_rss(self):
+        while not self._stop.wait(self._rss_interval):
+            rss = current_rss_bytes()
+            with self._lock:
+                self._record_rss(rss)
+
+    def __call__(self, stage, seconds):
+        rss = current_rss_bytes()
+        with self._lock:
+            self.samples[stage].append(seconds)
+            self._record_rss(rss)
+            if rss is not None and rss > self.stage_peak_rss.get(stage, 0):
+                self.stage_peak_rss[stage] = rss
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss_bytes()
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._poll_rss, name='benchmark-rss', daemon=True)
+        self._poller.start()
+        add_stage_observer(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        remove_stage_observer(self)
+        self._stop.set()
+        self._poller.join()
+        with self._lock:
+            self._record_rss(current_rss_bytes())
+        return False
+
+    def rss_summary(self):
+        """此區塊的 peak RSS 與相對於開始時的增量 (MB)。"""
+        growth = self.peak_rss - self.start_rss if self.peak_rss is not None and self.start_rss is not None else None
+        return {'peak_rss_mb': _mb(self.peak_rss), 'rss_growth_mb': _mb(growth)}
+
+    def summary(self):
+        return {stage: {**latency_summary(samples), 'peak_rss_mb': _mb(self.stage_peak_rss.get(stage))}
+                for stage, samples in sorted(self.samples.items())}
+
+
+# ====== 情境 ======
+def bench_process_image_bytes(images, confidence=0.5):
+    """手動上傳路徑：依序呼叫 process_image_bytes (推論 + 編碼 + 上傳 + 寫入資料庫)。"""
+    process_image_bytes(images[0], '.jpg', confidence, DetectionRecord())  # 暖機 (不計入)
+    latencies = []
+    with StageSampler() as sampler:
+        started_at = time.perf_counter()
+        for image_bytes in images:
+            call_started_at = time.perf_counter()
+            process_image_bytes(image_bytes, '.jpg', confidence, DetectionRecord())
+            latencies.append(time.perf_counter() - call_started_at)
+        wall_seconds = time.perf_counter() - started_at
+    return {
+        'images': len(images),
+        'wall_seconds': round(wall_seconds, 3),
+        'images_per_second': round(len(images) / wall_seconds, 2),
+        'latency': latency_summary(latencies),
+        'stages': sampler.summary(),
+        **sampler.rss_summary(),
+    }
+
+
+def bench_s3_folder_task(images, s3_client, prefix='rover/benchmark'):
+    """批次路徑：把圖片放到 DirectoryS3Client，以 eager 模式執行 process_s3_folder_task (含子任務與彙總)。"""
+    for index, image_bytes in enumerate(images):
+        s3_client.put_object(Bucket=BENCHMARK_BUCKET, Key=f"{prefix}/{index:06d}.jpg", Body=image_bytes)
+
+    original_get_s3_client = detector_tasks.get_s3_client
+    detector_tasks.get_s3_client = lambda: s3_client
+    try:
+        with StageSampler() as sampler:
+            started_at = time.perf_counter()
+            result = detector_tasks.process_s3_folder_task.apply(args=[BENCHMARK_BUCKET, prefix]).get()
+            wall_seconds = time.perf_counter() - started_at
+    finally:
+        detector_tasks.get_s3_client = original_get_s3_client
+
+    batch = BatchDetectionJob.objects.get(id=result['batch_id'])
+    processed = batch.images_processed_successfully + batch.images_failed_to_process
+    return {
+        'images': len(images),
+        'images_succeeded': batch.images_processed_successfully,
+        'images_failed': batch.images_failed_to_process,
+        'batch_status': batch.status,
+        'wall_seconds': round(wall_seconds, 3),
+        'images_per_second': round(processed / wall_seconds, 2),
+        'stages': sampler.summary(),
+        **sampler.rss_summary(),
+    }
+
+
+def _count_files(root):
+    return sum(len(filenames) for _, _, filenames in os.walk(root)) if os.path.isdir(root) else 0
+
+
+def bench_retention():
+    """清理路徑：保留數量設為 0，以 DataRetentionManager 刪除前面情境建立的所有紀錄、批次與圖片。"""
+    records_before = DetectionRecord.objects.count()
+    files_before = _count_files(settings.MEDIA_ROOT)
+    manager = DataRetentionManager()
+    with override_settings(MANUAL_RECORDS_TO_KEEP=0, BATCH_JOBS_TO_KEEP_BY_COUNT=0), StageSampler() as sampler:
+        started_at = time.perf_counter()
+        manual_deleted = manager.run_immediate_manual_cleanup()
+        batches_deleted = manager.cleanup_batch_jobs_by_count(log_prefix="Benchmark")
+        wall_seconds = time.perf_counter() - started_at
+    records_deleted = records_before - DetectionRecord.objects.count()
+    return {
+        'records': records_deleted,
+        'manual_records': manual_deleted,
+        'batch_jobs': batches_deleted,
+        'files_deleted': files_before - _count_files(settings.MEDIA_ROOT),
+        'wall_seconds': round(wall_seconds, 3),
+        'records_per_second': round(records_deleted / wall_seconds, 1) if wall_seconds > 0 else None,
+        **sampler.rss_summary(),
+    }
+
+
+# ====== 報告 ======
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=5, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(scenarios, image_count, width, height, model_name, confidence=0.5,
+                  pipeline=False, tiled=False, reduced_decode=False, s3_latency_ms=0.0, stub_latency_ms=None):
+    """
+    依序執行指定的情境 (process_image_bytes / process_s3_folder_task / retention) 並回傳報告 dict。
+    呼叫端需先安裝模型 (install_model) 並準備好空的資料庫與 MEDIA_ROOT。
+    """
+    images = synthetic_jpegs(image_count, width, height)
+    source_root = os.path.join(settings.BENCHMARK_WORK_DIR, 'source-s3')
+    shutil.rmtree(source_root, ignore_errors=True)
+    s3_client = DirectoryS3Client(source_root, get_latency_ms=s3_latency_ms)
+
+    results = {}
+    with override_settings(BATCH_PIPELINE_ENABLED=pipeline, YOLO_TILED_INFERENCE=tiled,
+                           YOLO_REDUCED_DECODE=reduced_decode):
+        if 'process_image_bytes' in scenarios:
+            results['process_image_bytes'] = bench_process_image_bytes(images, confidence)
+        if 'process_s3_folder_task' in scenarios:
+            results['process_s3_folder_task'] = bench_s3_folder_task(images, s3_client)
+    if 'retention' in scenarios:
+        results['retention'] = bench_retention()
+
+    return {
+        'schema_version': REPORT_SCHEMA_VERSION,
+        'git_commit': git_commit(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'config': {
+            'images': image_count,
+            'width': width,
+            'height': height,
+            'model': model_name,
+            'stub_latency_ms': stub_latency_ms,
+            'confidence': confidence,
+            'batch_pipeline': pipeline,
+            'tiled_inference': tiled,
+            'reduced_decode': reduced_decode,
+            'batch_inference_chunk_size': getattr(settings, 'BATCH_INFERENCE_CHUNK_SIZE', None),
+            's3_latency_ms': s3_latency_ms,
+        },
+        'scenarios': results,
+        'process_peak_rss_mb': _mb(peak_rss_bytes()),
+    }
+
+
+def _p95_metrics(scenario_report):
+    """情境的 p95 延遲 (ms)：整體延遲 (若有) 與各階段。"""
+    metrics = {}
+    if 'p95_ms' in scenario_report.get('latency', {}):
+        metrics['latency.p95_ms'] = scenario_report['latency']['p95_ms']
+    for stage, stage_report in scenario_report.get('stages', {}).items():
+        if 'p95_ms' in stage_report:
+            metrics[f'{stage}.p95_ms'] = stage_report['p95_ms']
+    return metrics
+
+
+def compare_reports(baseline, current, max_regression_pct, max_p95_regression_pct=None, max_rss_regression_pct=None):
+    """
+    比較兩份報告各情境的吞吐量 (越大越好)、p95 延遲與 peak RSS (越小越好)。
+    未指定 max_p95_regression_pct / max_rss_regression_pct 時沿用 max_regression_pct。
+    schema_version 1 的報告沒有各情境的 peak RSS，不比較 RSS。
+
+    Returns:
+        (rows, regressions)：rows 為 (情境, 指標, 基準值, 目前值, 變化百分比)；
+        regressions 為退步超過門檻的 '情境 指標'。
+    """
+    max_p95_regression_pct = max_regression_pct if max_p95_regression_pct is None else max_p95_regression_pct
+    max_rss_regression_pct = max_regression_pct if max_rss_regression_pct is None else max_rss_regression_pct
+    compare_rss = baseline.get('schema_version', 1) >= 2
+    rows, regressions = [], []
+
+    def compare(scenario, metric, before, after, higher_is_better, threshold_pct):
+        if not before or after is None:
+            return
+        change_pct = (after - before) / before * 100
+        rows.append((scenario, metric, before, after, round(change_pct, 1)))
+        if (-change_pct if higher_is_better else change_pct) > threshold_pct:
+            regressions.append(f"{scenario} {metric}")
+
+    for scenario, key in THROUGHPUT_KEYS.items():
+        before_report = baseline.get('scenarios', {}).get(scenario)
+        after_report = current.get('scenarios', {}).get(scenario)
+        if not before_report or not after_report:
+            continue
+        compare(scenario, key, before_report.get(key), after_report.get(key), True, max_regression_pct)
+
+        after_p95 = _p95_metrics(after_report)
+        for metric, before in _p95_metrics(before_report).items():
+            if before >= MIN_COMPARED_P95_MS:
+                compare(scenario, metric, before, after_p95.get(metric), False, max_p95_regression_pct)
+
+        if compare_rss:
+            compare(scenario, 'peak_rss_mb', before_report.get('peak_rss_mb'), after_report.get('peak_rss_mb'),
+                    False, max_rss_regression_pct)
+    return rows, regressions
@@ -0,0 +1,176 @@
+# detector/bulk_delete.py
+# ------------------------------------------------
+# 資料保留清理的批次刪除引擎 (取代 queryset.delete() 的逐筆 cascade + django-cleanup 逐檔 DELETE)：
+#   1. 以 keyset (id) 分段取出要刪除的紀錄與其圖片檔名 (每段 RETENTION_DELETE_CHUNK_SIZE 筆)
+#   2. 每段在一個 transaction 中先刪子資料表 (DetectionBox)，再以單一 DELETE 刪除紀錄
+#   3. 圖片以 S3 DeleteObjects (每次最多 1000 個 key) 在執行緒池中刪除，與下一段的資料庫刪除重疊
+# 先刪資料庫再刪檔案：檔案刪除失敗只會留下孤兒物件 (記錄在 log)，不會留下指向不存在檔案的紀錄。
+# ------------------------------------------------
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from .media_urls import invalidate_presigned_urls
+from .models import DetectionRecord, DetectionBox, BatchClassStatistic, BatchDetectionJob
+from .s3_originals import storage_key
+
+logger = logging.getLogger(__name__)
+
+S3_DELETE_OBJECTS_MAX_KEYS = 1000  # DeleteObjects 單次請求的 key 數上限
+RECORD_FILE_FIELDS = ('original_image', 'annotated_image', 'original_thumbnail', 'annotated_thumbnail')
+
+
+def _delete_s3_keys(client, bucket, keys):
+    """以一次 DeleteObjects (Quiet 模式) 刪除最多 1000 個 key。回傳 (成功數, 失敗數)。"""
+    response = client.delete_objects(
+        Bucket=bucket,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+    )
+    errors = response.get('Errors') or []
+    for error in errors[:5]:
+        logger.warning(f"[批次刪除] 無法刪除 s3://{bucket}/{error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+    return len(keys) - len(errors), len(errors)
+
+
+def _delete_storage_file(storage, name):
+    """非 S3 storage (例如本機 FileSystemStorage) 逐檔刪除。"""
+    storage.delete(name)
+    return 1, 0
+
+
+class StorageObjectDeleter:
+    """
+    在執行緒池中刪除 storage 上的檔案；S3 storage 以 DeleteObjects 每 1000 個 key 一次請求。
+    以 with 使用，離開時等待所有刪除完成。結果累計在 deleted / failed。
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or getattr(settings, 'RETENTION_S3_DELETE_WORKERS', 8)
+        self.deleted = 0
+        self.failed = 0
+        self._executor = None
+        self._futures = []
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.max_workers), thread_name_prefix='s3-delete')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wait()
+        self._executor.shutdown(wait=True)
+        return False
+
+    def submit(self, storage, names):
+        names = [name for name in dict.fromkeys(names) if name]
+        if not names:
+            return
+        invalidate_presigned_urls(storage, names)
+        bucket = getattr(storage, 'bucket_name', None)
+        if bucket:
+            # boto3 client 是執行緒安全的；storage.connection 則是每個執行緒各自建立，因此在這裡先取出
+            client = storage.connection.meta.client
+            keys = [storage_key(storage, name) for name in names]
+            for start in range(0, len(keys), S3_DELETE_OBJECTS_MAX_KEYS):
+                self._futures.append(self._executor.submit(
+                    _delete_s3_keys, client, bucket, keys[start:start + S3_DELETE_OBJECTS_MAX_KEYS]))
+        else:
+            for name in names:
+                self._futures.append(self._executor.submit(_delete_storage_file, storage, name))
+
+    def wait(self):
+        futures, self._futures = self._futures, []
+        for future in futures:
+            try:
+                deleted, failed = future.result()
+            except Exception as e:
+                logger.error(f"[批次刪除] 刪除 storage 檔案失敗: {e}", exc_info=True)
+                deleted, failed = 0, 1
+            self.deleted += deleted
+            self.failed += failed
+
+
+def _empty_stats():
+    return {'batch_jobs': 0, 'records': 0, 'boxes': 0, 'objects_deleted': 0, 'object_errors': 0}
+
+
+def _finish_stats(stats, started_at, deleter, log_prefix):
+    stats['objects_deleted'] += deleter.deleted
+    stats['object_errors'] += deleter.failed
+    elapsed = time.monotonic() - started_at
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['records_per_second'] = round(stats['records'] / elapsed, 1) if elapsed > 0 else None
+    stats['objects_per_second'] = round(stats['objects_deleted'] / elapsed, 1) if elapsed > 0 else None
+    if stats['records'] or stats['batch_jobs']:
+        logger.info(f"{log_prefix} [批次刪除] 完成: {stats}")
+    return stats
+
+
+def _purge_records(queryset, deleter, stats, chunk_size):
+    """以 keyset 分段刪除 queryset 中的紀錄，檔案交給 deleter。"""
+    file_storages = {field_name: DetectionRecord._meta.get_field(field_name).storage
+                     for field_name in RECORD_FILE_FIELDS}
+    last_id = None
+    while True:
+        chunk_qs = queryset.order_by('id')
+        if last_id is not None:
+            chunk_qs = chunk_qs.filter(id__gt=last_id)
+        rows = list(chunk_qs.values_list('id', 'original_image_is_reference', *RECORD_FILE_FIELDS)[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        record_ids = [row[0] for row in rows]
+
+        # 直接 DELETE (不經過 Collector 與 django-cleanup 的逐筆 post_delete)，子資料表先刪
+        with transaction.atomic():
+            boxes_qs = DetectionBox.objects.filter(record_id__in=record_ids)
+            stats['boxes'] += boxes_qs._raw_delete(boxes_qs.db)
+            records_qs = DetectionRecord.objects.filter(id__in=record_ids)
+            stats['records'] += records_qs._raw_delete(records_qs.db)
+
+        names_by_storage = {}
+        for row in rows:
+            for field_name, name in zip(RECORD_FILE_FIELDS, row[2:]):
+                # 引用的來源物件 (BATCH_ORIGINAL_IMAGE_MODE=reference) 不屬於紀錄，不刪除
+                if field_name == 'original_image' and row[1]:
+                    continue
+                if name:
+                    names_by_storage.setdefault(file_storages[field_name], []).append(name)
+        for storage, names in names_by_storage.items():
+            deleter.submit(storage, names)
+
+
+def purge_detection_records(queryset, log_prefix=""):
+    """
+    刪除 queryset 中的 DetectionRecord、其檢測框與 storage 上的圖片 (原圖、標註圖、縮圖)。
+    引用的來源物件 (original_image_is_reference) 不會被刪除。
+
+    Returns:
+        dict: 刪除數量與吞吐量 (records / boxes / objects_deleted / object_errors /
+              elapsed_seconds / records_per_second / objects_per_second)。
+    """
+    chunk_size = max(1, getattr(settings, 'RETENTION_DELETE_CHUNK_SIZE', 1000))
+    stats = _empty_stats()
+    started_at = time.monotonic()
+    with StorageObjectDeleter() as deleter:
+        _purge_records(queryset, deleter, stats, chunk_size)
+    return _finish_stats(stats, started_at, deleter, log_prefix)
+
+
+def purge_batch_jobs(batch_job_ids, log_prefix=""):
+    """
+    刪除多個 BatchDetectionJob：先以 purge_detection_records 的方式分段刪除所有紀錄與圖片，
+    再刪除類別統計與批次本身。回傳格式同 purge_detection_records，另含 batch_jobs。
+    """
+    batch_job_ids = list(batch_job_ids)
+    chunk_size = max(1, getattr(settings, 'RETENTION_DELETE_CHUNK_SIZE', 1000))
+    stats = _empty_stats()
+    started_at = time.monotonic()
+    with StorageObjectDeleter() as deleter:
+        _purge_records(DetectionRecord.objects.filter(batch_job_id__in=batch_job_ids), deleter, stats, chunk_size)
+        with transaction.atomic():
+            BatchClassStatistic.objects.filter(batch_job_id__in=batch_job_ids).delete()
+            # 紀錄已刪除，這裡的 cascade 只會查到處理中途新增的少量紀錄
+            stats['batch_jobs'] = BatchDetectionJob.objects.filter(id__in=batch_job_ids).delete()[1].get(
+                BatchDetectionJob._meta.label, 0)
+    return _finish_stats(stats, started_at, deleter, log_prefix)
@@ -0,0 +1,261 @@
+# detector/cpu_scheduler.py
+# ------------------------------------------------
+# CPU 推論排程：每個推論 process (gunicorn worker / celery prefork 子 process) 預設都會開
+# 「核心數」個 torch / OpenCV 執行緒，-c N 時就有 N x 核心數個執行緒搶 CPU，並行數越高吞吐量反而越低。
+# 這裡依可用 CPU 數與 process 並行數決定每個 process 的執行緒數 (可選擇把每個 celery 子 process
+# 綁定到各自的 CPU)，在模型載入之前套用：
+#   - web:    DetectorConfig.ready()
+#   - worker: detector_project/celery.py 的 worker_init (記錄並行數) 與 worker_process_init (套用)
+# 執行緒數的來源優先順序：INFERENCE_THREADS_PER_PROCESS > calibrate_cpu_scheduler 指令寫入的校正檔 > 自動計算。
+# ------------------------------------------------
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_SCHEMA_VERSION = 1
+WORKER_CONCURRENCY_ENV = 'DETECTOR_WORKER_CONCURRENCY'  # celery 主 process 在 fork 前寫入，子 process 讀取
+# torch (OpenMP / MKL) 與 numpy (OpenBLAS) 在初始化時讀取這些環境變數
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+_applied_config = None
+
+
+# ====== 可用 CPU ======
+def _cgroup_cpu_limit():
+    """容器的 CPU 配額 (cgroup v2 cpu.max 或 v1 cfs quota)；沒有限制時回傳 None。"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def allowed_cpus():
+    """此 process 可使用的 CPU 編號 (sched_getaffinity；不支援時為 0..cpu_count-1)。"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_cpu_count():
+    """可用的 CPU 數：affinity 與容器 CPU 配額取較小者。"""
+    count = len(allowed_cpus())
+    limit = _cgroup_cpu_limit()
+    return min(count, limit) if limit else count
+
+
+# ====== 設定 ======
+def load_calibration(path=None):
+    """讀取 calibrate_cpu_scheduler 寫入的校正檔；不存在或格式不符時回傳 None。"""
+    path = path or getattr(settings, 'INFERENCE_SCHEDULER_CONFIG_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            calibration = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"無法讀取 CPU 排程校正檔 {path} (略過): {e}")
+        return None
+    if calibration.get('schema_version') != CALIBRATION_SCHEMA_VERSION:
+        logger.warning(f"CPU 排程校正檔 {path} 版本不符 (略過)，請重新執行 calibrate_cpu_scheduler。")
+        return None
+    return calibration
+
+
+def get_process_concurrency(role):
+    """同一台主機 (容器) 上同時推論的 process 數。"""
+    if role == 'worker':
+        return max(1, int(os.environ.get(WORKER_CONCURRENCY_ENV) or available_cpu_count()))
+    if role == 'web':
+        return max(1, getattr(settings, 'INFERENCE_WEB_CONCURRENCY', 1))
+    return 1
+
+
+def resolve_scheduler_config(concurrency, cpus=None, calibration=None):
+    """
+    決定每個推論 process 的執行緒數。
+
+    Returns:
+        {'threads': int, 'concurrency': int, 'cpus': int, 'source': 'settings' | 'calibration' | 'auto'}
+    """
+    cpus = cpus or available_cpu_count()
+    config = {'concurrency': concurrency, 'cpus': cpus}
+
+    threads = getattr(settings, 'INFERENCE_THREADS_PER_PROCESS', 0)
+    if threads:
+        return {**config, 'threads': threads, 'source': 'settings'}
+
+    # 校正結果只適用於相同 CPU 數的主機 (映像檔可能部署到不同規格的機器)
+    if calibration and calibration.get('cpus') == cpus:
+        calibrated = calibration.get('threads_by_concurrency', {}).get(str(concurrency))
+        if calibrated:
+            return {**config, 'threads': calibrated, 'source': 'calibration'}
+
+    return {**config, 'threads': max(1, cpus // concurrency), 'source': 'auto'}
+
+
+# ====== 套用 ======
+def apply_thread_settings(threads):
+    """設定 torch / OpenCV / OpenMP 的執行緒數 (需在模型載入與第一次推論之前呼叫)。"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    import cv2
+    cv2.setNumThreads(threads)
+    # 只在 torch 已被匯入時直接設定；尚未匯入時由上面的環境變數生效，避免在 fork 前初始化 torch
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def pin_cpu_affinity(child_index, threads):
+    """
+    將第 child_index 個子 process 綁定到各自的 threads 個 CPU (超過可分配的組數時循環使用)。
+    回傳綁定的 CPU 列表；不支援或失敗時回傳 None。
+    """
+    if child_index is None or not hasattr(os, 'sched_setaffinity'):
+        return None
+    cpus = allowed_cpus()
+    groups = max(1, len(cpus) // threads)
+    start = (child_index % groups) * threads
+    assigned = cpus[start:start + threads] or cpus
+    try:
+        os.sched_setaffinity(0, assigned)
+    except OSError as e:
+        logger.warning(f"無法設定 CPU affinity {assigned}: {e}")
+        return None
+    return assigned
+
+
+def configure_inference_process(role, child_index=None):
+    """
+    依角色套用執行緒數 (與 CPU affinity)，每個 process 只執行一次。
+
+    Args:
+        role: 'web' 或 'worker' (見 apps.detect_process_role)。
+        child_index: celery prefork 子 process 的編號 (0 起算)，開啟 INFERENCE_CPU_AFFINITY 時用於綁定 CPU。
+    """
+    global _applied_config
+    if _applied_config is not None or not getattr(settings, 'INFERENCE_SCHEDULER_ENABLED', True):
+        return _applied_config
+
+    concurrency = get_process_concurrency(role)
+    config = resolve_scheduler_config(concurrency, calibration=load_calibration())
+    apply_thread_settings(config['threads'])
+    if getattr(settings, 'INFERENCE_CPU_AFFINITY', False):
+        config['affinity'] = pin_cpu_affinity(child_index, config['threads'])
+
+    _applied_config = {**config, 'role': role, 'pid': os.getpid()}
+    logger.info(f"CPU 推論排程 ({role}, pid={os.getpid()}): 每個 process {config['threads']} 執行緒 "
+                f"(並行 {concurrency}，可用 CPU {config['cpus']}，來源 {config['source']})"
+                + (f"，CPU affinity {config['affinity']}" if config.get('affinity') else ""))
+    return _applied_config
+
+
+def get_applied_config():
+    return _applied_config
+
+
+# ====== 校正 ======
+def _calibration_child(threads, frame_shape, ready_queue, start_event, result_queue, seconds):
+    """校正用子 process (spawn)：設定執行緒數、載入模型、等待開始訊號後在 seconds 秒內盡量推論。"""
+    import django
+    django.setup()
+    apply_thread_settings(threads)
+    from .apps import ensure_yolo_model_loaded
+    from .benchmarking import synthetic_frame
+
+    model = ensure_yolo_model_loaded(role='calibration')
+    if model is None:
+        ready_queue.put(('error', '無法載入 YOLO 模型'))
+        return
+    frame = synthetic_frame(frame_shape[1], frame_shape[0])
+    model(frame, verbose=False)  # 暖機
+    ready_queue.put(('ready', os.getpid()))
+    start_event.wait()
+
+    images = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        model(frame, verbose=False)
+        images += 1
+    result_queue.put(images)
+
+
+def measure_throughput(processes, threads, seconds=10.0, frame_shape=(1080, 1920), load_timeout=300):
+    """
+    同時啟動 processes 個各有 threads 個執行緒的推論 process，回傳整體 images/sec。
+
+    Raises:
+        RuntimeError: 子 process 無法載入模型或逾時。
+    """
+    import multiprocessing
+    from queue import Empty
+    context = multiprocessing.get_context('spawn')  # 子 process 各自初始化 torch，不繼承父 process 的執行緒池
+    ready_queue, result_queue = context.Queue(), context.Queue()
+    start_event = context.Event()
+    children = [context.Process(target=_calibration_child,
+                                args=(threads, frame_shape, ready_queue, start_event, result_queue, seconds),
+                                daemon=True)
+                for _ in range(processes)]
+    for child in children:
+        child.start()
+    try:
+        for _ in children:
+            status, detail = ready_queue.get(timeout=load_timeout)
+            if status != 'ready':
+                raise RuntimeError(detail)
+        start_event.set()
+        total_images = sum(result_queue.get(timeout=seconds + load_timeout) for _ in children)
+    except Empty:
+        raise RuntimeError(f"校正子 process 逾時 ({processes} x {threads})")
+    finally:
+        for child in children:
+            child.join(timeout=5)
+            if child.is_alive():
+                child.terminate()
+    return total_images / seconds
+
+
+def build_calibration(results, cpus):
+    """
+    由量測結果 [{'processes', 'threads', 'images_per_second'}] 產生校正檔內容：
+    最佳組合，以及每個並行數下吞吐量最高的執行緒數 (threads_by_concurrency)。
+    """
+    best_by_concurrency = {}
+    for row in results:
+        current = best_by_concurrency.get(row['processes'])
+        if current is None or row['images_per_second'] > current['images_per_second']:
+            best_by_concurrency[row['processes']] = row
+    best = max(results, key=lambda row: row['images_per_second'])
+    return {
+        'schema_version': CALIBRATION_SCHEMA_VERSION,
+        'host': platform.node(),
+        'cpus': cpus,
+        'backend': getattr(settings, 'YOLO_INFERENCE_BACKEND', 'pytorch'),
+        'imgsz': getattr(settings, 'YOLO_MODEL_IMGSZ', 640),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'best': best,
+        'threads_by_concurrency': {str(p): row['threads'] for p, row in sorted(best_by_concurrency.items())},
+        'results': results,
+    }
@@ -0,0 +1,161 @@
+# detector/image_encoding.py
+# ------------------------------------------------
+# 標註圖編碼：直接以 cv2.imencode 將 BGR array 編碼為單一 buffer，
+# 不經過 BGR->RGB 轉換、PIL Image 與 BytesIO 的多次整張影像複製。
+# 輸出格式 / 品質 / 最大邊長由 settings 的編碼設定檔 (profile) 決定。
+# ------------------------------------------------
+import hashlib
+import json
+import cv2
+from django.conf import settings
+
+# 以原始副檔名決定格式的特殊設定檔 (與舊版行為相同：JPEG 來源輸出 JPEG q90，其餘輸出 PNG)
+SOURCE_PROFILE = 'source'
+
+# 內建編碼設定檔；可由 settings.ANNOTATED_IMAGE_ENCODE_PROFILES 新增或覆寫
+# format: 'jpeg' | 'webp' | 'png'；quality: JPEG/WebP 品質 (1-100)；
+# png_compression: PNG 壓縮等級 (0-9)；max_dimension: 最長邊上限 (None 表示不縮放)
+DEFAULT_ENCODE_PROFILES = {
+    'jpeg_q90': {'format': 'jpeg', 'quality': 90},
+    'jpeg_q80': {'format': 'jpeg', 'quality': 80},
+    'jpeg_q80_1280': {'format': 'jpeg', 'quality': 80, 'max_dimension': 1280},
+    'webp_q80': {'format': 'webp', 'quality': 80},
+    'webp_q80_1280': {'format': 'webp', 'quality': 80, 'max_dimension': 1280},
+    'png': {'format': 'png', 'png_compression': 3},
+    # 列表頁 / admin 預覽用縮圖 (見 encode_thumbnail)
+    'webp_thumb_320': {'format': 'webp', 'quality': 75, 'max_dimension': 320},
+    'jpeg_thumb_320': {'format': 'jpeg', 'quality': 75, 'max_dimension': 320},
+}
+
+DEFAULT_THUMBNAIL_PROFILE = 'jpeg_thumb_320'
+
+_FORMAT_EXTENSIONS = {'jpeg': '.jpg', 'webp': '.webp', 'png': '.png'}
+
+
+def get_encode_profiles():
+    """回傳所有可用的編碼設定檔 (內建 + settings 覆寫)。"""
+    profiles = dict(DEFAULT_ENCODE_PROFILES)
+    profiles.update(getattr(settings, 'ANNOTATED_IMAGE_ENCODE_PROFILES', None) or {})
+    return profiles
+
+
+def encode_cache_variant():
+    """
+    推論快取 key 的附加欄位：標註圖與縮圖編碼設定的指紋。
+    快取條目含編碼後的圖片，更換設定檔 / 格式 / 品質 / 尺寸後不可再命中舊格式的條目。
+    """
+    profiles = get_encode_profiles()
+    annotated_name = getattr(settings, 'ANNOTATED_IMAGE_ENCODE_PROFILE', SOURCE_PROFILE)
+    thumbnail_name = getattr(settings, 'THUMBNAIL_ENCODE_PROFILE', DEFAULT_THUMBNAIL_PROFILE)
+    fingerprint = json.dumps({
+        'annotated': [annotated_name, profiles.get(annotated_name),
+                      getattr(settings, 'ANNOTATED_IMAGE_MAX_DIMENSION', None)],
+        'thumbnail': [thumbnail_name, profiles.get(thumbnail_name),
+                      getattr(settings, 'THUMBNAIL_MAX_DIMENSION', 320)],
+    }, sort_keys=True, default=str)
+    return f"enc{hashlib.sha1(fingerprint.encode()).hexdigest()[:12]}"
+
+
+def resolve_encode_profile(file_ext, profile_name=None):
+    """
+    依設定檔名稱取得編碼參數 dict。
+
+    Args:
+        file_ext: 原始圖片副檔名，只有 'source' 設定檔會用到。
+        profile_name: 設定檔名稱，預設為 settings.ANNOTATED_IMAGE_ENCODE_PROFILE。
+
+    Raises:
+        ValueError: 設定檔不存在或格式不支援。
+    """
+    profile_name = profile_name or getattr(settings, 'ANNOTATED_IMAGE_ENCODE_PROFILE', SOURCE_PROFILE)
+    if profile_name == SOURCE_PROFILE:
+        if (file_ext or '').lower() in ('.jpg', '.jpeg'):
+            profile = dict(DEFAULT_ENCODE_PROFILES['jpeg_q90'])
+        else:
+            profile = dict(DEFAULT_ENCODE_PROFILES['png'])
+    else:
+        profiles = get_encode_profiles()
+        if profile_name not in profiles:
+            raise ValueError(f"未知的標註圖編碼設定檔: {profile_name} (可用: {', '.join(sorted(profiles))}, {SOURCE_PROFILE})")
+        profile = dict(profiles[profile_name])
+
+    if profile.get('format') not in _FORMAT_EXTENSIONS:
+        raise ValueError(f"不支援的編碼格式: {profile.get('format')}")
+    # 全域最長邊上限 (設定檔本身有指定時以設定檔為準)
+    profile.setdefault('max_dimension', getattr(settings, 'ANNOTATED_IMAGE_MAX_DIMENSION', None))
+    return profile
+
+
+def _imencode_params(profile):
+    fmt = profile['format']
+    if fmt == 'jpeg':
+        return [cv2.IMWRITE_JPEG_QUALITY, int(profile.get('quality', 90))]
+    if fmt == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, int(profile.get('quality', 80))]
+    return [cv2.IMWRITE_PNG_COMPRESSION, int(profile.get('png_compression', 3))]
+
+
+def downscale_to_max_dimension(image_array, max_dimension):
+    """
+    最長邊超過 max_dimension 時等比例縮小；否則原樣回傳，不複製。
+    縮小一半以上才用 INTER_AREA 避免鋸齒，小幅縮小用較快的 INTER_LINEAR。
+    """
+    if not max_dimension:
+        return image_array
+    height, width = image_array.shape[:2]
+    longest = max(height, width)
+    if longest <= max_dimension:
+        return image_array
+    scale = max_dimension / float(longest)
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    interpolation = cv2.INTER_AREA if scale <= 0.5 else cv2.INTER_LINEAR
+    return cv2.resize(image_array, new_size, interpolation=interpolation)
+
+
+def encode_annotated_image(annotated_image_array, file_ext, profile_name=None, profile=None):
+    """
+    將 OpenCV BGR array 編碼為圖片 bytes。
+
+    Args:
+        annotated_image_array: 標註後的 BGR numpy array。
+        file_ext: 原始圖片副檔名 ('source' 設定檔依此決定格式)。
+        profile_name: 編碼設定檔名稱，預設使用 settings.ANNOTATED_IMAGE_ENCODE_PROFILE。
+        profile: 直接指定編碼參數 dict (優先於 profile_name，供基準測試使用)。
+
+    Returns:
+        (encoded_bytes, ext)：ext 為實際輸出格式的副檔名 (例如 '.webp')。
+
+    Raises:
+        ValueError: 設定檔無效或 OpenCV 編碼失敗。
+    """
+    if profile is None:
+        profile = resolve_encode_profile(file_ext, profile_name)
+    image = downscale_to_max_dimension(annotated_image_array, profile.get('max_dimension'))
+    ext = _FORMAT_EXTENSIONS[profile['format']]
+    ok, buffer = cv2.imencode(ext, image, _imencode_params(profile))
+    if not ok:
+        raise ValueError(f"cv2.imencode 無法將標註圖編碼為 {ext}")
+    return buffer.tobytes(), ext
+
+
+def encode_thumbnail(image_array, profile_name=None):
+    """
+    將已解碼的 BGR array 縮小並編碼為縮圖，供列表頁與 admin 預覽使用。
+
+    Args:
+        image_array: 原始圖或標註圖的 BGR numpy array (推論時已在記憶體中，不需重新解碼)。
+        profile_name: 編碼設定檔名稱，預設為 settings.THUMBNAIL_ENCODE_PROFILE。
+                      設定檔未指定 max_dimension 時使用 settings.THUMBNAIL_MAX_DIMENSION
+                      (不套用標註圖的 ANNOTATED_IMAGE_MAX_DIMENSION)。
+
+    Returns:
+        (encoded_bytes, ext)。
+
+    Raises:
+        ValueError: 設定檔無效或 OpenCV 編碼失敗。
+    """
+    profile_name = profile_name or getattr(settings, 'THUMBNAIL_ENCODE_PROFILE', DEFAULT_THUMBNAIL_PROFILE)
+    profile = resolve_encode_profile(None, profile_name)
+    profile['max_dimension'] = (get_encode_profiles().get(profile_name, {}).get('max_dimension')
+                                or getattr(settings, 'THUMBNAIL_MAX_DIMENSION', 320))
+    return encode_annotated_image(image_array, None, profile=profile)
@@ -0,0 +1,195 @@
+# detector/inference_cache.py
+# ------------------------------------------------
+# 以圖片內容 hash 為 key 的推論結果快取 (Redis)
+# key = (sha256(image_bytes), 模型權重 hash, 信心閾值, 編碼設定指紋[, 分塊推論 / 縮小解碼設定])
+# 命中時直接取得 text_results、編碼後的標註圖與縮圖，不需解碼與推論。
+# 條目含編碼後的圖片，總大小以 INFERENCE_CACHE_MAX_BYTES 限制 (超過時依 LRU 淘汰)；
+# 預設關閉，開啟時建議以 INFERENCE_CACHE_REDIS_URL 指向與 Celery broker 不同的 Redis。
+# ------------------------------------------------
+import hashlib
+import json
+import logging
+import time
+from django.conf import settings
+from . import apps as detector_apps
+from .redis_client import get_redis_client
+from .tiled_inference import get_tiling_options, cache_variant
+from .inference_utils import reduced_decode_cache_variant
+from .image_encoding import encode_cache_variant
+
+cache_logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'detector:infcache'
+INDEX_KEY = f'{KEY_PREFIX}:index'    # sorted set: entry key -> 最後使用時間 (LRU 淘汰用)
+SIZES_KEY = f'{KEY_PREFIX}:sizes'    # hash: entry key -> 條目大小 (bytes)，淘汰時扣除總量用
+BYTES_KEY = f'{KEY_PREFIX}:bytes'    # 所有條目的總大小 (bytes)
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+THUMBNAIL_FIELDS = ('original_thumbnail', 'annotated_thumbnail')
+
+
+def is_enabled():
+    return getattr(settings, 'INFERENCE_CACHE_ENABLED', False)
+
+
+def _get_client():
+    return get_redis_client(getattr(settings, 'INFERENCE_CACHE_REDIS_URL', None))
+
+
+def build_cache_key(image_bytes, confidence):
+    """
+    組合快取 key。模型尚未載入 (沒有權重 hash) 時回傳 None，代表不使用快取。
+    """
+    if detector_apps.yolo_model_weights_hash is None:
+        detector_apps.get_yolo_model()
+    weights_hash = detector_apps.yolo_model_weights_hash
+    if not weights_hash:
+        return None
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    # 條目含編碼後的標註圖與縮圖，編碼設定變更後不可沿用
+    key = f"{KEY_PREFIX}:{image_hash}:{weights_hash[:16]}:{float(confidence):.3f}:{encode_cache_variant()}"
+    # 分塊推論與縮小解碼的結果 (框、標註圖尺寸) 與預設路徑不同，不可共用快取條目
+    tiling_options = get_tiling_options()
+    variant = cache_variant(tiling_options) + reduced_decode_cache_variant(tiling_options)
+    return f"{key}:{variant}" if variant else key
+
+
+def get_cached_inference(image_bytes, confidence):
+    """
+    查詢快取，並更新命中/未命中計數。
+
+    Returns:
+        命中時回傳 {'text_results': list, 'annotated_image_bytes': bytes 或 None,
+                    'annotated_ext': str 或 None, 'thumbnails': {欄位名稱: (bytes, ext)}}；
+        未命中或快取不可用時回傳 None。較舊的快取條目沒有縮圖時 'thumbnails' 為空 dict。
+    """
+    if not is_enabled() or not image_bytes:
+        return None
+    key = build_cache_key(image_bytes, confidence)
+    if key is None:
+        return None
+
+    try:
+        client = _get_client()
+        entry = client.hgetall(key)
+        if not entry:
+            client.incr(MISSES_KEY)
+            return None
+
+        pipe = client.pipeline(transaction=False)
+        pipe.incr(HITS_KEY)
+        pipe.zadd(INDEX_KEY, {key: time.time()}, xx=True)
+        pipe.execute()
+
+        annotated_ext = entry.get(b'annotated_ext')
+        thumbnails = {}
+        for field_name in THUMBNAIL_FIELDS:
+            thumbnail_bytes = entry.get(field_name.encode())
+            if thumbnail_bytes:
+                thumbnails[field_name] = (thumbnail_bytes, entry.get(f'{field_name}_ext'.encode(), b'').decode())
+        return {
+            'text_results': json.loads(entry[b'text_results']),
+            'annotated_image_bytes': entry.get(b'annotated') or None,
+            'annotated_ext': annotated_ext.decode() if annotated_ext else None,
+            'thumbnails': thumbnails,
+        }
+    except Exception as e:
+        # 快取錯誤不可影響推論流程，視為未命中
+        cache_logger.warning(f"推論快取讀取失敗 (視為未命中): {e}")
+        return None
+
+
+def store_cached_inference(image_bytes, confidence, text_results, annotated_image_bytes=None, annotated_ext=None,
+                           thumbnails=None):
+    """
+    寫入快取，並在條目數超過 INFERENCE_CACHE_MAX_ENTRIES 或總大小超過 INFERENCE_CACHE_MAX_BYTES 時
+    淘汰最久未使用的條目。thumbnails 為 {欄位名稱: (bytes, ext)}，與標註圖一起快取。
+    """
+    if not is_enabled() or not image_bytes:
+        return
+    key = build_cache_key(image_bytes, confidence)
+    if key is None:
+        return
+
+    mapping = {'text_results': json.dumps(text_results, ensure_ascii=False).encode()}
+    if annotated_image_bytes:
+        mapping['annotated'] = annotated_image_bytes
+        mapping['annotated_ext'] = (annotated_ext or '').encode()
+    for field_name, (thumbnail_bytes, thumbnail_ext) in (thumbnails or {}).items():
+        if field_name in THUMBNAIL_FIELDS and thumbnail_bytes:
+            mapping[field_name] = thumbnail_bytes
+            mapping[f'{field_name}_ext'] = (thumbnail_ext or '').encode()
+
+    entry_bytes = sum(len(name) + len(value) for name, value in mapping.items())
+    max_entry_bytes = min(getattr(settings, 'INFERENCE_CACHE_MAX_ENTRY_BYTES', 2 * 1024 * 1024),
+                          getattr(settings, 'INFERENCE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    if entry_bytes > max_entry_bytes:
+        cache_logger.debug(f"快取條目 {entry_bytes} bytes 超過單筆上限，不寫入快取。")
+        return
+
+    try:
+        client = _get_client()
+        previous_bytes = int(client.hget(SIZES_KEY, key) or 0)
+        pipe = client.pipeline(transaction=False)
+        pipe.delete(key)  # 覆寫時不保留舊條目多出的欄位
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, getattr(settings, 'INFERENCE_CACHE_TTL', 7 * 24 * 3600))
+        pipe.zadd(INDEX_KEY, {key: time.time()})
+        pipe.hset(SIZES_KEY, key, entry_bytes)
+        pipe.incrby(BYTES_KEY, entry_bytes - previous_bytes)
+        pipe.zcard(INDEX_KEY)
+        total_bytes, entry_count = pipe.execute()[-2:]
+        _evict(client, entry_count, total_bytes)
+    except Exception as e:
+        cache_logger.warning(f"推論快取寫入失敗 (略過): {e}")
+
+
+def _evict(client, entry_count, total_bytes):
+    """
+    依 LRU 淘汰條目，直到條目數與總大小都在上限內。
+    已因 TTL 過期的條目仍留在索引中，會在這裡一併移除並扣除其大小。
+    """
+    max_entries = getattr(settings, 'INFERENCE_CACHE_MAX_ENTRIES', 5000)
+    max_bytes = getattr(settings, 'INFERENCE_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+    evicted_count = 0
+    while entry_count > max_entries or total_bytes > max_bytes:
+        popped = [member for member, _ in client.zpopmin(INDEX_KEY, min(max(entry_count - max_entries, 1), 100))]
+        if not popped:
+            break
+        freed = sum(int(size or 0) for size in client.hmget(SIZES_KEY, popped))
+        pipe = client.pipeline(transaction=False)
+        pipe.delete(*popped)
+        pipe.hdel(SIZES_KEY, *popped)
+        pipe.decrby(BYTES_KEY, freed)
+        total_bytes = pipe.execute()[-1]
+        entry_count -= len(popped)
+        evicted_count += len(popped)
+    if evicted_count:
+        cache_logger.debug(f"推論快取淘汰 {evicted_count} 筆最久未使用的條目 (目前 {total_bytes} bytes)。")
+
+
+def get_inference_cache_stats():
+    """回傳快取命中統計。"""
+    stats = {'enabled': is_enabled(), 'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0,
+             'max_bytes': getattr(settings, 'INFERENCE_CACHE_MAX_BYTES', 256 * 1024 * 1024), 'hit_ratio': None}
+    try:
+        client = _get_client()
+        pipe = client.pipeline(transaction=False)
+        pipe.get(HITS_KEY)
+        pipe.get(MISSES_KEY)
+        pipe.zcard(INDEX_KEY)
+        pipe.get(BYTES_KEY)
+        hits, misses, entries, total_bytes = pipe.execute()
+    except Exception as e:
+        cache_logger.warning(f"讀取推論快取統計失敗: {e}")
+        stats['error'] = str(e)
+        return stats
+
+    stats['hits'] = int(hits or 0)
+    stats['misses'] = int(misses or 0)
+    stats['entries'] = int(entries or 0)
+    stats['bytes'] = int(total_bytes or 0)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+    return stats
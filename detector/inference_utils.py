@@ -1,9 +1,14 @@
 # detector/inference_utils.py
+import io
 import cv2
 import numpy as np
 import os
 import logging # <-- 新增 logging
-from .apps import yolo_model
+from django.conf import settings
+from PIL import Image
+from .apps import get_yolo_model
+from .metrics import stage_timer
+from .tiled_inference import get_tiling_options, should_tile, iter_tiles, merge_detections, draw_detections
 
 # 設定此模組的 logger
 inference_logger = logging.getLogger(__name__) #或者 'detector.inference_utils'
@@ -12,55 +17,228 @@ class ImageDecodeError(Exception):
     """自訂異常，用於表示圖片解碼失敗。"""
     pass
 
-def run_yolo_inference_on_image_data(image_bytes, confidence_threshold=0.5):
+# JPEG 可在解碼時以 DCT 縮放直接輸出 1/2、1/4、1/8 尺寸 (不需先解出完整影像再縮小)
+_REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+_EXIF_ORIENTATION_TAG = 0x0112
+_EXIF_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)  # 旋轉 90/270 度，解碼後寬高互換
+
+
+def is_reduced_decode_enabled(tiling_options=None):
+    """分塊推論需要完整解析度，開啟時不使用縮小解碼。"""
+    return getattr(settings, 'YOLO_REDUCED_DECODE', False) and tiling_options is None
+
+
+def annotates_reduced_frame():
     """
-    使用預先載入的 YOLO 模型對記憶體中的圖片數據執行推論。
+    YOLO_REDUCED_DECODE_ANNOTATION = 'reduced' 時標註圖直接畫在縮小解碼的影像上 (不再解碼完整影像，
+    但標註圖為縮小後的尺寸)；預設 'full' 在有檢測結果時重新以完整解析度解碼並畫上換算後的檢測框。
     """
-    if yolo_model is None:
-        inference_logger.error("YOLO 模型尚未成功載入 (inference_utils)。")
-        raise RuntimeError("YOLO model is not loaded.")
+    return getattr(settings, 'YOLO_REDUCED_DECODE_ANNOTATION', 'full') == 'reduced'
+
+
+def reduced_decode_cache_variant(tiling_options=None):
+    """推論快取 key 的附加欄位：縮小解碼的標註圖尺寸依設定不同，不可共用快取條目。"""
+    if not is_reduced_decode_enabled(tiling_options):
+        return ''
+    return 'rdr' if annotates_reduced_frame() else 'rdf'
+
+
+def scale_xyxy(xyxy, scale):
+    """將縮小解碼影像上的 xyxy 座標換回原圖解析度。"""
+    x1, y1, x2, y2 = xyxy
+    return (x1 * scale[0], y1 * scale[1], x2 * scale[0], y2 * scale[1])
+
+
+def choose_decode_reduction(image_bytes, target_dimension):
+    """
+    只讀取圖片 header，選出解碼後最長邊仍不小於 target_dimension (模型輸入尺寸) 的最大縮小倍率。
+
+    Returns:
+        (factor, original_size)：factor 為 1/2/4/8；original_size 為套用 EXIF 方向後的原始 (寬, 高)。
+        非 JPEG 或無法讀取 header 時回傳 (1, None)，代表以完整解析度解碼。
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            if header.format != 'JPEG':
+                return 1, None
+            width, height = header.size
+            if header.getexif().get(_EXIF_ORIENTATION_TAG) in _EXIF_TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+    except Exception:
+        return 1, None
+    longest = max(width, height)
+    for factor in (8, 4, 2):
+        if longest // factor >= target_dimension:
+            return factor, (width, height)
+    return 1, (width, height)
 
-    annotated_image_array = None
-    text_results = []
 
+def decode_image_for_inference(image_bytes, tiling_options=None):
+    """
+    解碼要送入模型的影像。開啟 YOLO_REDUCED_DECODE 時，大尺寸 JPEG 以 DCT 縮放解碼為
+    接近 YOLO_MODEL_IMGSZ 的尺寸 (模型本來就會縮到這個大小)，解碼時間與記憶體都少數倍。
+
+    Returns:
+        (img, scale)：scale 為 (原圖寬 / 解碼寬, 原圖高 / 解碼高)，用來把檢測框換回原圖座標。
+    """
+    if not is_reduced_decode_enabled(tiling_options):
+        return decode_image_bytes(image_bytes), (1.0, 1.0)
+    factor, original_size = choose_decode_reduction(image_bytes, getattr(settings, 'YOLO_MODEL_IMGSZ', 640))
+    img = decode_image_bytes(image_bytes, reduce_factor=factor)
+    if factor == 1 or original_size is None:
+        return img, (1.0, 1.0)
+    inference_logger.debug(f"縮小解碼 1/{factor}: {original_size[0]}x{original_size[1]} -> {img.shape[1]}x{img.shape[0]}")
+    return img, (original_size[0] / img.shape[1], original_size[1] / img.shape[0])
+
+
+def decode_image_bytes(image_bytes, reduce_factor=1):
+    """
+    將圖片位元組解碼為 OpenCV BGR array，失敗時拋出 ImageDecodeError。
+    reduce_factor (2/4/8) 以 IMREAD_REDUCED_COLOR_* 在解碼時縮小 (JPEG 為 DCT 縮放)。
+    """
     if not image_bytes:
         inference_logger.warning("傳入的 image_bytes 為空 (inference_utils)。")
         raise ImageDecodeError("Input image_bytes is empty.")
 
     inference_logger.debug(f"Attempting to decode image_bytes of length: {len(image_bytes)}")
 
-    try:
+    with stage_timer('decode'):
         nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img = cv2.imdecode(nparr, _REDUCED_DECODE_FLAGS.get(reduce_factor, cv2.IMREAD_COLOR))
+
+    if img is None:
+        inference_logger.error(f"無法從位元組數據解碼圖片 (cv2.imdecode returned None). Bytes length: {len(image_bytes)} (inference_utils).")
+        # 拋出一個更特定的錯誤，而不是僅僅回傳 None, []
+        raise ImageDecodeError(f"cv2.imdecode failed for image_bytes of length {len(image_bytes)}.")
+
+    return img
 
-        if img is None:
-            inference_logger.error(f"無法從位元組數據解碼圖片 (cv2.imdecode returned None). Bytes length: {len(image_bytes)} (inference_utils).")
-            # 拋出一個更特定的錯誤，而不是僅僅回傳 None, []
-            raise ImageDecodeError(f"cv2.imdecode failed for image_bytes of length {len(image_bytes)}.")
-        
-        inference_logger.info(f"成功從位元組數據解碼圖片進行推論 (尺寸: {img.shape})")
 
-        results = yolo_model(img, conf=confidence_threshold)
-
-        if results and results[0] and results[0].boxes is not None:
-            if len(results[0].boxes) > 0:
-                inference_logger.info(f"偵測到 {len(results[0].boxes)} 個物件 (信心度 > {confidence_threshold})")
-                annotated_image_array = results[0].plot() 
-                
-                names = yolo_model.names
-                for box in results[0].boxes:
-                    class_id = int(box.cls.item())
-                    conf = box.conf.item()
-                    class_name = names.get(class_id, f"未知類別 {class_id}")
-                    text_results.append({
-                        'class': class_name,
-                        'confidence_str': f"{conf:.2f}",
-                        'confidence_float': conf
-                    })
-            else:
-                inference_logger.info(f"在此圖片上未偵測到信心度高於 {confidence_threshold} 的物件。")
+def _collect_detections(result, names, confidence_threshold, scale=(1.0, 1.0), image_bytes=None):
+    """
+    將單張圖片的 YOLO Results 轉換為 (annotated_image_array, text_results)。
+    scale 為縮小解碼的倍率 (見 decode_image_for_inference)：text_results 的座標換回原圖解析度；
+    標註圖見 _annotate (縮小解碼時需要 image_bytes 以完整解析度重新解碼)。
+    """
+    annotated_image_array = None
+    text_results = []
+
+    if result and result.boxes is not None:
+        if len(result.boxes) > 0:
+            inference_logger.info(f"偵測到 {len(result.boxes)} 個物件 (信心度 > {confidence_threshold})")
+            for box in result.boxes:
+                class_id = int(box.cls.item())
+                conf = box.conf.item()
+                class_name = names.get(class_id, f"未知類別 {class_id}")
+                xyxy = scale_xyxy(box.xyxy[0].tolist(), scale)
+                text_results.append(_detection_dict(class_name, class_id, conf, xyxy))
+            annotated_image_array = _annotate(result, text_results, scale, image_bytes)
         else:
+            inference_logger.info(f"在此圖片上未偵測到信心度高於 {confidence_threshold} 的物件。")
+    else:
+        inference_logger.warning("模型推論結果格式異常或為空。")
+
+    return annotated_image_array, text_results
+
+
+def _annotate(result, text_results, scale, image_bytes):
+    """
+    產生標註圖。完整解析度解碼 (或設定為 'reduced') 時直接使用 result.plot()；
+    縮小解碼時以完整解析度重新解碼，畫上已換回原圖座標的檢測框，標註圖與原圖尺寸相同。
+    """
+    if scale == (1.0, 1.0) or image_bytes is None or annotates_reduced_frame():
+        with stage_timer('plot'):
+            return result.plot()
+    full_image = decode_image_bytes(image_bytes)
+    with stage_timer('plot'):
+        return draw_detections(full_image, text_results)
+
+
+def _detection_dict(class_name, class_id, conf, xyxy):
+    return {
+        'class': class_name,
+        'class_id': class_id,
+        'confidence_str': f"{conf:.2f}",
+        'confidence_float': conf,
+        'xyxy': [round(float(v), 1) for v in xyxy],
+    }
+
+
+def _run_tiled_inference(yolo_model, img, confidence_threshold, options):
+    """
+    分塊推論 (見 tiled_inference.py)：tile 分批送入模型 (每批最多 max_tiles_in_flight 張)，
+    檢測框平移回原圖座標後以 NMS 合併，最後只在原圖複本上畫一次框。
+
+    Returns:
+        (annotated_image_array, text_results)，格式與 _collect_detections 相同。
+    """
+    tiles = list(iter_tiles(img, options['tile_size'], options['overlap']))
+    names = yolo_model.names
+    boxes, scores, class_ids = [], [], []
+    for start in range(0, len(tiles), options['max_tiles_in_flight']):
+        chunk = tiles[start:start + options['max_tiles_in_flight']]
+        with stage_timer('inference_tiled'):
+            results = yolo_model([tile for _, _, tile in chunk], conf=confidence_threshold)
+        for (x0, y0, _), result in zip(chunk, results):
+            if result is None or result.boxes is None:
+                continue
+            for box in result.boxes:
+                x1, y1, x2, y2 = box.xyxy[0].tolist()
+                boxes.append((x1 + x0, y1 + y0, x2 + x0, y2 + y0))
+                scores.append(box.conf.item())
+                class_ids.append(int(box.cls.item()))
+        del results
+
+    keep = merge_detections(boxes, scores, class_ids, options['nms_iou'])
+    text_results = [
+        _detection_dict(names.get(class_ids[i], f"未知類別 {class_ids[i]}"), class_ids[i], scores[i], boxes[i])
+        for i in keep
+    ]
+    inference_logger.info(f"分塊推論: {img.shape[1]}x{img.shape[0]} 切成 {len(tiles)} 個 tile，"
+                          f"合併前 {len(boxes)} 個框，NMS 後 {len(text_results)} 個 (信心度 > {confidence_threshold})")
+    if not text_results:
+        return None, []
+    with stage_timer('plot'):
+        annotated_image_array = draw_detections(img, text_results)
+    return annotated_image_array, text_results
+
+
+def run_yolo_inference_on_image_data(image_bytes, confidence_threshold=0.5):
+    """
+    使用預先載入的 YOLO 模型對記憶體中的圖片數據執行推論。
+
+    Returns:
+        (annotated_image_array, text_results, original_image_array)；
+        original_image_array 為解碼後的 BGR array，供呼叫端產生縮圖而不需重新解碼
+        (開啟 YOLO_REDUCED_DECODE 時為縮小解碼的影像；text_results 的座標與標註圖一律為原圖解析度，
+        除非 YOLO_REDUCED_DECODE_ANNOTATION = 'reduced')。
+    """
+    yolo_model = get_yolo_model()
+    if yolo_model is None:
+        inference_logger.error("YOLO 模型尚未成功載入 (inference_utils)。")
+        raise RuntimeError("YOLO model is not loaded.")
+
+    try:
+        tiling_options = get_tiling_options()
+        img, scale = decode_image_for_inference(image_bytes, tiling_options)
+        inference_logger.info(f"成功從位元組數據解碼圖片進行推論 (尺寸: {img.shape})")
+
+        if should_tile(img.shape, tiling_options):
+            return (*_run_tiled_inference(yolo_model, img, confidence_threshold, tiling_options), img)
+
+        with stage_timer('inference'):
+            results = yolo_model(img, conf=confidence_threshold)
+        if not results:
             inference_logger.warning("模型推論結果格式異常或為空。")
+            return None, [], img
+        annotated_image_array, text_results = _collect_detections(results[0], yolo_model.names,
+                                                                  confidence_threshold, scale, image_bytes)
+        return annotated_image_array, text_results, img
 
     except ImageDecodeError: # 直接重新拋出我們自訂的解碼錯誤
         raise
@@ -70,4 +248,65 @@ def run_yolo_inference_on_image_data(image_bytes, confidence_threshold=0.5):
         # 這裡我們讓它作為一個通用錯誤被上層捕獲
         raise RuntimeError(f"YOLO inference processing error: {e}")
 
-    return annotated_image_array, text_results
+
+def run_yolo_inference_on_image_batch(image_bytes_list, confidence_threshold=0.5):
+    """
+    對多張圖片執行一次批次 (batched) 前向推論。
+
+    每張圖片先各自解碼；解碼失敗的圖片不會送入模型，
+    其對應位置會放入 ImageDecodeError 實例，由呼叫端逐張處理。
+
+    Returns:
+        與 image_bytes_list 等長的 list，每個元素為
+        (annotated_image_array, text_results, original_image_array) tuple 或 ImageDecodeError。
+    """
+    yolo_model = get_yolo_model()
+    if yolo_model is None:
+        inference_logger.error("YOLO 模型尚未成功載入 (inference_utils)。")
+        raise RuntimeError("YOLO model is not loaded.")
+
+    outputs = [None] * len(image_bytes_list)
+    frames, frame_indices, scales = [], [], []
+    decode_failures = tiled_count = 0
+    tiling_options = get_tiling_options()
+    for idx, image_bytes in enumerate(image_bytes_list):
+        try:
+            frame, scale = decode_image_for_inference(image_bytes, tiling_options)
+        except ImageDecodeError as ide:
+            outputs[idx] = ide
+            decode_failures += 1
+            continue
+        if should_tile(frame.shape, tiling_options):
+            # 大尺寸畫面各自分塊推論 (tile 已是一次批次呼叫)，不與其他圖片合併
+            try:
+                outputs[idx] = (*_run_tiled_inference(yolo_model, frame, confidence_threshold, tiling_options), frame)
+            except Exception as e:
+                inference_logger.error(f"執行 YOLO 分塊推論時發生錯誤: {e}", exc_info=True)
+                raise RuntimeError(f"YOLO tiled inference processing error: {e}")
+            tiled_count += 1
+            continue
+        frames.append(frame)
+        frame_indices.append(idx)
+        scales.append(scale)
+
+    inference_logger.info(f"批次推論 {len(frames)} 張圖片 (分塊推論 {tiled_count} 張，解碼失敗 {decode_failures} 張)")
+    if not frames:
+        return outputs
+
+    try:
+        with stage_timer('inference_batch'):
+            results = yolo_model(frames, conf=confidence_threshold)
+        names = yolo_model.names
+        for idx, frame, scale, result in zip(frame_indices, frames, scales, results):
+            outputs[idx] = (*_collect_detections(result, names, confidence_threshold, scale,
+                                                 image_bytes_list[idx]), frame)
+    except Exception as e:
+        inference_logger.error(f"執行 YOLO 批次推論或處理結果時發生錯誤: {e}", exc_info=True)
+        raise RuntimeError(f"YOLO batch inference processing error: {e}")
+
+    # 模型回傳數量不足時，視為該張圖片沒有結果
+    for idx, frame in zip(frame_indices, frames):
+        if outputs[idx] is None:
+            outputs[idx] = (None, [], frame)
+
+    return outputs
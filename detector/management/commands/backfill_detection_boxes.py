@@ -0,0 +1,62 @@
+# detector/management/commands/backfill_detection_boxes.py
+# ------------------------------------------------
+# 為建立 DetectionBox 資料表之前的 DetectionRecord 補寫檢測框。
+# 以主鍵 keyset 分頁逐塊讀取 results_data，每塊以 bulk_create 寫入。
+# ------------------------------------------------
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from detector.models import DetectionRecord, DetectionBox
+from detector.batch_aggregates import rebuild_batch_aggregates
+
+
+class Command(BaseCommand):
+    help = "為尚未有檢測框的辨識紀錄，由 results_data 補寫 DetectionBox。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="每次讀取的紀錄數 (預設 2000)。")
+        parser.add_argument('--batch-job', default=None, help="只處理指定批次任務 ID 的紀錄。")
+        parser.add_argument('--rebuild-batch-aggregates', action='store_true',
+                            help="補寫後以 SQL 彙總重建受影響批次的統計。")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        qs = DetectionRecord.objects.filter(boxes__isnull=True)
+        if options['batch_job']:
+            qs = qs.filter(batch_job_id=options['batch_job'])
+
+        scanned = created = 0
+        touched_batches = set()
+        started = time.monotonic()
+        last_id = None
+
+        while True:
+            page = qs.order_by('id')
+            if last_id is not None:
+                page = page.filter(id__gt=last_id)
+            rows = list(page.values_list('id', 'batch_job_id', 'results_data')[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            scanned += len(rows)
+
+            boxes = []
+            for record_id, batch_job_id, results_data in rows:
+                record_boxes = DetectionBox.from_results_data(DetectionRecord(id=record_id, results_data=results_data))
+                if record_boxes and batch_job_id is not None:
+                    touched_batches.add(batch_job_id)
+                boxes.extend(record_boxes)
+            with transaction.atomic():
+                DetectionBox.objects.bulk_create(boxes, batch_size=chunk_size)
+            created += len(boxes)
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"已掃描 {scanned} 筆紀錄，寫入 {created} 個檢測框 ({scanned / elapsed:.0f} 筆/秒)")
+
+        if options['rebuild_batch_aggregates']:
+            for batch_job_id in touched_batches:
+                rebuild_batch_aggregates(batch_job_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：掃描 {scanned} 筆紀錄，寫入 {created} 個檢測框，涉及 {len(touched_batches)} 個批次。"
+        ))
@@ -0,0 +1,91 @@
+# detector/management/commands/benchmark_encode_profiles.py
+# ------------------------------------------------
+# 標註圖編碼基準測試：比較各編碼設定檔 (以及舊版 PIL 路徑) 的編碼時間與輸出大小。
+# 預設使用合成的 rover 解析度畫面，也可用 --image 指定實際拍攝的圖片。
+# ------------------------------------------------
+import io
+import json
+import statistics
+import time
+import cv2
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+from detector.benchmarking import synthetic_frame
+from detector.image_encoding import get_encode_profiles, encode_annotated_image, resolve_encode_profile
+
+LEGACY_PIL_PROFILE = 'pil_legacy_jpeg_q90'
+
+
+def _legacy_pil_encode(image_array):
+    """舊版 services._encode_annotated_image 的 PIL 路徑 (BGR->RGB -> PIL -> BytesIO)，作為對照組。"""
+    img_rgb = cv2.cvtColor(image_array, cv2.COLOR_BGR2RGB)
+    buffer = io.BytesIO()
+    Image.fromarray(img_rgb).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue(), '.jpg'
+
+
+class Command(BaseCommand):
+    help = "比較各標註圖編碼設定檔的編碼時間與輸出大小。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', action='append', default=[], help="使用實際圖片 (可重複指定)；未指定時使用合成畫面。")
+        parser.add_argument('--width', type=int, default=1920, help="合成畫面寬度 (預設 1920)。")
+        parser.add_argument('--height', type=int, default=1080, help="合成畫面高度 (預設 1080)。")
+        parser.add_argument('--repeat', type=int, default=20, help="每個設定檔每張圖片的編碼次數 (預設 20)。")
+        parser.add_argument('--profile', action='append', default=[], help="只測試指定的設定檔 (可重複指定)。")
+        parser.add_argument('--json', action='store_true', help="以 JSON 輸出結果。")
+
+    def handle(self, *args, **options):
+        frames = []
+        for path in options['image']:
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is None:
+                raise CommandError(f"無法讀取圖片: {path}")
+            frames.append(frame)
+        if not frames:
+            frames.append(synthetic_frame(options['width'], options['height']))
+
+        profiles = get_encode_profiles()
+        names = options['profile'] or [LEGACY_PIL_PROFILE] + sorted(profiles)
+        repeat = max(1, options['repeat'])
+
+        results = []
+        for name in names:
+            if name == LEGACY_PIL_PROFILE:
+                encode = _legacy_pil_encode
+            else:
+                try:
+                    profile = resolve_encode_profile('.jpg', name)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                encode = lambda array, profile=profile: encode_annotated_image(array, '.jpg', profile=profile)
+
+            timings_ms, sizes = [], []
+            ext = None
+            for frame in frames:
+                encode(frame)  # 暖機 (第一次呼叫會初始化編碼器)
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    data, ext = encode(frame)
+                    timings_ms.append((time.perf_counter() - started) * 1000)
+                sizes.append(len(data))
+
+            results.append({
+                'profile': name,
+                'ext': ext,
+                'mean_ms': round(statistics.fmean(timings_ms), 2),
+                'p95_ms': round(sorted(timings_ms)[int(0.95 * (len(timings_ms) - 1))], 2),
+                'mean_kb': round(statistics.fmean(sizes) / 1024, 1),
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'frames': [list(frame.shape) for frame in frames], 'repeat': repeat, 'results': results,
+            }, indent=2))
+            return
+
+        shapes = ', '.join(f"{f.shape[1]}x{f.shape[0]}" for f in frames)
+        self.stdout.write(f"畫面: {shapes}，每張重複 {repeat} 次")
+        self.stdout.write(f"{'profile':<24}{'ext':<7}{'mean ms':>10}{'p95 ms':>10}{'size KB':>10}")
+        for row in results:
+            self.stdout.write(f"{row['profile']:<24}{row['ext']:<7}{row['mean_ms']:>10}{row['p95_ms']:>10}{row['mean_kb']:>10}")
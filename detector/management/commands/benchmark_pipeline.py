@@ -0,0 +1,104 @@
+# detector/management/commands/benchmark_pipeline.py
+# ------------------------------------------------
+# 離線端到端基準測試：以合成的 rover 解析度圖片執行 process_image_bytes、process_s3_folder_task
+# 與資料保留清理，輸出各情境的 img/s、p50/p95 與 peak RSS (JSON)；--baseline 會比較吞吐量、p95 與 RSS。
+# 只能在 detector_project.settings_benchmark 下執行 (sqlite + 本機 storage，會清空資料表)：
+#   DJANGO_SETTINGS_MODULE=detector_project.settings_benchmark python manage.py benchmark_pipeline \
+#       --output bench.json --baseline bench-main.json
+# ------------------------------------------------
+import json
+import shutil
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from detector.apps import ensure_yolo_model_loaded
+from detector.benchmarking import StubYOLOModel, THROUGHPUT_KEYS, compare_reports, install_model, run_benchmark
+
+SCENARIOS = tuple(THROUGHPUT_KEYS)
+
+
+class Command(BaseCommand):
+    help = "以本機替代元件 (目錄 S3、假模型、sqlite) 執行端到端基準測試並輸出 JSON 報告。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=32, help="合成圖片數 (預設 32)。")
+        parser.add_argument('--width', type=int, default=1920, help="合成畫面寬度 (預設 1920)。")
+        parser.add_argument('--height', type=int, default=1080, help="合成畫面高度 (預設 1080)。")
+        parser.add_argument('--model', choices=('stub', 'real'), default='stub',
+                            help="stub: 假模型 (預設)；real: 載入 yolo/best.pt (需要 ultralytics)。")
+        parser.add_argument('--stub-latency-ms', type=float, default=50.0, help="假模型每張圖片的推論耗時 (預設 50)。")
+        parser.add_argument('--s3-latency-ms', type=float, default=0.0, help="模擬的 S3 GET 延遲 (預設 0)。")
+        parser.add_argument('--confidence', type=float, default=0.5, help="信心閾值 (預設 0.5)。")
+        parser.add_argument('--pipeline', action='store_true', help="批次情境啟用 BATCH_PIPELINE_ENABLED。")
+        parser.add_argument('--tiled', action='store_true', help="啟用分塊推論 (YOLO_TILED_INFERENCE)。")
+        parser.add_argument('--reduced-decode', action='store_true', help="啟用縮小解碼 (YOLO_REDUCED_DECODE)。")
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, default=[],
+                            help="只執行指定的情境 (可重複指定)；預設全部。")
+        parser.add_argument('--output', help="將 JSON 報告寫入檔案 (預設輸出到 stdout)。")
+        parser.add_argument('--baseline', help="與先前的 JSON 報告比較吞吐量、p95 延遲與 peak RSS。")
+        parser.add_argument('--max-regression', type=float, default=10.0,
+                            help="吞吐量下降超過此百分比時以非 0 結束 (需搭配 --baseline，預設 10)。")
+        parser.add_argument('--max-p95-regression', type=float, default=15.0,
+                            help="p95 延遲增加超過此百分比時以非 0 結束 (需搭配 --baseline，預設 15)。")
+        parser.add_argument('--max-rss-regression', type=float, default=10.0,
+                            help="各情境 peak RSS 增加超過此百分比時以非 0 結束 (需搭配 --baseline，預設 10)。")
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'DETECTOR_BENCHMARK', False):
+            raise CommandError("請以 DJANGO_SETTINGS_MODULE=detector_project.settings_benchmark 執行 (此指令會清空資料表)。")
+        if options['images'] < 1:
+            raise CommandError("--images 必須大於 0。")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"無法讀取基準報告 {options['baseline']}: {e}")
+
+        # 每次都從空的資料庫與 storage 開始，結果才可以互相比較
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        call_command('migrate', verbosity=0, interactive=False)
+        call_command('flush', verbosity=0, interactive=False)
+
+        if options['model'] == 'stub':
+            install_model(StubYOLOModel(latency_ms=options['stub_latency_ms']), 'stub')
+        elif ensure_yolo_model_loaded(role='benchmark') is None:
+            raise CommandError("無法載入 yolo/best.pt (請確認模型檔與 ultralytics 已安裝)。")
+
+        report = run_benchmark(
+            scenarios=options['scenario'] or SCENARIOS,
+            image_count=options['images'],
+            width=options['width'],
+            height=options['height'],
+            model_name=options['model'],
+            confidence=options['confidence'],
+            pipeline=options['pipeline'],
+            tiled=options['tiled'],
+            reduced_decode=options['reduced_decode'],
+            s3_latency_ms=options['s3_latency_ms'],
+            stub_latency_ms=options['stub_latency_ms'] if options['model'] == 'stub' else None,
+        )
+
+        content = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(content + '\n')
+            self.stderr.write(f"報告已寫入 {options['output']}")
+        else:
+            self.stdout.write(content)
+
+        if baseline is None:
+            return
+        if baseline.get('config') != report['config']:
+            self.stderr.write("注意：基準報告的設定與本次不同，比較結果僅供參考。")
+        rows, regressions = compare_reports(baseline, report, options['max_regression'],
+                                            options['max_p95_regression'], options['max_rss_regression'])
+        self.stderr.write(f"與基準 ({baseline.get('git_commit')}) 比較:")
+        for scenario, metric, before, after, change_pct in rows:
+            self.stderr.write(f"  {scenario:<24}{metric:<24}{before:>10} -> {after:<10}{change_pct:+.1f}%")
+        if regressions:
+            raise CommandError(f"效能退步超過門檻 (吞吐量 {options['max_regression']}% / "
+                               f"p95 {options['max_p95_regression']}% / RSS {options['max_rss_regression']}%): "
+                               f"{', '.join(regressions)}")
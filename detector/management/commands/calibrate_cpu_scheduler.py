@@ -0,0 +1,72 @@
+# detector/management/commands/calibrate_cpu_scheduler.py
+# ------------------------------------------------
+# CPU 推論排程校正：在本機量測 (process 數 x 每個 process 執行緒數) 各組合的整體推論吞吐量，
+# 把每個並行數的最佳執行緒數寫入 INFERENCE_SCHEDULER_CONFIG_PATH (web / worker 啟動時讀取，見 cpu_scheduler.py)。
+# 需要實際的 yolo/best.pt；請在部署的機器 (或相同規格的機器) 上、沒有其他負載時執行。
+# ------------------------------------------------
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from detector.cpu_scheduler import available_cpu_count, build_calibration, measure_throughput
+
+
+def _powers_of_two(limit):
+    values, value = [], 1
+    while value <= limit:
+        values.append(value)
+        value *= 2
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+class Command(BaseCommand):
+    help = "量測各 (process 數 x 執行緒數) 組合的推論吞吐量，寫入 CPU 推論排程校正檔。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, action='append', default=[],
+                            help="要量測的 process 數 (可重複指定)；預設為 1, 2, 4 ... 到可用 CPU 數。")
+        parser.add_argument('--threads', type=int, action='append', default=[],
+                            help="要量測的每個 process 執行緒數 (可重複指定)；預設為 1, 2, 4 ... 到可用 CPU 數。")
+        parser.add_argument('--seconds', type=float, default=10.0, help="每個組合的量測秒數 (預設 10)。")
+        parser.add_argument('--width', type=int, default=1920, help="合成畫面寬度 (預設 1920)。")
+        parser.add_argument('--height', type=int, default=1080, help="合成畫面高度 (預設 1080)。")
+        parser.add_argument('--allow-oversubscription', action='store_true',
+                            help="也量測 process 數 x 執行緒數超過可用 CPU 數的組合。")
+        parser.add_argument('--output', help="校正檔路徑 (預設 settings.INFERENCE_SCHEDULER_CONFIG_PATH)。")
+        parser.add_argument('--dry-run', action='store_true', help="只輸出結果，不寫入校正檔。")
+
+    def handle(self, *args, **options):
+        cpus = available_cpu_count()
+        process_counts = sorted(set(options['processes'] or _powers_of_two(cpus)))
+        thread_counts = sorted(set(options['threads'] or _powers_of_two(cpus)))
+        combinations = [(p, t) for p in process_counts for t in thread_counts
+                        if p > 0 and t > 0 and (options['allow_oversubscription'] or p * t <= cpus)]
+        if not combinations:
+            raise CommandError(f"沒有可量測的組合 (可用 CPU {cpus})。")
+
+        self.stdout.write(f"可用 CPU: {cpus}，量測 {len(combinations)} 個組合，每個 {options['seconds']} 秒")
+        results = []
+        for processes, threads in combinations:
+            try:
+                images_per_second = measure_throughput(processes, threads, seconds=options['seconds'],
+                                                       frame_shape=(options['height'], options['width']))
+            except RuntimeError as e:
+                raise CommandError(f"量測 {processes} x {threads} 失敗: {e}")
+            results.append({'processes': processes, 'threads': threads,
+                            'images_per_second': round(images_per_second, 2)})
+            self.stdout.write(f"  {processes:>3} process x {threads:>3} 執行緒: {images_per_second:8.2f} img/s")
+
+        calibration = build_calibration(results, cpus)
+        best = calibration['best']
+        self.stdout.write(f"最佳組合: {best['processes']} process x {best['threads']} 執行緒 "
+                          f"({best['images_per_second']} img/s)；各並行數的執行緒數: {calibration['threads_by_concurrency']}")
+        if options['dry_run']:
+            self.stdout.write(json.dumps(calibration, indent=2, ensure_ascii=False))
+            return
+
+        output = options['output'] or settings.INFERENCE_SCHEDULER_CONFIG_PATH
+        with open(output, 'w') as f:
+            json.dump(calibration, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(f"校正結果已寫入 {output}"))
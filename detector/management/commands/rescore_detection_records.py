@@ -0,0 +1,108 @@
+# detector/management/commands/rescore_detection_records.py
+# ------------------------------------------------
+# 依目前的嚴重程度評分參數重新計算既有 DetectionRecord 的 severity_score。
+# 以主鍵 keyset 分頁逐塊讀取 (只取 id / batch_job_id / results_data / severity_score)，
+# 每塊以向量化評分後 bulk_update，不載入完整 model、不觸發逐筆 save()。
+# 受影響的已完成批次最後以 rebuild_batch_aggregates (SQL 彙總) 重算統計與摘要。
+# ------------------------------------------------
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from detector.models import DetectionRecord, DetectionBox, BatchDetectionJob
+from detector.severity import score_detection_batch, get_severity_class_params
+from detector.batch_aggregates import build_batch_summary, rebuild_batch_aggregates
+
+
+class Command(BaseCommand):
+    help = "以目前的評分參數 (DETECTOR_SEVERITY_CLASS_PARAMS) 分塊重新計算所有辨識紀錄的嚴重程度評分。"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="每次讀取與更新的紀錄數 (預設 2000)。")
+        parser.add_argument('--batch-job', default=None, help="只重新評分指定批次任務 ID 的紀錄。")
+        parser.add_argument('--dry-run', action='store_true', help="只計算會變動的筆數，不寫入資料庫。")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        dry_run = options['dry_run']
+        class_params = get_severity_class_params()
+
+        qs = DetectionRecord.objects.all()
+        if options['batch_job']:
+            qs = qs.filter(batch_job_id=options['batch_job'])
+
+        scanned = changed = 0
+        touched_batches = set()
+        started = time.monotonic()
+        last_id = None
+
+        while True:
+            page = qs.order_by('id')
+            if last_id is not None:
+                page = page.filter(id__gt=last_id)
+            rows = list(page.values_list('id', 'batch_job_id', 'results_data', 'severity_score')[:chunk_size])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            scanned += len(rows)
+
+            new_scores = score_detection_batch([row[2] for row in rows], class_params)
+            updates = []
+            for (record_id, batch_job_id, results_data, old_score), new_score in zip(rows, new_scores):
+                if results_data and not isinstance(results_data, list):
+                    # 錯誤記錄：與 calculate_severity_score 相同，保留原分數
+                    continue
+                if new_score == old_score:
+                    continue
+                updates.append((record_id, batch_job_id, results_data, old_score, new_score))
+
+            changed += len(updates)
+            if updates and not dry_run:
+                self._apply_chunk(updates, chunk_size)
+                touched_batches.update(u[1] for u in updates if u[1] is not None)
+
+            elapsed = time.monotonic() - started
+            self.stdout.write(f"已掃描 {scanned} 筆，需更新 {changed} 筆 ({scanned / elapsed:.0f} 筆/秒)")
+
+        if touched_batches:
+            self._rebuild_batches(touched_batches)
+
+        elapsed = time.monotonic() - started
+        verb = "將會更新" if dry_run else "已更新"
+        self.stdout.write(self.style.SUCCESS(
+            f"完成：掃描 {scanned} 筆，{verb} {changed} 筆，涉及 {len(touched_batches)} 個批次，耗時 {elapsed:.1f} 秒。"
+        ))
+
+    def _apply_chunk(self, updates, chunk_size):
+        """寫入一塊的新分數 (批次統計在全部更新後由 _rebuild_batches 以 SQL 重算)。"""
+        with transaction.atomic():
+            DetectionRecord.objects.bulk_update(
+                [DetectionRecord(id=u[0], severity_score=u[4]) for u in updates],
+                ['severity_score'], batch_size=chunk_size,
+            )
+
+    def _rebuild_batches(self, batch_ids):
+        """
+        以 rebuild_batch_aggregates 重算受影響批次的統計，再以重算後的值更新已完成批次的 summary_results。
+        不以差值遞增：migration 0005 之前完成的批次沒有回填累計值與類別統計，在零值上套用差值會得到錯誤的摘要。
+        仍在處理中的批次略過，由 finalize_batch_processing_task 彙總時重算。
+        """
+        in_progress = (BatchDetectionJob.StatusChoices.PENDING, BatchDetectionJob.StatusChoices.PROCESSING)
+        for batch in BatchDetectionJob.objects.filter(id__in=batch_ids).exclude(status__in=in_progress):
+            self._backfill_detection_boxes(batch.id)
+            rebuild_batch_aggregates(batch.id)
+            if not batch.summary_results:
+                continue
+            batch.refresh_from_db()
+            summary = build_batch_summary(batch)
+            # 保留彙總任務寫入的其他欄位 (例如錯誤訊息)
+            batch.summary_results = {**batch.summary_results, **summary}
+            batch.save(update_fields=['summary_results'])
+
+    def _backfill_detection_boxes(self, batch_job_id):
+        """舊批次的紀錄可能還沒有 DetectionBox (見 backfill_detection_boxes)，重算前先補寫，否則統計會被歸零。"""
+        rows = DetectionRecord.objects.filter(batch_job_id=batch_job_id, boxes__isnull=True).values_list('id', 'results_data')
+        boxes = []
+        for record_id, results_data in rows.iterator():
+            boxes.extend(DetectionBox.from_results_data(DetectionRecord(id=record_id, results_data=results_data)))
+        if boxes:
+            DetectionBox.objects.bulk_create(boxes, batch_size=2000)
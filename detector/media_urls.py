@@ -0,0 +1,167 @@
+# detector/media_urls.py
+# ------------------------------------------------
+# 預簽名 (presigned) URL 快取：AWS_QUERYSTRING_AUTH = True 時每次 .url 都要計算一次 SigV4 簽章，
+# 列表頁每列至少兩次。這裡以 (bucket, storage key) 為 key 快取簽好的 URL，
+# 先查 process 記憶體，再查 Redis (多個 web/worker process 共用)，都沒有才簽章。
+# 快取時間一定短於 AWS_QUERYSTRING_EXPIRE，取出的 URL 至少還有 (EXPIRE - TTL) 秒有效。
+# ------------------------------------------------
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .redis_client import get_redis_client
+
+url_cache_logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'detector:presign'
+MIN_REMAINING_VALIDITY = 60  # 取出的 URL 至少還要有效的秒數
+
+_local_cache = OrderedDict()  # cache key -> (url, expires_at)
+_local_lock = threading.Lock()
+
+
+def is_enabled():
+    return getattr(settings, 'PRESIGNED_URL_CACHE_ENABLED', True)
+
+
+def get_cache_ttl(querystring_expire=None):
+    """快取秒數：預設為簽章有效時間的 3/4，且一定比有效時間短至少 MIN_REMAINING_VALIDITY 秒。"""
+    expire = querystring_expire or getattr(settings, 'AWS_QUERYSTRING_EXPIRE', 3600)
+    ttl = getattr(settings, 'PRESIGNED_URL_CACHE_TTL', None) or int(expire * 0.75)
+    return max(0, min(ttl, expire - MIN_REMAINING_VALIDITY))
+
+
+def _cache_key(storage, name):
+    return f"{KEY_PREFIX}:{getattr(storage, 'bucket_name', '') or ''}:{name}"
+
+
+def _local_get(key, now):
+    with _local_lock:
+        entry = _local_cache.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del _local_cache[key]
+            return None
+        _local_cache.move_to_end(key)
+        return entry[0]
+
+
+def _local_set(key, url, expires_at):
+    max_entries = getattr(settings, 'PRESIGNED_URL_LOCAL_CACHE_SIZE', 10000)
+    with _local_lock:
+        _local_cache[key] = (url, expires_at)
+        _local_cache.move_to_end(key)
+        while len(_local_cache) > max_entries:
+            _local_cache.popitem(last=False)
+
+
+def get_presigned_urls(storage, names, sign):
+    """
+    取得多個檔案的簽名 URL (記憶體 -> Redis MGET -> 簽章並以 pipeline 寫回 Redis)。
+
+    Args:
+        storage: S3 storage 實例 (用於組成快取 key 與決定簽章有效時間)。
+        names: storage 內的檔名列表。
+        sign: callable(name) -> url，實際產生簽名 URL。
+
+    Returns:
+        dict: name -> url。
+    """
+    ttl = get_cache_ttl(getattr(storage, 'querystring_expire', None))
+    names = [name for name in dict.fromkeys(names) if name]
+    if not is_enabled() or ttl <= 0:
+        return {name: sign(name) for name in names}
+
+    now = time.time()
+    urls, missing = {}, []
+    for name in names:
+        url = _local_get(_cache_key(storage, name), now)
+        if url is None:
+            missing.append(name)
+        else:
+            urls[name] = url
+    if not missing:
+        return urls
+
+    # Redis 中的值為 "<expires_at>|<url>"，讓各 process 的記憶體快取與 Redis 同時過期
+    client = None
+    try:
+        client = get_redis_client()
+        cached_values = client.mget([_cache_key(storage, name) for name in missing])
+    except Exception as e:
+        url_cache_logger.warning(f"預簽名 URL 快取讀取失敗 (改為直接簽章): {e}")
+        cached_values = [None] * len(missing)
+
+    to_sign = []
+    for name, value in zip(missing, cached_values):
+        if value:
+            expires_at, _, url = value.decode().partition('|')
+            if float(expires_at) > now:
+                urls[name] = url
+                _local_set(_cache_key(storage, name), url, float(expires_at))
+                continue
+        to_sign.append(name)
+
+    if to_sign:
+        expires_at = now + ttl
+        signed = {name: sign(name) for name in to_sign}
+        urls.update(signed)
+        for name, url in signed.items():
+            _local_set(_cache_key(storage, name), url, expires_at)
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for name, url in signed.items():
+                    pipe.set(_cache_key(storage, name), f"{expires_at}|{url}", ex=ttl)
+                pipe.execute()
+            except Exception as e:
+                url_cache_logger.warning(f"預簽名 URL 快取寫入失敗 (略過): {e}")
+    return urls
+
+
+def invalidate_presigned_url(storage, name):
+    """檔案刪除時移除快取的 URL。"""
+    invalidate_presigned_urls(storage, [name])
+
+
+def invalidate_presigned_urls(storage, names):
+    """批次刪除檔案 (見 bulk_delete.py) 時一次移除多個快取的 URL (一次 Redis DEL)。"""
+    keys = [_cache_key(storage, name) for name in names if name]
+    if not keys:
+        return
+    with _local_lock:
+        for key in keys:
+            _local_cache.pop(key, None)
+    try:
+        get_redis_client().delete(*keys)
+    except Exception as e:
+        url_cache_logger.debug(f"移除預簽名 URL 快取失敗 (略過): {e}")
+
+
+def prime_media_urls(instances, field_names=('original_image', 'annotated_image')):
+    """
+    一次為多個 model 實例的圖片欄位取得簽名 URL (一次 Redis MGET + 批次簽章)，
+    之後模板中的 .url 會直接命中 process 記憶體快取。storage 不支援批次時不做任何事。
+
+    field_names 的元素也可以是 tuple，代表「依序取第一個有檔案的欄位」，
+    例如 ('original_thumbnail', 'original_image') 對應模板中縮圖優先、退回原圖的預覽。
+    """
+    names_by_storage = {}
+    for instance in instances:
+        for field_name in field_names:
+            candidates = field_name if isinstance(field_name, tuple) else (field_name,)
+            for candidate in candidates:
+                field_file = getattr(instance, candidate, None)
+                if field_file and field_file.name:
+                    names_by_storage.setdefault(field_file.storage, []).append(field_file.name)
+                    break
+
+    for storage, names in names_by_storage.items():
+        if not hasattr(storage, 'urls'):
+            continue
+        try:
+            storage.urls(names)
+        except Exception as e:
+            url_cache_logger.warning(f"批次取得預簽名 URL 失敗 (略過): {e}")
@@ -0,0 +1,165 @@
+# detector/metrics.py
+# ------------------------------------------------
+# Prometheus 指標：各處理階段耗時、任務排隊時間、圖片處理數與批次吞吐量。
+# gunicorn / celery prefork 有多個 process，指標以 prometheus_client 的 multiprocess 模式
+# 寫入 PROMETHEUS_MULTIPROC_DIR (由 settings 設定，須在匯入 prometheus_client 之前)，
+# 讀取時再由 MultiProcessCollector 彙總：
+#   - web:    /metrics (metrics_view)
+#   - worker: celery 主 process 在 METRICS_WORKER_PORT 啟動的 HTTP exporter (見 install_celery_metrics)
+# ------------------------------------------------
+import logging
+import os
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY,
+    generate_latest, multiprocess, start_http_server,
+)
+
+metrics_logger = logging.getLogger(__name__)
+
+PUBLISHED_AT_HEADER = 'detector_published_at'  # before_task_publish 加入的訊息 header (epoch 秒)
+
+# 單張圖片各階段多為數毫秒到數秒；批次推論與上傳可能更久
+_STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_QUEUE_WAIT_BUCKETS = (0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+STAGE_SECONDS = Histogram(
+    'detector_stage_seconds',
+    '各處理階段耗時 (s3_get / decode / inference / inference_batch / inference_tiled / plot / encode / thumbnail / upload / db_save)',
+    ['stage'], buckets=_STAGE_BUCKETS,
+)
+IMAGES_PROCESSED = Counter(
+    'detector_images_processed_total',
+    '處理完成的 S3 圖片數', ['outcome'],
+)
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    'detector_task_queue_wait_seconds',
+    'Celery 任務從發布到開始執行的等待時間', ['task'], buckets=_QUEUE_WAIT_BUCKETS,
+)
+TASK_RUNTIME_SECONDS = Histogram(
+    'detector_task_runtime_seconds',
+    'Celery 任務執行時間', ['task'], buckets=_STAGE_BUCKETS + (300, 900, 3600),
+)
+BATCH_IMAGES_PER_SECOND = Histogram(
+    'detector_batch_images_per_second',
+    '已完成批次的吞吐量 (成功 + 失敗圖片數 / 批次建立到完成的秒數)',
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50),
+)
+LAST_BATCH_IMAGES_PER_SECOND = Gauge(
+    'detector_last_batch_images_per_second',
+    '最近一個完成批次的吞吐量', multiprocess_mode='mostrecent',
+)
+LAST_BATCH_DURATION_SECONDS = Gauge(
+    'detector_last_batch_duration_seconds',
+    '最近一個完成批次從建立到完成的秒數', multiprocess_mode='mostrecent',
+)
+
+
+_stage_observers = []  # callable(stage, seconds)；供基準測試收集原始樣本 (見 benchmarking.py)
+
+
+def is_multiprocess():
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def add_stage_observer(callback):
+    """註冊 callback(stage, seconds)，每次 stage_timer 結束時呼叫 (Histogram 無法提供百分位數)。"""
+    _stage_observers.append(callback)
+
+
+def remove_stage_observer(callback):
+    if callback in _stage_observers:
+        _stage_observers.remove(callback)
+
+
+@contextmanager
+def stage_timer(stage):
+    """記錄一個處理階段的耗時 (發生例外時同樣記錄)。用法: with stage_timer('decode'): ..."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started_at
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+        for callback in _stage_observers:
+            callback(stage, seconds)
+
+
+def record_batch_throughput(batch_job):
+    """
+    批次完成時記錄吞吐量 (由 finalize_batch_processing_task 在儲存最終狀態後呼叫，
+    此時 updated_at 即為完成時間)。
+    """
+    if not batch_job.created_at or not batch_job.updated_at:
+        return
+    duration = (batch_job.updated_at - batch_job.created_at).total_seconds()
+    if duration <= 0:
+        return
+    images = batch_job.images_processed_successfully + batch_job.images_failed_to_process
+    images_per_second = images / duration
+    BATCH_IMAGES_PER_SECOND.observe(images_per_second)
+    LAST_BATCH_IMAGES_PER_SECOND.set(images_per_second)
+    LAST_BATCH_DURATION_SECONDS.set(duration)
+
+
+def build_registry():
+    """multiprocess 模式下回傳彙總所有 process 的 registry，否則回傳預設 registry。"""
+    if not is_multiprocess():
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_latest():
+    """回傳 (Prometheus 文字格式內容, content type)。"""
+    return generate_latest(build_registry()), CONTENT_TYPE_LATEST
+
+
+# ====== Celery 整合 ======
+def _on_before_task_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+
+def _on_task_prerun(task=None, **kwargs):
+    if task is None:
+        return
+    task.request._detector_started_at = time.perf_counter()
+    published_at = getattr(task.request, PUBLISHED_AT_HEADER, None)
+    if published_at:
+        TASK_QUEUE_WAIT_SECONDS.labels(task=task.name).observe(max(0.0, time.time() - float(published_at)))
+
+
+def _on_task_postrun(task=None, **kwargs):
+    started_at = getattr(task.request, '_detector_started_at', None) if task is not None else None
+    if started_at is not None:
+        TASK_RUNTIME_SECONDS.labels(task=task.name).observe(time.perf_counter() - started_at)
+
+
+def _on_worker_init(**kwargs):
+    port = getattr(settings, 'METRICS_WORKER_PORT', 0)
+    if not port:
+        return
+    try:
+        start_http_server(port, registry=build_registry())
+        metrics_logger.info(f"Celery worker 指標 exporter 已啟動於 :{port}/metrics")
+    except OSError as e:
+        metrics_logger.warning(f"無法啟動 Celery worker 指標 exporter (port {port}): {e}")
+
+
+def _on_worker_process_shutdown(pid=None, **kwargs):
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+def install_celery_metrics():
+    """連接 Celery signals (由 detector_project/celery.py 呼叫)。"""
+    from celery import signals
+    signals.before_task_publish.connect(_on_before_task_publish, weak=False)
+    signals.task_prerun.connect(_on_task_prerun, weak=False)
+    signals.task_postrun.connect(_on_task_postrun, weak=False)
+    signals.worker_init.connect(_on_worker_init, weak=False)
+    signals.worker_process_shutdown.connect(_on_worker_process_shutdown, weak=False)
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0003_alter_detectionrecord_batch_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchdetectionjob',
+            name='finalization_dispatched',
+            field=models.BooleanField(default=False, verbose_name='已分派彙總任務'),
+        ),
+        migrations.AddField(
+            model_name='batchdetectionjob',
+            name='listing_completed',
+            field=models.BooleanField(default=False, verbose_name='S3 列表已完成'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0004_batchdetectionjob_listing_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchdetectionjob',
+            name='healthy_boxes',
+            field=models.IntegerField(default=0, verbose_name='健康檢測框數'),
+        ),
+        migrations.AddField(
+            model_name='batchdetectionjob',
+            name='severity_score_count',
+            field=models.IntegerField(default=0, verbose_name='已評分圖片數'),
+        ),
+        migrations.AddField(
+            model_name='batchdetectionjob',
+            name='severity_score_sum',
+            field=models.FloatField(default=0.0, verbose_name='嚴重程度評分總和'),
+        ),
+        migrations.AddField(
+            model_name='batchdetectionjob',
+            name='total_boxes',
+            field=models.IntegerField(default=0, verbose_name='總檢測框數'),
+        ),
+        migrations.CreateModel(
+            name='BatchClassStatistic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_name', models.CharField(max_length=255, verbose_name='類別名稱')),
+                ('detection_count', models.IntegerField(default=0, verbose_name='檢測框數')),
+                ('severity_sum', models.FloatField(default=0.0, verbose_name='嚴重程度評分總和')),
+                ('image_count', models.IntegerField(default=0, verbose_name='圖片數')),
+                ('batch_job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='class_statistics', to='detector.batchdetectionjob', verbose_name='所屬批次任務')),
+            ],
+            options={
+                'verbose_name': '批次類別統計',
+                'verbose_name_plural': '批次類別統計',
+                'constraints': [models.UniqueConstraint(fields=('batch_job', 'class_name'), name='uniq_batch_class_statistic')],
+            },
+        ),
+    ]
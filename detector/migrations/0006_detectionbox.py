@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0005_batch_incremental_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DetectionBox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('class_id', models.IntegerField(blank=True, null=True, verbose_name='類別 ID')),
+                ('class_name', models.CharField(max_length=255, verbose_name='類別名稱')),
+                ('confidence', models.FloatField(verbose_name='信心度')),
+                ('x1', models.FloatField(blank=True, null=True)),
+                ('y1', models.FloatField(blank=True, null=True)),
+                ('x2', models.FloatField(blank=True, null=True)),
+                ('y2', models.FloatField(blank=True, null=True)),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='boxes', to='detector.detectionrecord', verbose_name='所屬辨識紀錄')),
+            ],
+            options={
+                'verbose_name': '檢測框',
+                'verbose_name_plural': '檢測框',
+                'indexes': [models.Index(fields=['class_name', 'confidence'], name='detbox_class_conf_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0006_detectionbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batchdetectionjob',
+            index=models.Index(fields=['-created_at', '-id'], name='batchjob_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionrecord',
+            index=models.Index(condition=models.Q(('severity_score__isnull', False)), fields=['batch_job', '-severity_score', '-uploaded_at', '-id'], name='detrec_batch_scored_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='detectionrecord',
+            index=models.Index(condition=models.Q(('severity_score__isnull', True)), fields=['batch_job', '-uploaded_at', '-id'], name='detrec_batch_unscored_idx'),
+        ),
+    ]
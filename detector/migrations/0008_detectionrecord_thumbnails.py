@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:55
+
+import detector.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectionrecord',
+            name='annotated_thumbnail',
+            field=models.ImageField(blank=True, max_length=255, null=True, upload_to=detector.models.get_thumbnail_upload_path, verbose_name='標註結果縮圖'),
+        ),
+        migrations.AddField(
+            model_name='detectionrecord',
+            name='original_thumbnail',
+            field=models.ImageField(blank=True, max_length=255, null=True, upload_to=detector.models.get_thumbnail_upload_path, verbose_name='原始圖片縮圖'),
+        ),
+    ]
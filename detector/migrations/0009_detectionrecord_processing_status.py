@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0008_detectionrecord_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectionrecord',
+            name='processing_status',
+            field=models.CharField(choices=[('PENDING', '等待辨識'), ('PROCESSING', '辨識中'), ('COMPLETED', '已完成'), ('FAILED', '失敗')], default='COMPLETED', max_length=20, verbose_name='處理狀態'),
+        ),
+    ]
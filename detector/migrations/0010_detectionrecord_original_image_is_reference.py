@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('detector', '0009_detectionrecord_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='detectionrecord',
+            name='original_image_is_reference',
+            field=models.BooleanField(default=False, help_text='為 True 時刪除紀錄不會刪除原始圖片 (來源物件由上傳端管理)', verbose_name='原始圖片為引用的來源物件'),
+        ),
+    ]
@@ -0,0 +1,107 @@
+# detector/model_backends.py
+# ------------------------------------------------
+# YOLO 推論後端選擇：PyTorch / ONNX Runtime / OpenVINO
+# 匯出後的模型檔以權重檔 hash 為 key，快取在權重檔旁邊，只需匯出一次。
+# ------------------------------------------------
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+BACKEND_PYTORCH = 'pytorch'
+BACKEND_ONNX = 'onnx'
+BACKEND_OPENVINO = 'openvino'
+SUPPORTED_BACKENDS = (BACKEND_PYTORCH, BACKEND_ONNX, BACKEND_OPENVINO)
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_weights_hash(weights_path):
+    """計算權重檔的 sha256 (hex)。"""
+    digest = hashlib.sha256()
+    with open(weights_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_exported_model_path(weights_path, backend, weights_hash):
+    """
+    回傳匯出模型的快取路徑，例如:
+      yolo/best.3f2a9c1d4e5b.onnx
+      yolo/best_3f2a9c1d4e5b_openvino_model/
+    """
+    base_dir = os.path.dirname(weights_path)
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    short_hash = weights_hash[:12]
+    if backend == BACKEND_ONNX:
+        return os.path.join(base_dir, f"{stem}.{short_hash}.onnx")
+    if backend == BACKEND_OPENVINO:
+        return os.path.join(base_dir, f"{stem}_{short_hash}_openvino_model")
+    raise ValueError(f"Backend '{backend}' does not use an exported artifact.")
+
+
+def _export_model(weights_path, backend, target_path, imgsz):
+    """
+    使用 ultralytics 匯出模型，並移動到以 hash 命名的快取路徑。
+    以檔案鎖避免多個 process 同時匯出同一個權重檔。
+    """
+    from ultralytics import YOLO
+
+    lock_path = f"{weights_path}.export.lock"
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(target_path):
+                # 其他 process 已在我們等待鎖時完成匯出
+                return target_path
+
+            logger.info(f"匯出 YOLO 模型 ({backend}) 至 {target_path} ...")
+            # dynamic=True 讓匯出的模型可接受不同的 batch 大小 (批次推論需要)
+            exported = YOLO(weights_path).export(format=backend, imgsz=imgsz, dynamic=True)
+            exported = str(exported)
+            if os.path.abspath(exported) != os.path.abspath(target_path):
+                if os.path.isdir(target_path):
+                    shutil.rmtree(target_path)
+                shutil.move(exported, target_path)
+            logger.info(f"YOLO 模型匯出完成: {target_path}")
+            return target_path
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_yolo_model(weights_path, backend=BACKEND_PYTORCH, imgsz=640):
+    """
+    依指定後端載入 YOLO 模型。
+
+    非 PyTorch 後端會先檢查快取的匯出檔，不存在時才匯出。
+    任何後端的回傳物件皆為 ultralytics.YOLO，因此 `names` 與 Results/boxes 介面一致。
+    匯出或載入失敗時退回 PyTorch 後端。
+
+    Returns:
+        (model, weights_hash, backend_in_use)
+    """
+    from ultralytics import YOLO
+
+    backend = (backend or BACKEND_PYTORCH).lower()
+    if backend not in SUPPORTED_BACKENDS:
+        logger.warning(f"未知的推論後端 '{backend}'，改用 {BACKEND_PYTORCH}。支援: {SUPPORTED_BACKENDS}")
+        backend = BACKEND_PYTORCH
+
+    weights_hash = compute_weights_hash(weights_path)
+
+    if backend != BACKEND_PYTORCH:
+        try:
+            exported_path = get_exported_model_path(weights_path, backend, weights_hash)
+            if not os.path.exists(exported_path):
+                _export_model(weights_path, backend, exported_path, imgsz)
+            else:
+                logger.info(f"使用快取的 {backend} 模型: {exported_path}")
+            return YOLO(exported_path, task='detect'), weights_hash, backend
+        except Exception as e:
+            logger.error(f"載入 {backend} 後端失敗，改用 {BACKEND_PYTORCH}: {e}", exc_info=True)
+
+    return YOLO(weights_path), weights_hash, BACKEND_PYTORCH
@@ -1,7 +1,10 @@
 from django.db import models
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 import uuid # 用於產生不會重複的 ID
 import os
 from django.utils import timezone
+from .severity import score_detections
 
 class BatchDetectionJob(models.Model):
     """
@@ -30,6 +33,16 @@ class BatchDetectionJob(models.Model):
     total_images_found = models.IntegerField(default=0, verbose_name="找到的圖片總數")
     images_processed_successfully = models.IntegerField(default=0, verbose_name="成功處理圖片數")
     images_failed_to_process = models.IntegerField(default=0, verbose_name="處理失敗圖片數")
+    # 逐頁列出 S3 物件並即時分派：列表全部完成後才可能進入彙總
+    listing_completed = models.BooleanField(default=False, verbose_name="S3 列表已完成")
+    # 彙總任務是否已分派 (避免多個子任務同時觸發彙總)
+    finalization_dispatched = models.BooleanField(default=False, verbose_name="已分派彙總任務")
+
+    # 子任務完成時以原子遞增累加的統計值 (批次摘要直接由這些欄位與 BatchClassStatistic 產生)
+    severity_score_sum = models.FloatField(default=0.0, verbose_name="嚴重程度評分總和")
+    severity_score_count = models.IntegerField(default=0, verbose_name="已評分圖片數")
+    total_boxes = models.IntegerField(default=0, verbose_name="總檢測框數")
+    healthy_boxes = models.IntegerField(default=0, verbose_name="健康檢測框數")
 
     # 用於儲存整個批次的摘要結果，例如整體健康狀況描述、各類病害的統計數字等
     summary_results = models.JSONField(null=True, blank=True, verbose_name="批次摘要結果")
@@ -46,6 +59,36 @@ class BatchDetectionJob(models.Model):
         ordering = ['-created_at']
         verbose_name = "批次辨識任務"
         verbose_name_plural = "批次辨識任務"
+        indexes = [
+            # 批次歷史列表的 keyset 分頁 (created_at DESC, id DESC)
+            models.Index(fields=['-created_at', '-id'], name='batchjob_created_id_idx'),
+        ]
+
+class BatchClassStatistic(models.Model):
+    """
+    批次中每個類別的累計統計，由子任務完成時以原子遞增更新。
+    """
+    batch_job = models.ForeignKey(
+        BatchDetectionJob,
+        on_delete=models.CASCADE,
+        related_name='class_statistics',
+        verbose_name="所屬批次任務"
+    )
+    class_name = models.CharField(max_length=255, verbose_name="類別名稱")
+    detection_count = models.IntegerField(default=0, verbose_name="檢測框數")
+    # 含有此類別的圖片之嚴重程度評分總和與圖片數 (用於計算類別平均嚴重程度)
+    severity_sum = models.FloatField(default=0.0, verbose_name="嚴重程度評分總和")
+    image_count = models.IntegerField(default=0, verbose_name="圖片數")
+
+    def __str__(self):
+        return f"{self.batch_job_id} - {self.class_name}: {self.detection_count}"
+
+    class Meta:
+        verbose_name = "批次類別統計"
+        verbose_name_plural = "批次類別統計"
+        constraints = [
+            models.UniqueConstraint(fields=['batch_job', 'class_name'], name='uniq_batch_class_statistic'),
+        ]
 
 def get_original_image_upload_path(instance, filename):
     """決定原始圖片的上傳路徑"""
@@ -67,7 +110,21 @@ def get_annotated_image_upload_path(instance, filename):
         now = timezone.now()
         return os.path.join('results', 'manual', now.strftime('%Y'), now.strftime('%m'), now.strftime('%d'), filename)
 
+def get_thumbnail_upload_path(instance, filename):
+    """決定縮圖 (原始圖與標註圖共用) 的上傳路徑"""
+    if instance.batch_job_id:
+        return os.path.join('thumbnails', f'batch_{instance.batch_job_id}', filename)
+    else:
+        now = timezone.now()
+        return os.path.join('thumbnails', 'manual', now.strftime('%Y'), now.strftime('%m'), now.strftime('%d'), filename)
+
 class DetectionRecord(models.Model):
+    class ProcessingStatusChoices(models.TextChoices):
+        PENDING = 'PENDING', '等待辨識'      # 非同步上傳：原始圖片已儲存，任務尚未開始
+        PROCESSING = 'PROCESSING', '辨識中'
+        COMPLETED = 'COMPLETED', '已完成'
+        FAILED = 'FAILED', '失敗'
+
     # ... (id, batch_job 欄位保持不變) ...
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     batch_job = models.ForeignKey(
@@ -89,6 +146,17 @@ class DetectionRecord(models.Model):
         null=True, blank=True,
         verbose_name="標註結果圖"
     )
+    # 推論時由記憶體中已解碼的影像產生的縮圖 (列表頁與 admin 預覽用；舊紀錄可能沒有)
+    original_thumbnail = models.ImageField(
+        upload_to=get_thumbnail_upload_path, max_length=255,  # 批次路徑含兩個 UUID，超過預設的 100
+        null=True, blank=True,
+        verbose_name="原始圖片縮圖"
+    )
+    annotated_thumbnail = models.ImageField(
+        upload_to=get_thumbnail_upload_path, max_length=255,  # 批次路徑含兩個 UUID，超過預設的 100
+        null=True, blank=True,
+        verbose_name="標註結果縮圖"
+    )
 
     # ... (results_data, severity_score, uploaded_at, __str__, Meta, calculate_severity_score, save 方法保持不變) ...
     results_data = models.JSONField(
@@ -105,6 +173,26 @@ class DetectionRecord(models.Model):
         auto_now_add=True,
         verbose_name="上傳時間"
     )
+    # 同步流程與批次任務寫入的紀錄一律為 COMPLETED；
+    # 非同步上傳 (DETECTOR_ASYNC_UPLOADS) 由 process_uploaded_image_task 更新
+    processing_status = models.CharField(
+        max_length=20,
+        choices=ProcessingStatusChoices.choices,
+        default=ProcessingStatusChoices.COMPLETED,
+        verbose_name="處理狀態"
+    )
+
+    # BATCH_ORIGINAL_IMAGE_MODE=reference 時 original_image 直接指向 rover 上傳的來源物件，
+    # 該物件不屬於這筆紀錄：刪除紀錄 (django-cleanup / bulk_delete) 時不可刪除
+    original_image_is_reference = models.BooleanField(
+        default=False,
+        verbose_name="原始圖片為引用的來源物件",
+        help_text="為 True 時刪除紀錄不會刪除原始圖片 (來源物件由上傳端管理)"
+    )
+
+    # 非資料庫欄位：批次任務的來源物件 (bucket, key)，
+    # 供 BATCH_ORIGINAL_IMAGE_MODE 為 copy / reference 時沿用 S3 上既有的原始圖片 (見 s3_originals.py)
+    source_s3_object = None
 
     def __str__(self):
         if self.batch_job:
@@ -115,64 +203,30 @@ class DetectionRecord(models.Model):
         ordering = ['-uploaded_at']
         verbose_name = "辨識紀錄"
         verbose_name_plural = "辨識紀錄"
+        indexes = [
+            # 批次詳情頁的 keyset 分頁：有評分 / 未評分的紀錄各用一個部分索引 (見 pagination.py)
+            models.Index(
+                fields=['batch_job', '-severity_score', '-uploaded_at', '-id'],
+                name='detrec_batch_scored_idx',
+                condition=models.Q(severity_score__isnull=False),
+            ),
+            models.Index(
+                fields=['batch_job', '-uploaded_at', '-id'],
+                name='detrec_batch_unscored_idx',
+                condition=models.Q(severity_score__isnull=True),
+            ),
+        ]
 
     def calculate_severity_score(self):
         if not self.results_data:
             self.severity_score = None
             return
+        if not isinstance(self.results_data, list):
+            # 錯誤記錄 (results_data 為 {'error': ...})，保留呼叫端設定的分數
+            return
 
-        # 可擴展的 class 參數設定
-        CLASS_PARAMS = {
-            'angular leaf spot': {
-                'base': 0.4,
-                'confidence_factor': 0.6,
-                'per_detection_bonus': 0.05,
-            },
-            'healthy': {
-                'base': 0.05,
-                'confidence_factor': 0.05,
-                'per_detection_bonus': 0.0,
-            },
-            # 其他病害可在此擴充
-        }
-
-        # 統計每個 class 的 confidence
-        class_confidences = {}
-        for detection in self.results_data:
-            class_name = detection.get('class', '').strip().lower()
-            confidence = detection.get('confidence_float', 0.0)
-            class_confidences.setdefault(class_name, []).append(confidence)
-
-        # 先處理所有病害類別（排除 healthy）
-        disease_scores = []
-        for cls, params in CLASS_PARAMS.items():
-            if cls == 'healthy':
-                continue
-            if cls in class_confidences:
-                confs = class_confidences[cls]
-                score = params['base']
-                if confs:
-                    score += max(confs) * params['confidence_factor']
-                    score += (len(confs) - 1) * params['per_detection_bonus'] if len(confs) > 0 else 0
-                disease_scores.append(score)
-
-        # 取所有病害分數的最大值（最嚴重的病害為主）
-        if disease_scores:
-            final_score = max(disease_scores)
-        elif 'healthy' in class_confidences:
-            # 只檢測到 healthy
-            healthy_confs = class_confidences['healthy']
-            final_score = CLASS_PARAMS['healthy']['base']
-            if healthy_confs:
-                final_score = max(0, final_score - max(healthy_confs) * CLASS_PARAMS['healthy']['confidence_factor'])
-        else:
-            # 既沒有病害也沒有 healthy，但有其他未知類別
-            final_score = 0.2
-
-        # 標準化分數到 0.0 - 1.0
-        self.severity_score = min(max(final_score, 0.0), 1.0)
-        if self.severity_score is not None:
-            self.severity_score = round(self.severity_score, 2)
+        # 評分規則與類別參數見 detector/severity.py (可由 settings.DETECTOR_SEVERITY_CLASS_PARAMS 覆寫)
+        self.severity_score = score_detections(self.results_data)
 
     def save(self, *args, **kwargs):
         self.calculate_severity_score()
@@ -181,3 +235,62 @@ class DetectionRecord(models.Model):
     # (重要) 覆寫 delete 方法，以便在刪除資料庫記錄時，也刪除對應的圖片檔案
     def delete(self, *args, **kwargs):
         super().delete(*args, **kwargs)
+
+
+@receiver(pre_delete, sender=DetectionRecord)
+def keep_referenced_original_image(sender, instance, **kwargs):
+    """
+    引用的來源物件不屬於這筆紀錄：在 django-cleanup 的 post_delete 刪除檔案之前清空檔名，
+    只刪除紀錄本身產生的檔案 (標註圖、縮圖)。
+    """
+    if instance.original_image_is_reference:
+        instance.original_image.name = None
+
+
+class DetectionBox(models.Model):
+    """
+    單一檢測框 (results_data 中每個檢測結果的結構化版本)，
+    在儲存 DetectionRecord 時以 bulk_create 寫入，供依類別 / 信心度查詢與 SQL 彙總使用。
+    """
+    record = models.ForeignKey(
+        DetectionRecord,
+        on_delete=models.CASCADE,
+        related_name='boxes',
+        verbose_name="所屬辨識紀錄"
+    )
+    class_id = models.IntegerField(null=True, blank=True, verbose_name="類別 ID")
+    class_name = models.CharField(max_length=255, verbose_name="類別名稱")
+    confidence = models.FloatField(verbose_name="信心度")
+    # 原始圖片座標 (左上 x1, y1 / 右下 x2, y2)；舊資料沒有座標時為 None
+    x1 = models.FloatField(null=True, blank=True)
+    y1 = models.FloatField(null=True, blank=True)
+    x2 = models.FloatField(null=True, blank=True)
+    y2 = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.class_name} ({self.confidence:.2f}) - {self.record_id}"
+
+    class Meta:
+        verbose_name = "檢測框"
+        verbose_name_plural = "檢測框"
+        # record 外鍵本身已有索引
+        indexes = [
+            models.Index(fields=['class_name', 'confidence'], name='detbox_class_conf_idx'),
+        ]
+
+    @classmethod
+    def from_results_data(cls, record):
+        """由 record.results_data (list) 建立尚未儲存的 DetectionBox 列表；錯誤紀錄回傳空列表。"""
+        if not isinstance(record.results_data, list):
+            return []
+        boxes = []
+        for detection in record.results_data:
+            xyxy = detection.get('xyxy') or [None] * 4
+            boxes.append(cls(
+                record=record,
+                class_id=detection.get('class_id'),
+                class_name=detection.get('class', 'unknown'),
+                confidence=detection.get('confidence_float', 0.0) or 0.0,
+                x1=xyxy[0], y1=xyxy[1], x2=xyxy[2], y2=xyxy[3],
+            ))
+        return boxes
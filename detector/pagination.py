@@ -0,0 +1,124 @@
+# detector/pagination.py
+# ------------------------------------------------
+# Keyset (cursor) 分頁：以上一頁最後一筆的排序鍵作為游標，
+# 每頁只用索引範圍查詢取 page_size + 1 筆，成本與資料總量 (OFFSET) 無關。
+# ------------------------------------------------
+import base64
+import json
+import uuid
+from datetime import datetime
+from django.db.models import Q
+
+DEFAULT_BATCH_RECORDS_PAGE_SIZE = 48
+DEFAULT_BATCH_HISTORY_PAGE_SIZE = 20
+
+
+class InvalidCursor(ValueError):
+    """游標格式錯誤或已被竄改。"""
+    pass
+
+
+def encode_cursor(values):
+    """把排序鍵 (list) 編碼為可放在 URL 中的字串。"""
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """encode_cursor 的反向；格式錯誤時拋出 InvalidCursor。"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+    if not isinstance(values, list):
+        raise InvalidCursor("cursor must be a list")
+    return values
+
+
+def _parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError) as e:
+        raise InvalidCursor(str(e))
+
+
+def _parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError as e:
+        raise InvalidCursor(str(e))
+
+
+def paginate_batch_records(batch_job, cursor=None, page_size=DEFAULT_BATCH_RECORDS_PAGE_SIZE):
+    """
+    批次內的辨識紀錄，依 (severity_score DESC NULLS LAST, uploaded_at DESC, id DESC) 分頁。
+
+    有評分與未評分的紀錄分兩段查詢 (各自對應一個部分索引)：
+    先取有評分的紀錄，不足一頁時再接著取 severity_score 為 NULL 的紀錄。
+
+    Returns:
+        (records, next_cursor)；沒有下一頁時 next_cursor 為 None。
+
+    Raises:
+        InvalidCursor: 游標格式錯誤。
+    """
+    base_qs = batch_job.detection_records.all()
+    scored_qs = base_qs.filter(severity_score__isnull=False).order_by('-severity_score', '-uploaded_at', '-id')
+    unscored_qs = base_qs.filter(severity_score__isnull=True).order_by('-uploaded_at', '-id')
+
+    in_unscored_section = False
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 3:
+            raise InvalidCursor("batch record cursor must have 3 values")
+        severity, uploaded_at, record_id = values[0], _parse_datetime(values[1]), _parse_uuid(values[2])
+        after_time = Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=record_id)
+        if severity is None:
+            in_unscored_section = True
+            unscored_qs = unscored_qs.filter(after_time)
+        else:
+            try:
+                severity = float(severity)
+            except (TypeError, ValueError) as e:
+                raise InvalidCursor(str(e))
+            scored_qs = scored_qs.filter(Q(severity_score__lt=severity) | (Q(severity_score=severity) & after_time))
+
+    records = []
+    if not in_unscored_section:
+        records = list(scored_qs[:page_size + 1])
+    if len(records) <= page_size:
+        records += list(unscored_qs[:page_size + 1 - len(records)])
+
+    has_next = len(records) > page_size
+    records = records[:page_size]
+    next_cursor = None
+    if has_next:
+        last = records[-1]
+        next_cursor = encode_cursor([last.severity_score, last.uploaded_at.isoformat(), str(last.id)])
+    return records, next_cursor
+
+
+def paginate_batch_jobs(queryset, cursor=None, page_size=DEFAULT_BATCH_HISTORY_PAGE_SIZE):
+    """
+    批次任務依 (created_at DESC, id DESC) 分頁。
+
+    Returns:
+        (batch_jobs, next_cursor)；沒有下一頁時 next_cursor 為 None。
+
+    Raises:
+        InvalidCursor: 游標格式錯誤。
+    """
+    qs = queryset.order_by('-created_at', '-id')
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise InvalidCursor("batch job cursor must have 2 values")
+        created_at, job_id = _parse_datetime(values[0]), _parse_uuid(values[1])
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=job_id))
+
+    jobs = list(qs[:page_size + 1])
+    has_next = len(jobs) > page_size
+    jobs = jobs[:page_size]
+    next_cursor = encode_cursor([jobs[-1].created_at.isoformat(), str(jobs[-1].id)]) if has_next else None
+    return jobs, next_cursor
@@ -0,0 +1,34 @@
+# detector/redis_client.py
+# ------------------------------------------------
+# detector app 共用的 Redis 連線 (快取、計數器等，與 Celery broker 分開的 DB)
+# ------------------------------------------------
+import os
+import threading
+import redis
+from django.conf import settings
+
+_clients = {}  # url -> (pid, client)
+_client_lock = threading.Lock()
+
+
+def get_redis_client(url=None):
+    """
+    取得此 process 的 Redis client (內含連線池)；url 未指定時使用 DETECTOR_REDIS_URL。
+    以 pid 判斷是否在 fork 之後，fork 後重新建立，避免子 process 共用父 process 的 socket。
+    """
+    url = url or settings.DETECTOR_REDIS_URL
+    pid = os.getpid()
+    cached = _clients.get(url)
+    if cached is not None and cached[0] == pid:
+        return cached[1]
+
+    with _client_lock:
+        cached = _clients.get(url)
+        if cached is None or cached[0] != pid:
+            client = redis.Redis.from_url(
+                url,
+                socket_timeout=getattr(settings, 'DETECTOR_REDIS_SOCKET_TIMEOUT', 2),
+                socket_connect_timeout=getattr(settings, 'DETECTOR_REDIS_SOCKET_TIMEOUT', 2),
+            )
+            cached = _clients[url] = (pid, client)
+    return cached[1]
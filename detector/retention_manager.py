@@ -4,12 +4,14 @@ from django.utils import timezone
 from datetime import timedelta
 import logging
 from .models import DetectionRecord, BatchDetectionJob
+from .bulk_delete import purge_detection_records, purge_batch_jobs
 
 logger = logging.getLogger(__name__)
 
 class DataRetentionManager:
     """
     管理 DetectionRecord 和 BatchDetectionJob 的數據保留策略。
+    實際刪除交給 bulk_delete.py (分段 DELETE + S3 DeleteObjects)，不使用 queryset.delete() 的逐筆 cascade。
     """
 
     def _get_setting(self, setting_name, default_value):
@@ -32,8 +34,8 @@ class DataRetentionManager:
             count_to_delete = manual_records_qs.count()
             logger.info(f"{log_prefix} [按時間清理手動紀錄] 找到 {count_to_delete} 筆早於 {cutoff_date.strftime('%Y-%m-%d')} (保留 {days_to_keep} 天)。")
             if count_to_delete > 0:
-                info = manual_records_qs.delete()
-                deleted_count = info[0] if isinstance(info, tuple) else 0
+                info = purge_detection_records(manual_records_qs, log_prefix=log_prefix)
+                deleted_count = info['records']
                 logger.info(f"{log_prefix} [按時間清理手動紀錄] 成功刪除 {deleted_count} 筆。詳情: {info}")
             else:
                 logger.info(f"{log_prefix} [按時間清理手動紀錄] 無需刪除。")
@@ -58,8 +60,8 @@ class DataRetentionManager:
                 ids_to_delete = list(manual_records_qs.values_list('id', flat=True)[records_to_keep:])
                 if ids_to_delete:
                     logger.info(f"{log_prefix} [手動記錄-數量清理] 刪除 {num_to_delete} 筆 (IDs: {ids_to_delete[:5]}...)")
-                    info = DetectionRecord.objects.filter(id__in=ids_to_delete).delete()
-                    deleted_count = info[0] if isinstance(info, tuple) else 0
+                    info = purge_detection_records(DetectionRecord.objects.filter(id__in=ids_to_delete), log_prefix=log_prefix)
+                    deleted_count = info['records']
                     logger.info(f"{log_prefix} [手動記錄-數量清理] 已刪除 {deleted_count} 筆。")
                 else:
                     logger.info(f"{log_prefix} [手動記錄-數量清理] 無需刪除 (ids_to_delete 為空)。")
@@ -92,9 +94,9 @@ class DataRetentionManager:
             logger.info(f"{log_prefix} [按時間清理批次] 找到 {count_to_delete} 個批次早于 {cutoff_date.strftime('%Y-%m-%d')} (保留 {days_to_keep} 天)。")
 
             if count_to_delete > 0:
-                # 假設 on_delete=models.CASCADE 會處理關聯的 DetectionRecord 和 S3 檔案 (透過 django-cleanup)
-                info = batch_jobs_to_delete_qs.delete()
-                deleted_count = info[0] if isinstance(info, tuple) else 0
+                # 批次的紀錄、檢測框與 S3 檔案由 purge_batch_jobs 分段刪除 (不經過 django-cleanup 的逐檔刪除)
+                info = purge_batch_jobs(batch_jobs_to_delete_qs.values_list('id', flat=True), log_prefix=log_prefix)
+                deleted_count = info['batch_jobs']
                 logger.info(f"{log_prefix} [按時間清理批次] 成功刪除 {deleted_count} 個。詳情: {info}")
             else:
                 logger.info(f"{log_prefix} [按時間清理批次] 無符合條件的舊批次可刪除。")
@@ -131,8 +133,8 @@ class DataRetentionManager:
                 
                 if ids_to_delete:
                     logger.info(f"{log_prefix} [按數量清理批次] 準備刪除 {num_to_delete} 筆 (IDs: {ids_to_delete[:5]}...).")
-                    info = BatchDetectionJob.objects.filter(id__in=ids_to_delete).delete()
-                    deleted_count = info[0] if isinstance(info, tuple) else 0
+                    info = purge_batch_jobs(ids_to_delete, log_prefix=log_prefix)
+                    deleted_count = info['batch_jobs']
                     logger.info(f"{log_prefix} [按數量清理批次] 成功刪除 {deleted_count} 個。詳情: {info}")
                 else:
                     logger.info(f"{log_prefix} [按數量清理批次] 無需刪除 (ids_to_delete 為空)。")
@@ -0,0 +1,95 @@
+# detector/s3_originals.py
+# ------------------------------------------------
+# 批次任務的原始圖片處理方式 (settings.BATCH_ORIGINAL_IMAGE_MODE)：
+#   upload    : 以下載的 bytes 重新上傳 (舊行為)
+#   copy      : 以 S3 CopyObject 在伺服器端複製到 storage 路徑，不經過 worker
+#   reference : 直接讓 original_image 指向來源物件 (來源須在 storage 的 bucket 與 AWS_LOCATION 之下)；
+#               紀錄標記 original_image_is_reference，刪除紀錄時不會刪除來源物件
+# copy / reference 無法使用時退回 upload，確保一定能存下原始圖片。
+# ------------------------------------------------
+import logging
+import posixpath
+import uuid
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL_MODE_UPLOAD = 'upload'
+ORIGINAL_MODE_COPY = 'copy'
+ORIGINAL_MODE_REFERENCE = 'reference'
+ORIGINAL_MODES = (ORIGINAL_MODE_UPLOAD, ORIGINAL_MODE_COPY, ORIGINAL_MODE_REFERENCE)
+
+_COPY_OBJECT_PARAMETERS = ('ACL', 'ServerSideEncryption', 'SSEKMSKeyId', 'StorageClass')
+
+
+def get_original_image_mode():
+    mode = getattr(settings, 'BATCH_ORIGINAL_IMAGE_MODE', ORIGINAL_MODE_UPLOAD)
+    if mode not in ORIGINAL_MODES:
+        logger.warning(f"未知的 BATCH_ORIGINAL_IMAGE_MODE '{mode}'，改用 '{ORIGINAL_MODE_UPLOAD}'。")
+        return ORIGINAL_MODE_UPLOAD
+    return mode
+
+
+def storage_key(storage, name):
+    """storage 內的檔名 -> bucket 中的完整 key (加上 AWS_LOCATION 前綴)。"""
+    location = (getattr(storage, 'location', '') or '').strip('/')
+    return posixpath.join(location, name) if location else name
+
+
+def _reference_name(storage, s3_bucket, s3_key):
+    """來源物件可直接作為 storage 檔名時回傳該檔名，否則回傳 None。"""
+    if s3_bucket != getattr(storage, 'bucket_name', None):
+        return None
+    location = (getattr(storage, 'location', '') or '').strip('/')
+    if not location:
+        return s3_key
+    prefix = f"{location}/"
+    return s3_key[len(prefix):] if s3_key.startswith(prefix) else None
+
+
+def attach_original_from_source(record, file_ext):
+    """
+    依 BATCH_ORIGINAL_IMAGE_MODE，讓 record.original_image 沿用 S3 上既有的來源物件
+    (record.source_s3_object = (bucket, key)，由批次任務設定)。
+    只使用 storage / S3 API，不存取資料庫，可在背景執行緒中執行。
+
+    Returns:
+        實際使用的方式 ('copy' 或 'reference')，代表 original_image 已指向 S3 上的物件，不需再上傳 bytes；
+        None 代表呼叫端應以原本的方式上傳。'copy' 建立的物件屬於此紀錄，'reference' 則是來源物件本身。
+    """
+    source = getattr(record, 'source_s3_object', None)
+    mode = get_original_image_mode()
+    if not source or mode == ORIGINAL_MODE_UPLOAD:
+        return None
+
+    s3_bucket, s3_key = source
+    storage = record.original_image.storage
+    if not getattr(storage, 'bucket_name', None):
+        # 非 S3 storage (例如本機開發用的 FileSystemStorage) 只能上傳
+        return None
+
+    if mode == ORIGINAL_MODE_REFERENCE:
+        name = _reference_name(storage, s3_bucket, s3_key)
+        if name:
+            record.original_image.name = name
+            return ORIGINAL_MODE_REFERENCE
+        logger.debug(f"s3://{s3_bucket}/{s3_key} 不在 storage 路徑下，無法直接引用，改用伺服器端複製。")
+
+    # copy (或 reference 無法使用時)：伺服器端複製到 upload_to 決定的路徑
+    try:
+        name = record.original_image.field.generate_filename(record, f"{uuid.uuid4()}{file_ext}")
+        # 只帶入 CopyObject 適用的物件參數 (例如伺服器端加密)，metadata 沿用來源物件
+        copy_params = {k: v for k, v in (getattr(storage, 'object_parameters', None) or {}).items()
+                       if k in _COPY_OBJECT_PARAMETERS}
+        storage.connection.meta.client.copy_object(
+            Bucket=storage.bucket_name,
+            Key=storage_key(storage, name),
+            CopySource={'Bucket': s3_bucket, 'Key': s3_key},
+            **copy_params,
+        )
+    except Exception as e:
+        logger.warning(f"伺服器端複製 s3://{s3_bucket}/{s3_key} 失敗，改為重新上傳: {e}")
+        return None
+
+    record.original_image.name = name
+    return ORIGINAL_MODE_COPY
@@ -1,12 +1,17 @@
 ## detector/services.py
-import io
 import uuid # 雖然檔名由 task 生成，但保留以防未來其他用途
-import cv2 # OpenCV 用於影像處理
-from PIL import Image # Pillow 用於影像格式轉換和儲存
 from django.core.files.base import ContentFile # 用於將 bytes 轉換為 Django File Object
+from django.db import transaction
 # --- 匯入 DetectionRecord 模型 ---
-from .models import DetectionRecord
-from .inference_utils import run_yolo_inference_on_image_data, ImageDecodeError # YOLO 推論工具
+from .models import DetectionRecord, DetectionBox
+from .inference_utils import (  # YOLO 推論工具
+    run_yolo_inference_on_image_data, run_yolo_inference_on_image_batch, ImageDecodeError
+)
+from .inference_cache import get_cached_inference, store_cached_inference
+from .image_encoding import encode_annotated_image, encode_thumbnail
+from .s3_originals import attach_original_from_source, ORIGINAL_MODE_REFERENCE
+from .upload_pool import run_concurrently
+from .metrics import stage_timer
 import logging
 service_logger = logging.getLogger(__name__)
 
@@ -43,10 +48,19 @@ def process_image_bytes(image_bytes: bytes,
 
     record = detection_record_instance # 使用傳入的實例
 
+    # 0) 內容 hash 快取：相同圖片 + 相同模型 + 相同閾值 直接沿用先前結果，不需解碼與推論
+    cached = get_cached_inference(image_bytes, confidence)
+    if cached is not None:
+        service_logger.info(f"Inference cache hit for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'})")
+        record.results_data = cached['text_results']
+        return _persist_detection_record(record, image_bytes, file_ext,
+                                         cached['annotated_image_bytes'], cached['annotated_ext'],
+                                         cached['thumbnails'])
+
     try:
         # 1) 執行 YOLO 推論 (這部分邏輯與之前類似，但錯誤會向上拋出)
         # run_yolo_inference_on_image_data 內部會處理 ImageDecodeError
-        annotated_image_array, text_results = run_yolo_inference_on_image_data(
+        annotated_image_array, text_results, original_image_array = run_yolo_inference_on_image_data(
             image_bytes, confidence_threshold=confidence
         )
         record.results_data = text_results # 設定辨識結果數據
@@ -65,62 +79,165 @@ def process_image_bytes(image_bytes: bytes,
         record.save()
         raise # 重新拋出
 
-    # 2) 處理和儲存圖片檔案
-    # 即使 YOLO 推論沒有任何結果 (annotated_image_array 為 None)，我們通常還是要儲存原始圖片。
-    
-    # 使用 uuid 生成唯一的基礎檔名，確保檔名不重複
-    # Celery task 中傳入的 s3_object_key 已經是唯一的，這裡主要是為了 Django 的 ImageField
-    # ImageField 的 upload_to 函式會接收原始檔名，我們需要給它一個基礎檔名
-    # 這裡的 unique_base 和 file_ext 主要是為了 `save()` 方法中的 `name` 參數
-    unique_base_filename = str(uuid.uuid4())
-    original_image_name = f"{unique_base_filename}{file_ext}"
-    annotated_image_name = f"annotated_{unique_base_filename}{file_ext}"
+    annotated_image_bytes, annotated_ext = _encode_annotated_image_for_record(record, annotated_image_array, file_ext)
+    thumbnails = _encode_thumbnails_for_record(record, original_image_array,
+                                               annotated_image_array if annotated_image_bytes else None)
+    store_cached_inference(image_bytes, confidence, text_results, annotated_image_bytes, annotated_ext, thumbnails)
+    return _persist_detection_record(record, image_bytes, file_ext, annotated_image_bytes, annotated_ext, thumbnails)
+
 
-    # 儲存原始圖片到 S3 (透過 DetectionRecord 的 ImageField)
+def _encode_annotated_image_for_record(record: DetectionRecord, annotated_image_array, file_ext: str):
+    """
+    依 settings 的編碼設定檔編碼標註圖 (見 image_encoding.py)。
+
+    Returns:
+        (annotated_image_bytes, annotated_ext)；沒有標註結果或編碼失敗時為 (None, None)。
+        編碼失敗時會把錯誤記錄到 record.results_data。
+    """
+    if annotated_image_array is None or annotated_image_array.size == 0:
+        return None, None
     try:
-        record.original_image.save(original_image_name, ContentFile(image_bytes), save=False)
-        # 注意：save=False 只是將檔案內容和名稱與 ImageField 關聯起來，
-        # 實際的資料庫記錄儲存和檔案上傳會在最後的 record.save() 中發生。
+        with stage_timer('encode'):
+            return encode_annotated_image(annotated_image_array, file_ext)
     except Exception as e:
-        service_logger.error(f"Error saving original image for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'}): {e}", exc_info=True)
+        service_logger.error(f"Error encoding annotated image for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'}): {e}", exc_info=True)
+        # 記錄錯誤，但不影響 record 的整體儲存
         record.results_data = {** (record.results_data if isinstance(record.results_data, dict) else {}),
-                               'original_image_error': f'Failed to save original image: {str(e)}'}
-        # 即使原始圖片儲存失敗，我們還是嘗試儲存 record (帶有錯誤訊息)
-        # 但這種情況比較嚴重，可能需要標記為處理失敗
+                               'annotated_image_error': f'Failed to encode annotated image: {str(e)}'}
+        return None, None
 
 
-    # 若有標註結果 (annotated_image_array 不是 None 且有內容)，則儲存標註圖到 S3
-    if annotated_image_array is not None and annotated_image_array.size > 0:
+def _encode_thumbnails_for_record(record: DetectionRecord, original_image_array, annotated_image_array):
+    """
+    由推論時已解碼的原始圖與標註圖產生縮圖 (見 image_encoding.encode_thumbnail)。
+
+    Returns:
+        {欄位名稱: (thumbnail_bytes, ext)}；縮圖只用於預覽，編碼失敗時只記錄警告並略過該張。
+    """
+    thumbnails = {}
+    for field_name, image_array in (('original_thumbnail', original_image_array),
+                                    ('annotated_thumbnail', annotated_image_array)):
+        if image_array is None or image_array.size == 0:
+            continue
         try:
-            # 將 OpenCV 的 BGR array 轉換為 RGB
-            img_rgb = cv2.cvtColor(annotated_image_array, cv2.COLOR_BGR2RGB)
-            pil_img = Image.fromarray(img_rgb) # 轉換為 Pillow Image 物件
-            
-            buffer = io.BytesIO() # 在記憶體中建立一個二進位流
-            # 根據原始副檔名決定儲存格式
-            image_format_name = 'JPEG' if file_ext.lower() in ['.jpg', '.jpeg'] else 'PNG'
-            if image_format_name == 'JPEG':
-                pil_img.save(buffer, format=image_format_name, quality=90) # 對 JPEG 設定品質
-            else: # PNG 等格式不接受 quality 參數
-                pil_img.save(buffer, format=image_format_name)
-            buffer.seek(0) # 重置流的指針到開頭
-
-            record.annotated_image.save(annotated_image_name, ContentFile(buffer.getvalue()), save=False)
+            with stage_timer('thumbnail'):
+                thumbnails[field_name] = encode_thumbnail(image_array)
         except Exception as e:
-            service_logger.error(f"Error saving annotated image for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'}): {e}", exc_info=True)
-            # 記錄錯誤，但不影響 record 的整體儲存
-            record.results_data = {** (record.results_data if isinstance(record.results_data, dict) else {}),
-                                   'annotated_image_error': f'Failed to save annotated image: {str(e)}'}
+            service_logger.warning(f"Error encoding {field_name} for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'}): {e}")
+    return thumbnails
+
+
+def _persist_detection_record(record: DetectionRecord,
+                              image_bytes: bytes,
+                              file_ext: str,
+                              annotated_image_bytes,
+                              annotated_ext: str = None,
+                              thumbnails=None) -> DetectionRecord:
+    """
+    將原始圖片、已編碼的標註圖片與縮圖附加到 record，並儲存 record。
+    record.results_data 需已由呼叫端設定。
+    """
+    upload_record_images(record, image_bytes, file_ext, annotated_image_bytes, annotated_ext, thumbnails)
+    return save_detection_record(record)
+
+
+def upload_record_images(record: DetectionRecord,
+                         image_bytes: bytes,
+                         file_ext: str,
+                         annotated_image_bytes,
+                         annotated_ext: str = None,
+                         thumbnails=None) -> DetectionRecord:
+    """
+    將原始圖片、標註圖片與縮圖上傳到 storage 並附加到 record 的 ImageField (不寫入資料庫)。
+    所有檔案在共用的上傳執行緒池中同時上傳 (見 upload_pool.py)。
+    thumbnails 為 {欄位名稱: (bytes, ext)}，由 _encode_thumbnails_for_record 或推論快取提供。
+    只使用 storage，不存取資料庫，因此可以在背景執行緒中執行。
+
+    Raises:
+        Exception: 任一張圖片上傳失敗時拋出 (第一個) 錯誤。此時已上傳的檔案會盡力刪除、
+                   record 的圖片欄位會被清空，呼叫端不應把 record 當作成功結果儲存。
+    """
+    # 使用 uuid 生成唯一的基礎檔名，確保檔名不重複
+    # ImageField 的 upload_to 函式會接收這個檔名，並決定最終的儲存路徑
+    unique_base_filename = str(uuid.uuid4())
+    original_image_name = f"{unique_base_filename}{file_ext}"
+    annotated_image_name = f"annotated_{unique_base_filename}{annotated_ext or file_ext}"
+
+    # 注意：FieldFile.save(save=False) 會直接上傳到 storage，只是不寫入資料庫；
+    # 資料庫記錄會在兩張圖片都上傳成功後，由 save_detection_record() 儲存。
+    def store_original():
+        if record.original_image.name:
+            # 非同步上傳：原始圖片已在提交時儲存 (見 store_pending_upload)，沿用且失敗時不刪除
+            return False
+        # 批次任務可沿用 S3 上的來源物件 (伺服器端複製或直接引用)，不需再上傳一次
+        mode = attach_original_from_source(record, file_ext)
+        if mode is None:
+            record.original_image.save(original_image_name, ContentFile(image_bytes), save=False)
+        record.original_image_is_reference = mode == ORIGINAL_MODE_REFERENCE
+        # 回傳此檔案是否屬於這筆紀錄 (直接引用的來源物件失敗時不可刪除)
+        return mode != ORIGINAL_MODE_REFERENCE
+
+    def store_annotated():
+        record.annotated_image.save(annotated_image_name, ContentFile(annotated_image_bytes), save=False)
+        return True
+
+    def thumbnail_store(field_name, thumbnail_bytes, thumbnail_ext):
+        def store():
+            getattr(record, field_name).save(f"{field_name}_{unique_base_filename}{thumbnail_ext}",
+                                             ContentFile(thumbnail_bytes), save=False)
+            return True
+        return store
+
+    transfers = [('original_image', store_original)]
+    if annotated_image_bytes:
+        transfers.append(('annotated_image', store_annotated))
     else:
-        # 如果沒有標註結果，確保 annotated_image 欄位為 None (或者它預設就是)
+        # 如果沒有標註結果，確保 annotated_image 欄位為 None
         record.annotated_image = None
+    for field_name in ('original_thumbnail', 'annotated_thumbnail'):
+        thumbnail = (thumbnails or {}).get(field_name)
+        if thumbnail and thumbnail[0]:
+            transfers.append((field_name, thumbnail_store(field_name, *thumbnail)))
+        else:
+            setattr(record, field_name, None)
+
+    stored_original_name = record.original_image.name
+    with stage_timer('upload'):
+        outcomes = run_concurrently([store for _, store in transfers])
+    errors = [error for _, error in outcomes if error is not None]
+    if not errors:
+        return record
+
+    # 任一張失敗：刪除這次已上傳的檔案，避免留下沒有資料庫紀錄的孤兒物件
+    for (field_name, _), (owned, error) in zip(transfers, outcomes):
+        field_file = getattr(record, field_name)
+        if error is None and owned and field_file.name:
+            try:
+                field_file.storage.delete(field_file.name)
+            except Exception as cleanup_error:
+                service_logger.warning(f"Failed to clean up uploaded file {field_file.name}: {cleanup_error}")
+        if field_name == 'original_image' and stored_original_name:
+            continue  # 提交時已儲存的原始圖片仍屬於這筆紀錄
+        setattr(record, field_name, None)
+    service_logger.error(f"Error uploading images for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'}): {errors[0]}", exc_info=errors[0])
+    raise errors[0]
 
 
+def save_detection_record(record: DetectionRecord) -> DetectionRecord:
+    """
+    儲存 DetectionRecord 實例到資料庫 (圖片需已由 upload_record_images 上傳)，
+    並在同一個 transaction 中以 bulk_create 寫入結構化的檢測框 (DetectionBox)。
+    """
     # 3) 最後，儲存 DetectionRecord 實例到資料庫
     # 這次的 save() 會觸發模型中定義的 save() 方法，進而呼叫 calculate_severity_score()
-    # 同時，ImageField 中設定的 save=False 的檔案也會在這一步被實際提交和上傳
     try:
-        record.save()
+        with stage_timer('db_save'), transaction.atomic():
+            is_new = record._state.adding
+            record.processing_status = DetectionRecord.ProcessingStatusChoices.COMPLETED
+            record.save()
+            if not is_new:
+                record.boxes.all().delete()
+            DetectionBox.objects.bulk_create(DetectionBox.from_results_data(record))
         service_logger.info(f"Successfully processed and saved DetectionRecord ID {record.id} (BatchJob {record.batch_job_id if record.batch_job_id else 'N/A'})")
     except Exception as e:
         service_logger.error(f"Critical error saving DetectionRecord ID (intended: {record.id}, BatchJob {record.batch_job_id if record.batch_job_id else 'N/A'}): {e}", exc_info=True)
@@ -128,4 +245,116 @@ def process_image_bytes(image_bytes: bytes,
         # Celery task 應該捕獲這個錯誤並將對應的圖片處理標記為失敗
         raise # 重新拋出，讓 Celery task 處理
 
-    return record
\ No newline at end of file
+    return record
+
+
+def store_pending_upload(image_bytes: bytes, file_ext: str = '.jpg') -> DetectionRecord:
+    """
+    非同步上傳的提交階段：只把原始圖片存到 storage，並以 PENDING 狀態建立 DetectionRecord，
+    推論、標註圖與縮圖由 process_uploaded_image_task 在 worker 中完成 (沿用已儲存的原始圖片)。
+    """
+    record = DetectionRecord(processing_status=DetectionRecord.ProcessingStatusChoices.PENDING)
+    record.original_image.save(f"{uuid.uuid4()}{file_ext}", ContentFile(image_bytes), save=False)
+    try:
+        record.save()
+    except Exception:
+        record.original_image.storage.delete(record.original_image.name)
+        raise
+    service_logger.info(f"Stored pending upload as DetectionRecord ID {record.id}")
+    return record
+
+
+def prepare_image_batch(image_items, confidence: float = 0.5):
+    """
+    批次推論階段：查快取、對未命中的圖片執行一次批次推論並編碼標註圖。
+    不上傳檔案也不寫入資料庫 (解碼失敗的 record 也尚未儲存)。
+
+    Args:
+        image_items: list of (image_bytes, file_ext, detection_record_instance)。
+        confidence: YOLO 推論的信心水準閾值。
+
+    Returns:
+        與 image_items 等長的 list，每個元素為
+        (record, error, annotated_image_bytes, annotated_ext, thumbnails)；
+        error 為 None 代表可以進入上傳/儲存階段，否則為 ImageDecodeError。
+        thumbnails 為 {欄位名稱: (bytes, ext)} (見 _encode_thumbnails_for_record)。
+
+    Raises:
+        RuntimeError: 如果 YOLO 模型未載入或整批推論失敗 (所有未命中快取的 record 皆已標記錯誤並儲存)。
+    """
+    if not image_items:
+        return []
+
+    # 先查快取，只有未命中的圖片才送入模型
+    cached_entries = [get_cached_inference(image_bytes, confidence) for image_bytes, _, _ in image_items]
+    miss_indices = [idx for idx, cached in enumerate(cached_entries) if cached is None]
+
+    outputs = [None] * len(image_items)
+    if miss_indices:
+        try:
+            miss_outputs = run_yolo_inference_on_image_batch(
+                [image_items[idx][0] for idx in miss_indices], confidence_threshold=confidence
+            )
+        except RuntimeError as rte:
+            service_logger.error(f"RuntimeError during batched YOLO inference for {len(miss_indices)} images: {rte}")
+            for idx in miss_indices:
+                record = image_items[idx][2]
+                record.results_data = {'error': f'YOLO inference runtime error: {str(rte)}'}
+                record.save()
+            raise
+        for idx, output in zip(miss_indices, miss_outputs):
+            outputs[idx] = output
+
+    prepared = []
+    for (image_bytes, file_ext, record), cached, output in zip(image_items, cached_entries, outputs):
+        if cached is not None:
+            record.results_data = cached['text_results']
+            prepared.append((record, None, cached['annotated_image_bytes'], cached['annotated_ext'],
+                             cached['thumbnails']))
+        elif isinstance(output, ImageDecodeError):
+            service_logger.error(f"ImageDecodeError in batch service for record (batch_job {record.batch_job_id if record.batch_job_id else 'N/A'}): {output}")
+            record.results_data = {'error': f'Image decode error: {str(output)}'}
+            prepared.append((record, output, None, None, None))
+        else:
+            annotated_image_array, text_results, original_image_array = output
+            record.results_data = text_results
+            annotated_image_bytes, annotated_ext = _encode_annotated_image_for_record(record, annotated_image_array, file_ext)
+            thumbnails = _encode_thumbnails_for_record(record, original_image_array,
+                                                       annotated_image_array if annotated_image_bytes else None)
+            store_cached_inference(image_bytes, confidence, text_results, annotated_image_bytes, annotated_ext, thumbnails)
+            prepared.append((record, None, annotated_image_bytes, annotated_ext, thumbnails))
+
+    return prepared
+
+
+def process_image_batch(image_items, confidence: float = 0.5):
+    """
+    以一次批次推論處理多張圖片，再把每張圖片的結果分別寫回對應的 DetectionRecord。
+
+    Args:
+        image_items: list of (image_bytes, file_ext, detection_record_instance)。
+        confidence: YOLO 推論的信心水準閾值。
+
+    Returns:
+        與 image_items 等長的 list，每個元素為 (record, error)；
+        成功時 error 為 None，失敗時為對應的例外 (record 仍會帶著錯誤訊息被儲存)。
+
+    Raises:
+        RuntimeError: 如果 YOLO 模型未載入或整批推論失敗 (所有 record 皆已標記錯誤並儲存)。
+    """
+    prepared = prepare_image_batch(image_items, confidence)
+
+    processed = []
+    for (image_bytes, file_ext, _), (record, error, annotated_image_bytes, annotated_ext, thumbnails) in zip(
+            image_items, prepared):
+        if error is not None:
+            record.save()
+            processed.append((record, error))
+            continue
+        try:
+            processed.append((_persist_detection_record(record, image_bytes, file_ext,
+                                                        annotated_image_bytes, annotated_ext, thumbnails), None))
+        except Exception as e:
+            processed.append((record, e))
+
+    return processed
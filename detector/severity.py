@@ -0,0 +1,114 @@
+# detector/severity.py
+# ------------------------------------------------
+# 嚴重程度評分引擎
+# 類別參數可由 settings.DETECTOR_SEVERITY_CLASS_PARAMS 覆寫；
+# 評分以 NumPy 向量化實作，可一次為大量紀錄評分 (見 rescore_detection_records 指令)。
+# ------------------------------------------------
+import numpy as np
+from django.conf import settings
+
+HEALTHY_CLASS = 'healthy'
+
+# 預設的 class 參數設定 (可擴展)
+DEFAULT_SEVERITY_CLASS_PARAMS = {
+    'angular leaf spot': {
+        'base': 0.4,
+        'confidence_factor': 0.6,
+        'per_detection_bonus': 0.05,
+    },
+    'healthy': {
+        'base': 0.05,
+        'confidence_factor': 0.05,
+        'per_detection_bonus': 0.0,
+    },
+    # 其他病害可在此擴充
+}
+
+# 既沒有病害也沒有 healthy，只有其他未知類別時的分數
+UNKNOWN_CLASSES_SCORE = 0.2
+
+
+def get_severity_class_params():
+    """回傳目前使用的類別參數 (settings 覆寫優先)。"""
+    return getattr(settings, 'DETECTOR_SEVERITY_CLASS_PARAMS', None) or DEFAULT_SEVERITY_CLASS_PARAMS
+
+
+def score_detection_batch(results_data_list, class_params=None):
+    """
+    一次為多筆 results_data 計算嚴重程度評分。
+
+    規則：
+      - 每個病害類別: base + max(confidence) * confidence_factor + (數量 - 1) * per_detection_bonus，
+        取所有病害分數的最大值 (最嚴重的病害為主)。
+      - 只檢測到 healthy: max(0, base - max(confidence) * confidence_factor)。
+      - 只有未知類別: UNKNOWN_CLASSES_SCORE。
+      - 結果限制在 0.0 - 1.0 並四捨五入至小數點後兩位。
+
+    Args:
+        results_data_list: DetectionRecord.results_data 的列表。
+        class_params: 類別參數 dict，預設使用 get_severity_class_params()。
+
+    Returns:
+        與輸入等長的 list；沒有檢測結果或格式不是 list (錯誤紀錄) 時為 None。
+    """
+    params = class_params or get_severity_class_params()
+    class_names = list(params)
+    class_index = {name: idx for idx, name in enumerate(class_names)}
+
+    # 攤平成 (紀錄索引, 類別索引, 信心度) 三個陣列；未知類別的類別索引為 -1
+    record_idx, cls_idx, confs = [], [], []
+    for i, results_data in enumerate(results_data_list):
+        if not results_data or not isinstance(results_data, list):
+            continue
+        for detection in results_data:
+            record_idx.append(i)
+            cls_idx.append(class_index.get(str(detection.get('class', '')).strip().lower(), -1))
+            confs.append(detection.get('confidence_float', 0.0) or 0.0)
+
+    n_records, n_classes = len(results_data_list), len(class_names)
+    scores = [None] * n_records
+    if not record_idx:
+        return scores
+
+    record_idx = np.asarray(record_idx, dtype=np.intp)
+    cls_idx = np.asarray(cls_idx, dtype=np.intp)
+    confs = np.asarray(confs, dtype=np.float64)
+    has_detections = np.bincount(record_idx, minlength=n_records) > 0
+
+    known = cls_idx >= 0
+    counts = np.zeros((n_records, n_classes), dtype=np.int64)
+    max_conf = np.full((n_records, n_classes), -np.inf)
+    np.add.at(counts, (record_idx[known], cls_idx[known]), 1)
+    np.maximum.at(max_conf, (record_idx[known], cls_idx[known]), confs[known])
+    present = counts > 0
+
+    base = np.array([params[c]['base'] for c in class_names])
+    conf_factor = np.array([params[c]['confidence_factor'] for c in class_names])
+    bonus = np.array([params[c]['per_detection_bonus'] for c in class_names])
+
+    with np.errstate(invalid='ignore'):
+        class_scores = base + max_conf * conf_factor + (counts - 1) * bonus
+    class_scores = np.where(present, class_scores, -np.inf)
+
+    disease_cols = np.array([c != HEALTHY_CLASS for c in class_names], dtype=bool)
+    final = np.full(n_records, UNKNOWN_CLASSES_SCORE)
+
+    if HEALTHY_CLASS in class_index:
+        h = class_index[HEALTHY_CLASS]
+        healthy_scores = np.maximum(0.0, base[h] - np.where(present[:, h], max_conf[:, h], 0.0) * conf_factor[h])
+        final = np.where(present[:, h], healthy_scores, final)
+
+    if disease_cols.any():
+        disease_present = present[:, disease_cols].any(axis=1)
+        disease_best = class_scores[:, disease_cols].max(axis=1)
+        final = np.where(disease_present, disease_best, final)
+
+    final = np.clip(final, 0.0, 1.0)
+    for i in np.flatnonzero(has_detections):
+        scores[i] = round(float(final[i]), 2)
+    return scores
+
+
+def score_detections(results_data, class_params=None):
+    """為單筆 results_data 計算嚴重程度評分 (規則同 score_detection_batch)。"""
+    return score_detection_batch([results_data], class_params)[0]
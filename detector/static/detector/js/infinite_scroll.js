@@ -0,0 +1,54 @@
+// detector/static/detector/js/infinite_scroll.js
+// 無限捲動：.infinite-scroll-sentinel 進入畫面時，以 data-next-url 取得下一頁 HTML 片段，
+// 並以片段內容 (含下一個 sentinel) 取代自己。片段由 keyset 分頁的 fragment view 產生。
+(function () {
+    'use strict';
+
+    if (!('IntersectionObserver' in window) || !('fetch' in window)) {
+        return; // 舊瀏覽器保留「載入更多」連結
+    }
+
+    var observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) {
+                loadNextPage(entry.target);
+            }
+        });
+    }, { rootMargin: '600px 0px' });
+
+    function observeSentinels(root) {
+        root.querySelectorAll('[data-infinite-scroll] .infinite-scroll-sentinel').forEach(function (sentinel) {
+            observer.observe(sentinel);
+        });
+    }
+
+    function loadNextPage(sentinel) {
+        var url = sentinel.dataset.nextUrl;
+        if (!url || sentinel.dataset.loading) {
+            return;
+        }
+        sentinel.dataset.loading = '1';
+
+        fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' }, credentials: 'same-origin' })
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error('HTTP ' + response.status);
+                }
+                return response.text();
+            })
+            .then(function (html) {
+                observer.unobserve(sentinel);
+                var template = document.createElement('template');
+                template.innerHTML = html;
+                var container = sentinel.parentNode;
+                sentinel.replaceWith(template.content);
+                observeSentinels(container.parentNode || document);
+            })
+            .catch(function () {
+                // 失敗時保留「載入更多」連結，下次進入畫面再重試
+                delete sentinel.dataset.loading;
+            });
+    }
+
+    observeSentinels(document);
+})();
@@ -0,0 +1,33 @@
+# detector/storage_backends.py
+# ------------------------------------------------
+# 自訂的 S3 storage：簽名 URL 經由 media_urls.py 的快取取得，
+# 模板、admin 與任務中的 .url 不需每次重新計算 SigV4 簽章。
+# ------------------------------------------------
+from storages.backends.s3boto3 import S3Boto3Storage
+from .media_urls import get_presigned_urls, invalidate_presigned_url
+
+
+class CachedUrlS3Storage(S3Boto3Storage):
+    """S3Boto3Storage + 預簽名 URL 快取 (只快取預設參數的 GET URL)。"""
+
+    def _uses_url_cache(self, parameters, expire, http_method):
+        return (self.querystring_auth and not self.custom_domain
+                and not parameters and expire is None and http_method is None)
+
+    def _sign(self, name):
+        return super().url(name)
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if not self._uses_url_cache(parameters, expire, http_method):
+            return super().url(name, parameters=parameters, expire=expire, http_method=http_method)
+        return get_presigned_urls(self, [name], self._sign)[name]
+
+    def urls(self, names):
+        """一次取得多個檔案的簽名 URL (name -> url)。"""
+        if not self._uses_url_cache(None, None, None):
+            return {name: super(CachedUrlS3Storage, self).url(name) for name in names if name}
+        return get_presigned_urls(self, names, self._sign)
+
+    def delete(self, name):
+        super().delete(name)
+        invalidate_presigned_url(self, name)
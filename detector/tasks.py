@@ -3,24 +3,113 @@
 # Celery 任務：處理單張/批次 S3 圖片，與排程清理舊資料
 # ------------------------------------------------
 import os
+import threading
+import time
 import traceback
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import BotoCoreError, ClientError
 from django.conf import settings
 from django.db.models import F
-from celery import shared_task, group
+from celery import shared_task
 from .retention_manager import DataRetentionManager
 from .models import BatchDetectionJob, DetectionRecord
-from .services import process_image_bytes, ImageDecodeError
+from .services import process_image_bytes, process_image_batch, ImageDecodeError
+from .batch_pipeline import run_pipelined_batch, get_pipeline_options
+from .batch_aggregates import fold_batch_results, build_batch_summary, rebuild_batch_aggregates
+from .redis_client import get_redis_client
+from .metrics import IMAGES_PROCESSED, record_batch_throughput, stage_timer
 import logging
 
 logger = logging.getLogger(__name__)
 
 # ====== 常數 ======
 MIN_VALID_IMAGE_SIZE = 1024  # 最小圖檔大小 (bytes)
+DEFAULT_BATCH_INFERENCE_CHUNK_SIZE = 8  # 每個批次推論子任務處理的圖片數
+MANUAL_CLEANUP_DEBOUNCE_KEY = 'detector:retention:manual-cleanup-scheduled'
+S3_GET_MAX_RETRIES = 3  # 批次任務中單張圖片下載遇到暫時性錯誤 (5xx / 限流 / 連線中斷) 的重試次數
+S3_GET_RETRY_BACKOFF = 0.5  # 重試等待秒數 (每次加倍)
+TRANSIENT_S3_ERROR_CODES = {
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestTimeout',
+    'InternalError', 'ServiceUnavailable',
+}
+
+
+# ====== S3 client (每個 worker process 一個) ======
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    取得此 worker process 共用的 boto3 S3 client。
+
+    第一次使用時才建立 (prefork 子 process 在 fork 之後各自建立)，之後跨任務重用，
+    避免每張圖片都重新解析憑證、建立連線池與 TLS 連線。以 pid 判斷是否需要在 fork 後重建。
+    boto3 client 本身是執行緒安全的。
+    """
+    global _s3_client, _s3_client_pid
+    pid = os.getpid()
+    if _s3_client is not None and _s3_client_pid == pid:
+        return _s3_client
+
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != pid:
+            _s3_client = boto3.session.Session().client(
+                's3',
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                region_name=settings.AWS_S3_REGION_NAME,
+                endpoint_url=getattr(settings, 'AWS_S3_ENDPOINT_URL', None) or None,
+                config=BotoConfig(
+                    retries={'max_attempts': 3, 'mode': 'standard'},
+                    max_pool_connections=getattr(settings, 'S3_CLIENT_MAX_POOL_CONNECTIONS', 10),
+                    tcp_keepalive=getattr(settings, 'S3_CLIENT_TCP_KEEPALIVE', True),
+                ),
+            )
+            _s3_client_pid = pid
+            logger.info(f"S3 client 已建立 (pid={pid})")
+    return _s3_client
 
 
 # ====== 工具函式 ======
+class _InvalidImageError(Exception):
+    """下載的圖片不符合處理條件 (例如檔案過小)。"""
+    pass
+
+
+def _is_transient_s3_error(err):
+    """S3 錯誤是否值得重試：連線/讀取錯誤、5xx 與限流。"""
+    if isinstance(err, BotoCoreError):
+        return True
+    if isinstance(err, ClientError):
+        response = err.response or {}
+        code = response.get('Error', {}).get('Code')
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return code in TRANSIENT_S3_ERROR_CODES or status >= 500
+    return False
+
+
+def _get_s3_object_bytes(client, s3_bucket, s3_key, log_label=''):
+    """
+    下載 S3 物件內容；暫時性錯誤最多重試 S3_GET_MAX_RETRIES 次。
+    botocore 本身的重試只涵蓋 get_object 請求，讀取 Body 時中斷也需要在這裡重試。
+    """
+    for attempt in range(S3_GET_MAX_RETRIES + 1):
+        try:
+            with stage_timer('s3_get'):
+                obj = client.get_object(Bucket=s3_bucket, Key=s3_key)
+                return obj['Body'].read()
+        except (ClientError, BotoCoreError) as err:
+            if attempt >= S3_GET_MAX_RETRIES or not _is_transient_s3_error(err):
+                raise
+            delay = S3_GET_RETRY_BACKOFF * (2 ** attempt)
+            logger.warning(f"{log_label}: S3 下載暫時性錯誤 ({s3_key})，{delay:.1f} 秒後重試 "
+                           f"({attempt + 1}/{S3_GET_MAX_RETRIES}): {err}")
+            time.sleep(delay)
+
+
 def _increment_batch_failure(batch_job_id):
     """批次失敗計數遞增。"""
     BatchDetectionJob.objects.filter(id=batch_job_id).update(
@@ -28,69 +117,40 @@ def _increment_batch_failure(batch_job_id):
     )
 
 
-def generate_batch_summary(results, batch):
+def _get_batch_chunk_size():
+    """從 settings 讀取每個批次推論子任務的圖片數 (至少為 1)。"""
+    return max(1, int(getattr(settings, 'BATCH_INFERENCE_CHUNK_SIZE', DEFAULT_BATCH_INFERENCE_CHUNK_SIZE)))
+
+
+def _failure_payload(s3_key, error):
+    """單張圖片處理失敗時回傳的 dict (批次統計已寫入資料庫，回傳內容保持精簡)。"""
+    IMAGES_PROCESSED.labels(outcome='failure').inc()
+    return {'status': 'FAILURE', 's3_key': s3_key, 'error': error, 'processed': False}
+
+
+def _success_payload(processed, s3_key):
+    """單張圖片處理成功時回傳的 dict (批次統計已寫入資料庫，回傳內容保持精簡)。"""
+    IMAGES_PROCESSED.labels(outcome='success').inc()
+    return {
+        'status': 'SUCCESS', 'record_id': str(processed.id), 's3_key': s3_key,
+        'severity_score': processed.severity_score, 'processed': True
+    }
+
+
+def _maybe_finalize_batch(batch_job_id):
     """
-    封裝批次摘要分析邏輯，回傳 summary dict。
+    列表已完成且所有圖片都已處理 (成功+失敗 >= 總數) 時分派彙總任務。
+    以條件式 UPDATE 原子地取得分派權，確保彙總只會被分派一次。
     """
-    success, fail = 0, 0
-    total_score, score_count = 0.0, 0
-    agg_counts = {}
-    class_severity = {}
-    total_boxes = 0
-    healthy_boxes = 0
-
-    for r in results:
-        if not isinstance(r, dict) or 'processed' not in r:
-            continue
-        if r['status'] == 'SUCCESS':
-            success += 1
-            if r.get('severity_score') is not None:
-                try:
-                    total_score += float(r['severity_score'])
-                    score_count += 1
-                except (TypeError, ValueError):
-                    pass
-            for item in r.get('results_data', []) or []:
-                cls = item.get('class', 'unknown')
-                agg_counts[cls] = agg_counts.get(cls, 0) + 1
-                total_boxes += 1
-                if cls == 'healthy':
-                    healthy_boxes += 1
-                sev = item.get('severity')
-                if sev is not None:
-                    class_severity.setdefault(cls, []).append(float(sev))
-        else:
-            fail += 1
-
-    avg_score = round(total_score / score_count, 3) if score_count else None
-    disease_statistics = {}
-    for cls, count in agg_counts.items():
-        avg_sev = None
-        if cls in class_severity and class_severity[cls]:
-            avg_sev = round(sum(class_severity[cls]) / len(class_severity[cls]), 2)
-        disease_statistics[cls] = {"count": count, "average_severity": avg_sev}
-
-    healthy_ratio = round(healthy_boxes / total_boxes, 2) if total_boxes else None
-    if disease_statistics.get('angular leaf spot', {}).get('count', 0) > 0:
-        recommendations = "建議對檢測到角斑病的區域進行觀察，並考慮預防性措施。"
-    else:
-        recommendations = "田區狀況良好，持續觀察即可。"
-    overall_status_guess = "多數健康" if healthy_boxes > (total_boxes - healthy_boxes) else "需注意病害情況"
-
-    summary = {
-        "stats": {
-            "檢測到健康植株的框數": healthy_boxes,
-            "總檢測框數": total_boxes,
-            "成功處理圖片數": success,
-            "處理失敗圖片數": fail,
-        },
-        "overall_status_guess": overall_status_guess,
-        "disease_statistics": disease_statistics,
-        "healthy_plants_ratio": healthy_ratio,
-        "average_severity_score": avg_score,
-        "recommendations": recommendations,
-    }
-    return summary
+    claimed = BatchDetectionJob.objects.filter(
+        id=batch_job_id,
+        listing_completed=True,
+        finalization_dispatched=False,
+        total_images_found__lte=F('images_processed_successfully') + F('images_failed_to_process'),
+    ).update(finalization_dispatched=True)
+    if claimed:
+        finalize_batch_processing_task.delay(batch_job_id)
+    return bool(claimed)
 
 
 # ====== Celery 任務：單張 S3 圖片處理 ======
@@ -114,26 +174,17 @@ def process_s3_image_task(self, s3_bucket, s3_key, batch_job_id=None):
                 'exc_type': 'BatchJobNotFound',
                 'exc_message': f'id={batch_job_id} 不存在'
             })
-            return {
-                'status': 'FAILURE', 's3_key': s3_key,
-                'error': 'BatchJob 不存在', 'processed': False,
-                'class_counts': {}, 'severity_score': None
-            }
+            return _failure_payload(s3_key, 'BatchJob 不存在')
         except Exception as e:
             logger.error(f"{task_label}: Fetch BatchJob error: {e}", exc_info=True)
             raise self.retry(exc=e, countdown=60)
 
     # 下載 S3 圖片
     try:
-        client = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME,
-            config=boto3.session.Config(retries={'max_attempts': 3, 'mode': 'standard'})
-        )
-        obj = client.get_object(Bucket=s3_bucket, Key=s3_key)
-        img_bytes = obj['Body'].read()
+        client = get_s3_client()
+        with stage_timer('s3_get'):
+            obj = client.get_object(Bucket=s3_bucket, Key=s3_key)
+            img_bytes = obj['Body'].read()
         size = len(img_bytes)
         logger.info(f"{task_label}: Downloaded {size} bytes, Content-Type={obj.get('ContentType')}")
 
@@ -142,11 +193,7 @@ def process_s3_image_task(self, s3_bucket, s3_key, batch_job_id=None):
             if batch:
                 _increment_batch_failure(batch.id)
             self.update_state(state='FAILURE', meta={'exc_type': 'InvalidImage', 'exc_message': '圖檔過小'})
-            return {
-                'status': 'FAILURE', 's3_key': s3_key,
-                'error': '圖檔過小', 'processed': False,
-                'class_counts': {}, 'severity_score': None
-            }
+            return _failure_payload(s3_key, '圖檔過小')
     except ClientError as err:
         logger.error(f"{task_label}: S3 下載錯誤: {err}", exc_info=True)
         if batch:
@@ -157,6 +204,8 @@ def process_s3_image_task(self, s3_bucket, s3_key, batch_job_id=None):
     filename = os.path.basename(s3_key)
     ext = os.path.splitext(filename)[1].lower() or '.jpg'
     record = DetectionRecord(batch_job=batch)
+    if batch:
+        record.source_s3_object = (s3_bucket, s3_key)
 
     # 執行影像處理與儲存
     try:
@@ -170,25 +219,10 @@ def process_s3_image_task(self, s3_bucket, s3_key, batch_job_id=None):
 
         logger.info(f"{task_label}: 處理完成，Record ID={processed.id}")
         if batch:
-            BatchDetectionJob.objects.filter(id=batch.id).update(
-                images_processed_successfully=F('images_processed_successfully') + 1
-            )
+            fold_batch_results(batch.id, [processed])
+            _maybe_finalize_batch(batch.id)
 
-        # 建立 class_counts
-        counts = {}
-        for item in processed.results_data or []:
-            cls = item.get('class', 'unknown')
-            counts[cls] = counts.get(cls, 0) + 1
-
-        return {
-            'status': 'SUCCESS', 'record_id': str(processed.id),
-            's3_key': s3_key,
-            'original_image_url': getattr(processed.original_image, 'url', None),
-            'annotated_image_url': processed.annotated_image.url if processed.annotated_image and processed.annotated_image.name else None,
-            'results_data': processed.results_data,
-            'severity_score': processed.severity_score,
-            'class_counts': counts, 'processed': True
-        }
+        return _success_payload(processed, s3_key)
 
     except ImageDecodeError as ide:
         logger.error(f"{task_label}: 圖片解碼錯誤: {ide}", exc_info=True)
@@ -198,33 +232,203 @@ def process_s3_image_task(self, s3_bucket, s3_key, batch_job_id=None):
         record.severity_score = 1.0
         record.save()
         self.update_state(state='FAILURE', meta={'exc_type': 'ImageDecodeError', 'exc_message': str(ide)})
-        return {
-            'status': 'FAILURE', 's3_key': s3_key,
-            'error': f'DecodeError: {ide}', 'processed': False,
-            'class_counts': {}, 'severity_score': None
-        }
+        return _failure_payload(s3_key, f'DecodeError: {ide}')
 
     except Exception as ex:
         logger.error(f"{task_label}: 處理錯誤: {ex}", exc_info=True)
         if batch:
             _increment_batch_failure(batch.id)
-        if not record.pk:
+        if record._state.adding:
             record.results_data = {'error': str(ex), 'original_s3_key': s3_key}
             record.severity_score = 1.0
             record.save()
         self.update_state(state='FAILURE', meta={'exc_type': type(ex).__name__, 'exc_message': str(ex)})
-        return {
-            'status': 'FAILURE', 's3_key': s3_key,
-            'error': f'ProcessingError: {ex}', 'processed': False,
-            'class_counts': {}, 'severity_score': None
-        }
+        return _failure_payload(s3_key, f'ProcessingError: {ex}')
+
+
+# ====== Celery 任務：非同步手動上傳 ======
+@shared_task(bind=True, acks_late=True, time_limit=120, soft_time_limit=110, max_retries=2)
+def process_uploaded_image_task(self, record_id):
+    """
+    非同步上傳 (DETECTOR_ASYNC_UPLOADS)：對已儲存原始圖片的 PENDING 紀錄執行推論，
+    寫入結果、標註圖與縮圖 (原始圖片沿用，不重新上傳)，之後清理舊的手動上傳紀錄。
+    經由 CELERY_TASK_ROUTES 送到 interactive 佇列，不與批次任務排隊。
+    """
+    task_label = f"Task[{self.request.id}]-Record[{record_id}]"
+    statuses = DetectionRecord.ProcessingStatusChoices
+    try:
+        record = DetectionRecord.objects.get(id=record_id)
+    except DetectionRecord.DoesNotExist:
+        logger.warning(f"{task_label}: 紀錄不存在 (可能已被清理)，略過")
+        return {'status': 'missing', 'record_id': str(record_id)}
+
+    if record.processing_status == statuses.COMPLETED:
+        # acks_late 重新投遞時不重複處理
+        return {'status': 'success', 'record_id': str(record.id)}
+
+    record.processing_status = statuses.PROCESSING
+    record.save(update_fields=['processing_status'])
+
+    error = None
+    try:
+        with record.original_image.open('rb') as original_file:
+            image_bytes = original_file.read()
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"{task_label}: 讀取原始圖片失敗，稍後重試: {e}")
+            raise self.retry(exc=e, countdown=5 * (self.request.retries + 1))
+        error = e
+
+    if error is None:
+        ext = os.path.splitext(record.original_image.name)[1].lower() or '.jpg'
+        try:
+            process_image_bytes(image_bytes=image_bytes, file_ext=ext, detection_record_instance=record)
+        except Exception as ex:
+            error = ex
+
+    if error is not None:
+        logger.error(f"{task_label}: 處理錯誤: {error}", exc_info=error)
+        if not isinstance(record.results_data, dict) or 'error' not in record.results_data:
+            record.results_data = {'error': str(error)}
+        record.processing_status = statuses.FAILED
+        record.save(update_fields=['results_data', 'severity_score', 'processing_status'])
+        return {'status': 'failed', 'record_id': str(record.id), 'error': str(error)}
+
+    logger.info(f"{task_label}: 處理完成")
+    schedule_manual_cleanup()
+    return {'status': 'success', 'record_id': str(record.id), 'severity_score': record.severity_score}
+
+
+# ====== Celery 任務：多張 S3 圖片批次推論 ======
+@shared_task(bind=True, acks_late=True, time_limit=900, soft_time_limit=870, max_retries=3)
+def process_s3_image_batch_task(self, s3_bucket, s3_keys, batch_job_id=None):
+    """
+    處理一組 S3 圖片：逐張下載與驗證後，以一次批次推論送入 YOLO 模型，
+    再將每張圖片的結果分別存成 DetectionRecord。
+    BATCH_PIPELINE_ENABLED 為 True 時改用管線模式 (下載/推論/上傳重疊進行)。
+    回傳 list，每個元素為與 process_s3_image_task 相同格式的 dict。
+    """
+    task_label = f"Task[{self.request.id}]-Batch[{batch_job_id or 'N/A'}]-Chunk[{len(s3_keys)}]"
+    logger.info(f"{task_label}: Start processing {len(s3_keys)} images from s3://{s3_bucket}")
+
+    batch = None
+    if batch_job_id:
+        try:
+            batch = BatchDetectionJob.objects.get(id=batch_job_id)
+        except BatchDetectionJob.DoesNotExist:
+            logger.error(f"{task_label}: BatchJob {batch_job_id} not found.")
+            return [_failure_payload(k, 'BatchJob 不存在') for k in s3_keys]
+        except Exception as e:
+            logger.error(f"{task_label}: Fetch BatchJob error: {e}", exc_info=True)
+            raise self.retry(exc=e, countdown=60)
+
+    try:
+        client = get_s3_client()
+    except Exception as e:
+        logger.error(f"{task_label}: 建立 S3 client 失敗: {e}", exc_info=True)
+        raise self.retry(exc=e, countdown=60)
+
+    def fetch_image(s3_key):
+        img_bytes = _get_s3_object_bytes(client, s3_bucket, s3_key, log_label=task_label)
+        if len(img_bytes) < MIN_VALID_IMAGE_SIZE:
+            raise _InvalidImageError(f'圖檔過小 ({len(img_bytes)} bytes)')
+        return img_bytes
+
+    def build_item(s3_key, img_bytes):
+        ext = os.path.splitext(os.path.basename(s3_key))[1].lower() or '.jpg'
+        record = DetectionRecord(batch_job=batch)
+        record.source_s3_object = (s3_bucket, s3_key)
+        return img_bytes, ext, record
+
+    # outcomes: s3_key -> (record 或 None, error 或 None)；單張失敗只影響該張，不重試整個 chunk
+    outcomes = {}
+    folded = False
+    try:
+        if getattr(settings, 'BATCH_PIPELINE_ENABLED', False):
+            # 管線模式：背景預取下載與上傳，主執行緒持續推論
+            run_pipelined_batch(
+                s3_keys, fetch_image, build_item, log_label=task_label, outcomes=outcomes, **get_pipeline_options()
+            )
+        else:
+            image_items, item_keys = [], []
+            for s3_key in s3_keys:
+                try:
+                    image_items.append(build_item(s3_key, fetch_image(s3_key)))
+                    item_keys.append(s3_key)
+                except (ClientError, BotoCoreError, _InvalidImageError) as err:
+                    outcomes[s3_key] = (None, err)
+
+            # 一次批次推論並分別儲存
+            if image_items:
+                try:
+                    processed = process_image_batch(image_items)
+                except Exception as ex:
+                    logger.error(f"{task_label}: 批次推論錯誤: {ex}", exc_info=True)
+                    processed = [(record, ex) for _, _, record in image_items]
+                outcomes.update(zip(item_keys, processed))
+
+        payloads = {}
+        for s3_key in s3_keys:
+            record, error = outcomes[s3_key]
+            if error is None:
+                payloads[s3_key] = _success_payload(record, s3_key)
+            elif isinstance(error, _InvalidImageError):
+                logger.warning(f"{task_label}: {error}，略過 {s3_key}")
+                payloads[s3_key] = _failure_payload(s3_key, '圖檔過小')
+            elif record is None:
+                logger.error(f"{task_label}: S3 下載錯誤 ({s3_key}): {error}")
+                payloads[s3_key] = _failure_payload(s3_key, f'S3DownloadError: {error}')
+            elif isinstance(error, ImageDecodeError):
+                payloads[s3_key] = _failure_payload(s3_key, f'DecodeError: {error}')
+            else:
+                payloads[s3_key] = _failure_payload(s3_key, f'ProcessingError: {error}')
+
+        results = [payloads[k] for k in s3_keys]
+        succeeded_records = [outcomes[k][0] for k in s3_keys if payloads[k]['processed']]
+        succeeded = len(succeeded_records)
+        failed = len(results) - succeeded
+        if batch:
+            # 增量累加批次統計，彙總時不需再讀取每張圖片的結果
+            fold_batch_results(batch.id, succeeded_records, failed)
+            folded = True
+            _maybe_finalize_batch(batch.id)
+        logger.info(f"{task_label}: 完成，成功 {succeeded} 張，失敗 {failed} 張")
+        return results
+    except Exception as ex:
+        # 未預期的錯誤 (SoftTimeLimitExceeded、資料庫錯誤等)：下面的 finally 會把尚未計入的圖片記為失敗
+        logger.error(f"{task_label}: chunk 中斷 ({type(ex).__name__}): {ex}", exc_info=True)
+        raise
+    finally:
+        if batch and not folded:
+            _fold_interrupted_chunk(batch.id, s3_keys, outcomes, task_label)
+
+
+def _fold_interrupted_chunk(batch_job_id, s3_keys, outcomes, task_label):
+    """
+    chunk 中途中斷時，把已成功儲存的圖片計為成功、其餘 (含尚未處理的) 計為失敗，
+    確保 成功 + 失敗 最終會達到總數，批次不會永遠停在 PROCESSING。
+    """
+    succeeded_records = [outcomes[k][0] for k in s3_keys if k in outcomes and outcomes[k][1] is None]
+    failed = len(s3_keys) - len(succeeded_records)
+    try:
+        fold_batch_results(batch_job_id, succeeded_records, failed)
+    except Exception as e:
+        # 類別統計寫入失敗時至少累加計數 (類別統計在彙總時會由 rebuild_batch_aggregates 重算)
+        logger.error(f"{task_label}: 批次統計累加失敗，只累加計數: {e}", exc_info=True)
+        BatchDetectionJob.objects.filter(id=batch_job_id).update(
+            images_processed_successfully=F('images_processed_successfully') + len(succeeded_records),
+            images_failed_to_process=F('images_failed_to_process') + failed,
+        )
+    logger.warning(f"{task_label}: chunk 中斷，{len(succeeded_records)} 張計為成功、{failed} 張計為失敗")
+    _maybe_finalize_batch(batch_job_id)
 
 
 # ====== Celery 任務：批次彙總與清理 ======
 @shared_task(bind=True, name="detector.tasks.finalize_batch_processing")
-def finalize_batch_processing_task(self, results, batch_job_id):
+def finalize_batch_processing_task(self, batch_job_id):
     """
     批次處理完成後彙總結果並清理舊筆數。
+    由最後一個完成的子任務 (或列表結束時) 透過 _maybe_finalize_batch 觸發。
     """
     task_label = f"Task[{self.request.id}]-Finalize[{batch_job_id}]"
     logger.info(f"{task_label}: 開始最終統計")
@@ -235,13 +439,15 @@ def finalize_batch_processing_task(self, results, batch_job_id):
         logger.error(f"{task_label}: BatchJob 不存在，跳過")
         return
 
-    # 呼叫封裝後的摘要分析
-    summary = generate_batch_summary(results, batch)
+    # 以檢測框的 SQL 彙總校正子任務累加的統計 (框數 / 類別 / 嚴重程度)，再產生摘要
+    try:
+        rebuild_batch_aggregates(batch.id)
+        batch.refresh_from_db()
+    except Exception as e:
+        logger.error(f"{task_label}: SQL 彙總校正失敗，沿用增量統計: {e}", exc_info=True)
+    summary = build_batch_summary(batch)
 
     # 更新 BatchDetectionJob 狀態
-    # 這裡 summary 內已經有 success/fail 統計
-    batch.images_processed_successfully = summary['stats']['成功處理圖片數']
-    batch.images_failed_to_process = summary['stats']['處理失敗圖片數']
     if summary['stats']['處理失敗圖片數'] == 0:
         batch.status = BatchDetectionJob.StatusChoices.COMPLETED
     elif summary['stats']['成功處理圖片數'] > 0:
@@ -252,6 +458,7 @@ def finalize_batch_processing_task(self, results, batch_job_id):
 
     batch.summary_results = summary
     batch.save()
+    record_batch_throughput(batch)
 
     # 立即執行批次清理
     try:
@@ -279,6 +486,34 @@ def cleanup_old_detection_data_task():
         return f"Cleanup failed: {e}"
 
 
+@shared_task(name="detector.tasks.cleanup_manual_records_task", ignore_result=True)
+def cleanup_manual_records_task():
+    """手動上傳紀錄的數量清理 (由 schedule_manual_cleanup 延遲排入，一段時間內的多次上傳合併為一次)。"""
+    try:
+        deleted_count = DataRetentionManager().run_immediate_manual_cleanup()
+        logger.info(f"Task-CleanupManualRecords: 完成，刪除 {deleted_count} 筆")
+    except Exception as e:
+        logger.error(f"Task-CleanupManualRecords: 清理失敗: {e}", exc_info=True)
+
+
+def schedule_manual_cleanup():
+    """
+    新增手動上傳紀錄後呼叫：以 Redis SET NX EX 做 debounce，每 MANUAL_CLEANUP_DEBOUNCE_SECONDS 秒
+    最多排入一次 cleanup_manual_records_task (countdown 同為該秒數，期間的上傳都會被同一次清理涵蓋)。
+    request 路徑只做一次 Redis SET (與偶爾一次 apply_async)，不做任何資料庫清理。失敗時只記錄警告，
+    由每日的排程清理補上。
+    """
+    debounce_seconds = max(1, int(getattr(settings, 'MANUAL_CLEANUP_DEBOUNCE_SECONDS', 30)))
+    try:
+        if not get_redis_client().set(MANUAL_CLEANUP_DEBOUNCE_KEY, 1, nx=True, ex=debounce_seconds):
+            return False  # 已有排定的清理
+        cleanup_manual_records_task.apply_async(countdown=debounce_seconds)
+        return True
+    except Exception as e:
+        logger.warning(f"排入手動記錄清理失敗 (略過，由排程清理處理): {e}")
+        return False
+
+
 # ====== Celery 任務：批次處理 S3 資料夾 ======
 @shared_task(bind=True, time_limit=3600, soft_time_limit=3500, max_retries=2)
 def process_s3_folder_task(self, s3_bucket, s3_prefix):
@@ -302,43 +537,67 @@ def process_s3_folder_task(self, s3_bucket, s3_prefix):
         self.update_state(state='FAILURE', meta={'exc_type': type(e).__name__, 'exc_message': str(e)})
         return {'status': 'FAILURE', 'error': str(e)}
 
-    # 列出 S3 圖片
+    # 逐頁列出 S3 圖片，每頁的 key 立即切成 chunk 分派，不等整個列表完成
+    chunk_size = _get_batch_chunk_size()
+    pending_keys = []
+    dispatched_chunks = 0
+    total_found = 0
+
+    def dispatch_chunk(chunk_keys):
+        nonlocal dispatched_chunks
+        process_s3_image_batch_task.delay(s3_bucket, chunk_keys, batch.id)
+        dispatched_chunks += 1
+
     try:
-        client = boto3.client(
-            's3', aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION_NAME,
-            config=boto3.session.Config(retries={'max_attempts': 3, 'mode': 'standard'})
-        )
+        client = get_s3_client()
         prefix = s3_prefix.rstrip('/') + '/'
         paginator = client.get_paginator('list_objects_v2')
-        keys = []
         for page in paginator.paginate(Bucket=s3_bucket, Prefix=prefix):
-            for obj in page.get('Contents', []):
-                key = obj['Key']
-                if obj.get('Size', 0) > 0 and key.lower().endswith(('.jpg', '.png', '.webp')):
-                    keys.append(key)
+            page_keys = [
+                obj['Key'] for obj in page.get('Contents', [])
+                if obj.get('Size', 0) > 0 and obj['Key'].lower().endswith(('.jpg', '.png', '.webp'))
+            ]
+            if not page_keys:
+                continue
+
+            # 先累加總數再分派，完成判斷才不會提早成立
+            total_found += len(page_keys)
+            BatchDetectionJob.objects.filter(id=batch.id).update(
+                total_images_found=F('total_images_found') + len(page_keys)
+            )
+            pending_keys.extend(page_keys)
+            while len(pending_keys) >= chunk_size:
+                dispatch_chunk(pending_keys[:chunk_size])
+                pending_keys = pending_keys[chunk_size:]
+            logger.info(f"{task_label}: 已找到 {total_found} 張圖片，已分派 {dispatched_chunks} 個 chunk")
+
+        if pending_keys:
+            dispatch_chunk(pending_keys)
     except ClientError as err:
         logger.error(f"{task_label}: ListObjects 錯誤: {err}", exc_info=True)
-        batch.status = BatchDetectionJob.StatusChoices.FAILED
-        batch.error_message = str(err)
-        batch.save()
-        raise self.retry(exc=err, countdown=120)
+        if total_found == 0:
+            batch.status = BatchDetectionJob.StatusChoices.FAILED
+            batch.error_message = str(err)
+            batch.save()
+            raise self.retry(exc=err, countdown=120)
+        # 已分派部分圖片：不重試 (會建立新的批次)，以目前已找到的圖片完成此批次
+        if pending_keys:
+            dispatch_chunk(pending_keys)
+        BatchDetectionJob.objects.filter(id=batch.id).update(
+            error_message=f"S3 列表中途失敗，僅處理已列出的 {total_found} 張圖片: {err}"
+        )
 
-    # 更新並觸發子任務
-    batch.total_images_found = len(keys)
-    batch.save()
-    logger.info(f"{task_label}: 共找到 {len(keys)} 張圖片")
+    logger.info(f"{task_label}: 列表完成，共找到 {total_found} 張圖片，分派 {dispatched_chunks} 個 chunk (chunk_size={chunk_size})")
 
-    if not keys:
+    if not total_found:
         batch.status = BatchDetectionJob.StatusChoices.COMPLETED
+        batch.listing_completed = True
         batch.summary_results = {"message": "No images found."}
         batch.save()
         return {'status': 'NO_IMAGES', 'batch_id': str(batch.id)}
 
-    chord = group(
-        process_s3_image_task.s(s3_bucket, k, batch.id) for k in keys
-    ) | finalize_batch_processing_task.s(batch.id)
-    res = chord.apply_async()
-    logger.info(f"{task_label}: Chord dispatched ID={res.id}")
-    return {'status': 'DISPATCHED', 'batch_id': str(batch.id), 'chord_id': res.id}
+    BatchDetectionJob.objects.filter(id=batch.id).update(listing_completed=True)
+    # 所有 chunk 可能在列表結束前就已完成，這裡也要檢查一次
+    _maybe_finalize_batch(batch.id)
+    return {'status': 'DISPATCHED', 'batch_id': str(batch.id),
+            'total_images_found': total_found, 'chunks_dispatched': dispatched_chunks}
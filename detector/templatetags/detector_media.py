@@ -0,0 +1,31 @@
+# detector/templatetags/detector_media.py
+import logging
+from django import template
+
+register = template.Library()
+logger = logging.getLogger(__name__)
+
+
+@register.filter
+def media_url(field_file):
+    """
+    回傳圖片欄位的 URL (經由 storage 的預簽名 URL 快取)；沒有檔案或取得失敗時回傳空字串。
+    用法: {{ record.original_image|media_url }}
+    """
+    if not field_file or not getattr(field_file, 'name', None):
+        return ''
+    try:
+        return field_file.url
+    except Exception as e:
+        logger.warning(f"取得圖片 URL 失敗 ({field_file.name}): {e}")
+        return ''
+
+
+@register.filter
+def preview_url(record, kind='original'):
+    """
+    列表頁預覽用 URL：優先使用縮圖 (<kind>_thumbnail)，沒有縮圖的舊紀錄退回完整圖片 (<kind>_image)。
+    用法: {{ record|preview_url:'original' }}、{{ record|preview_url:'annotated' }}
+    """
+    return (media_url(getattr(record, f'{kind}_thumbnail', None))
+            or media_url(getattr(record, f'{kind}_image', None)))
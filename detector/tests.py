@@ -1,9 +1,31 @@
 # detector/tests.py
 
 import base64
-from django.test import TestCase
+import io
+from unittest import mock
+import cv2
+import numpy as np
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework.exceptions import ParseError
 from rest_framework.test import APIClient
 import os
+from .severity import score_detection_batch, score_detections
+from . import inference_utils
+from . import apps as detector_apps
+from .apps import DetectorConfig
+from .inference_cache import build_cache_key
+from .tiled_inference import iter_tiles, max_tiles_in_flight, merge_detections
+from . import bulk_delete
+from . import tasks
+from .cpu_scheduler import resolve_scheduler_config
+from .api import views as api_views
+from .api.parsers import RawImageParser
+from .models import BatchDetectionJob, DetectionBox, DetectionRecord
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate_batch_records
 
 class DetectionAPITest(TestCase):
 
@@ -31,3 +53,422 @@ class DetectionAPITest(TestCase):
         self.assertIn("record_id", response.data)
         self.assertIn("results", response.data)
         print("✅ 測試成功：辨識結果如下：", response.data)
+
+
+class SeverityScoreTest(SimpleTestCase):
+
+    def test_scores_match_rules(self):
+        leaf_spot = {"class": "angular leaf spot", "confidence_float": 0.8}
+        healthy = {"class": "healthy", "confidence_float": 0.6}
+        unknown = {"class": "rust", "confidence_float": 0.7}
+
+        scores = score_detection_batch([
+            [leaf_spot, dict(leaf_spot, confidence_float=0.5), healthy],  # 0.4 + 0.8*0.6 + 1*0.05
+            [healthy],                                                    # max(0, 0.05 - 0.6*0.05)
+            [unknown],
+            [],
+            {"error": "decode failed"},
+        ])
+        self.assertEqual(scores, [0.93, 0.02, 0.2, None, None])
+        self.assertEqual(score_detections([leaf_spot]), 0.88)
+
+
+class _StubResult:
+    """模擬 ultralytics Results：在影像中找出白色區域作為單一檢測框。"""
+
+    def __init__(self, image):
+        self.image = image
+        ys, xs = np.where(image[:, :, 0] > 200)
+        if len(xs):
+            self.boxes = [mock.Mock(cls=np.array([0.0]), conf=np.array([0.9]),
+                                    xyxy=np.array([[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]], dtype=float))]
+        else:
+            self.boxes = []
+
+    def plot(self):
+        return self.image.copy()
+
+
+class _StubModel:
+    names = {0: 'angular leaf spot'}
+
+    def __call__(self, source, conf=0.25, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        return [_StubResult(frame) for frame in frames]
+
+
+def _jpeg(width, height, exif_orientation=None):
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if exif_orientation:
+        exif[0x0112] = exif_orientation
+    Image.new('RGB', (width, height)).save(buffer, 'JPEG', exif=exif)
+    return buffer.getvalue()
+
+
+class ReducedDecodeTest(SimpleTestCase):
+
+    def test_choose_decode_reduction(self):
+        self.assertEqual(inference_utils.choose_decode_reduction(_jpeg(4000, 3000), 640), (4, (4000, 3000)))
+        self.assertEqual(inference_utils.choose_decode_reduction(_jpeg(1400, 1000), 640), (2, (1400, 1000)))
+        self.assertEqual(inference_utils.choose_decode_reduction(_jpeg(1000, 800), 640), (1, (1000, 800)))
+        # EXIF 旋轉 90 度：原始尺寸以旋轉後的寬高回傳
+        self.assertEqual(inference_utils.choose_decode_reduction(_jpeg(1600, 1200, exif_orientation=6), 640),
+                         (2, (1200, 1600)))
+        # 非 JPEG 或無法讀取 header 時以完整解析度解碼
+        png = cv2.imencode('.png', np.zeros((2000, 2000, 3), np.uint8))[1].tobytes()
+        self.assertEqual(inference_utils.choose_decode_reduction(png, 640), (1, None))
+        self.assertEqual(inference_utils.choose_decode_reduction(b'not an image', 640), (1, None))
+
+    def test_boxes_rescaled_to_original_resolution(self):
+        image = np.zeros((3000, 4000, 3), np.uint8)
+        image[800:1200, 1600:2400] = 255
+        jpeg = cv2.imencode('.jpg', image)[1].tobytes()
+
+        with mock.patch.object(inference_utils, 'get_yolo_model', return_value=_StubModel()), \
+                override_settings(YOLO_REDUCED_DECODE=True, YOLO_TILED_INFERENCE=False, YOLO_MODEL_IMGSZ=640):
+            annotated, results, frame = inference_utils.run_yolo_inference_on_image_data(jpeg)
+            self.assertEqual(frame.shape, (750, 1000, 3))  # 以 1/4 解碼送入模型
+            self.assertEqual(results[0]['xyxy'], [1600.0, 800.0, 2400.0, 1200.0])
+            self.assertEqual(annotated.shape, image.shape)  # 預設標註圖維持原尺寸
+
+            [(annotated, results, frame)] = inference_utils.run_yolo_inference_on_image_batch([jpeg])
+            self.assertEqual(results[0]['xyxy'], [1600.0, 800.0, 2400.0, 1200.0])
+            self.assertEqual(annotated.shape, image.shape)
+
+            with override_settings(YOLO_REDUCED_DECODE_ANNOTATION='reduced'):
+                annotated, results, frame = inference_utils.run_yolo_inference_on_image_data(jpeg)
+            self.assertEqual(annotated.shape, frame.shape)
+            self.assertEqual(results[0]['xyxy'], [1600.0, 800.0, 2400.0, 1200.0])
+
+
+class KeysetPaginationTest(TestCase):
+
+    def test_cursor_round_trip(self):
+        values = [0.5, '2024-05-01T12:00:00+00:00', '0b7c2c1e-9d43-4a53-8a8e-3f5c6a1d2e4f']
+        cursor = encode_cursor(values)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), values)
+        self.assertEqual(decode_cursor(encode_cursor([None, 'x', 'y'])), [None, 'x', 'y'])
+        for bad in ('***', encode_cursor({'a': 1})[:-2], base64.urlsafe_b64encode(b'{"a": 1}').decode()):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(bad)
+
+    def test_pages_cross_scored_unscored_boundary(self):
+        batch = BatchDetectionJob.objects.create(s3_bucket_name='bucket', s3_folder_prefix='rover')
+        # 相同分數的紀錄以 (uploaded_at, id) 排序；results_data 為錯誤 dict 時保留指定的分數
+        for severity in (0.9, 0.5, 0.5, 0.5, 0.1, None, None, None):
+            DetectionRecord.objects.create(batch_job=batch, original_image='uploads/x.jpg',
+                                           results_data={'error': 'x'} if severity is not None else None,
+                                           severity_score=severity)
+        records = batch.detection_records.all()
+        expected = (list(records.filter(severity_score__isnull=False).order_by('-severity_score', '-uploaded_at', '-id'))
+                    + list(records.filter(severity_score__isnull=True).order_by('-uploaded_at', '-id')))
+
+        for page_size in (1, 2, 3, 5, 8):
+            pages, cursor = [], None
+            while True:
+                page, cursor = paginate_batch_records(batch, cursor=cursor, page_size=page_size)
+                pages.append(page)
+                if cursor is None:
+                    break
+            self.assertEqual([r.id for page in pages for r in page], [r.id for r in expected], page_size)
+            self.assertTrue(all(len(page) == page_size for page in pages[:-1]))
+
+    def test_invalid_cursor_length(self):
+        batch = BatchDetectionJob.objects.create(s3_bucket_name='bucket', s3_folder_prefix='rover')
+        with self.assertRaises(InvalidCursor):
+            paginate_batch_records(batch, cursor=encode_cursor([0.5, '2024-05-01T12:00:00']))
+        with self.assertRaises(InvalidCursor):
+            paginate_batch_records(batch, cursor=encode_cursor(['high', '2024-05-01T12:00:00', str(batch.id)]))
+
+
+class BulkDeleteTest(TestCase):
+
+    def test_storage_object_deleter_chunks_s3_keys(self):
+        storage = mock.Mock(bucket_name='bucket', location='media')
+        client = storage.connection.meta.client
+        client.delete_objects.side_effect = lambda Bucket, Delete: (
+            {'Errors': [{'Key': Delete['Objects'][0]['Key'], 'Code': 'AccessDenied'}]}
+            if len(Delete['Objects']) < 1000 else {})
+        names = [f'uploads/{i}.jpg' for i in range(2500)] + ['uploads/0.jpg', '']  # 重複與空白檔名會被略過
+
+        with mock.patch.object(bulk_delete, 'invalidate_presigned_urls'), \
+                bulk_delete.StorageObjectDeleter(max_workers=2) as deleter:
+            deleter.submit(storage, names)
+
+        batches = [call.kwargs['Delete']['Objects'] for call in client.delete_objects.call_args_list]
+        self.assertEqual(sorted(len(objects) for objects in batches), [500, 1000, 1000])
+        keys = {obj['Key'] for objects in batches for obj in objects}
+        self.assertEqual(len(keys), 2500)
+        self.assertIn('media/uploads/2499.jpg', keys)
+        self.assertEqual((deleter.deleted, deleter.failed), (2499, 1))
+
+    def test_purge_detection_records_in_chunks(self):
+        records = []
+        for i in range(5):
+            record = DetectionRecord.objects.create(
+                original_image=f'uploads/{i}.jpg', annotated_image=f'results/{i}.jpg',
+                original_image_is_reference=(i == 0),
+            )
+            DetectionBox.objects.create(record=record, class_name='healthy', confidence=0.9)
+            records.append(record)
+        kept = DetectionRecord.objects.create(original_image='uploads/kept.jpg')
+
+        submitted = []
+        with mock.patch.object(bulk_delete.StorageObjectDeleter, 'submit',
+                               lambda self, storage, names: submitted.append(list(names))), \
+                override_settings(RETENTION_DELETE_CHUNK_SIZE=2):
+            stats = bulk_delete.purge_detection_records(
+                DetectionRecord.objects.filter(id__in=[r.id for r in records]))
+
+        self.assertEqual((stats['records'], stats['boxes']), (5, 5))
+        self.assertEqual(list(DetectionRecord.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(DetectionBox.objects.count(), 0)
+        self.assertEqual(len(submitted), 3)  # 每段 (2 + 2 + 1 筆) 提交一次 (各圖片欄位共用 default storage)
+        names = {name for chunk in submitted for name in chunk}
+        expected = {f'results/{i}.jpg' for i in range(5)} | {f'uploads/{i}.jpg' for i in range(1, 5)}
+        self.assertEqual(names, expected)  # 引用的來源物件 (uploads/0.jpg) 不刪除
+
+
+class TiledInferenceTest(SimpleTestCase):
+
+    def test_iter_tiles_cover_image_with_views(self):
+        image = np.zeros((1000, 1500, 3), np.uint8)
+        covered = np.zeros(image.shape[:2], bool)
+        tiles = list(iter_tiles(image, 640, 0.2))
+        for x0, y0, tile in tiles:
+            self.assertTrue(np.shares_memory(tile, image))  # tile 為 view，不複製
+            self.assertEqual(tile.shape, (640, 640, 3))  # 最後一個 tile 貼齊邊緣，大小不變
+            covered[y0:y0 + 640, x0:x0 + 640] = True
+        self.assertTrue(covered.all())
+        self.assertEqual(sorted({x0 for x0, _, _ in tiles}), [0, 512, 860])
+        self.assertEqual(sorted({y0 for _, y0, _ in tiles}), [0, 360])
+
+        # 比 tile 小的影像只有一個 tile
+        [(x0, y0, tile)] = iter_tiles(np.zeros((300, 400, 3), np.uint8), 640, 0.2)
+        self.assertEqual((x0, y0, tile.shape), (0, 0, (300, 400, 3)))
+
+    def test_merge_detections(self):
+        boxes = [
+            (100, 100, 200, 200),  # 相鄰 tile 重疊區域的同一個物件
+            (102, 98, 201, 203),
+            (100, 100, 200, 200),  # 同位置但不同類別，保留
+            (500, 500, 550, 550),
+        ]
+        scores = [0.6, 0.8, 0.7, 0.5]
+        class_ids = [0, 0, 1, 0]
+        self.assertEqual(merge_detections(boxes, scores, class_ids, 0.5), [1, 2, 3])
+        self.assertEqual(merge_detections([], [], [], 0.5), [])
+
+    def test_max_tiles_in_flight(self):
+        self.assertEqual(max_tiles_in_flight(640, 60), 2)
+        self.assertEqual(max_tiles_in_flight(640, 1), 1)  # 預算不足時至少 1
+
+    @override_settings(YOLO_TILED_INFERENCE=True, YOLO_TILE_SIZE=640, YOLO_TILED_MIN_DIMENSION=960,
+                       YOLO_REDUCED_DECODE=False)
+    def test_batch_counts_tiled_images_separately(self):
+        images = [_jpeg(1600, 1200), b'not an image', _jpeg(640, 480), _jpeg(800, 600)]
+        with mock.patch.object(inference_utils, 'get_yolo_model', return_value=_StubModel()), \
+                self.assertLogs('detector.inference_utils', level='INFO') as logs:
+            outputs = inference_utils.run_yolo_inference_on_image_batch(images)
+        self.assertIsInstance(outputs[1], inference_utils.ImageDecodeError)
+        self.assertTrue(all(isinstance(output, tuple) for i, output in enumerate(outputs) if i != 1))
+        self.assertIn('批次推論 2 張圖片 (分塊推論 1 張，解碼失敗 1 張)', '\n'.join(logs.output))
+
+
+class RawImageUploadTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.api_url = '/api/process/process/'
+
+    def test_raw_image_parser(self):
+        parser = RawImageParser()
+        self.assertEqual(parser.parse(io.BytesIO(b'png-bytes'), 'image/png'),
+                         {'image_bytes': b'png-bytes', 'file_ext': '.png'})
+        self.assertEqual(parser.parse(io.BytesIO(b'jpeg-bytes'), 'image/jpeg; q=1')['file_ext'], '.jpg')
+        self.assertEqual(parser.parse(io.BytesIO(b'x'), 'image/x-unknown')['file_ext'], '.jpg')
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b''), 'image/png')
+        with override_settings(API_MAX_IMAGE_BYTES=4), self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'12345'), 'image/png')
+
+    def _fake_batch(self, calls):
+        def process_image_batch(items, confidence=0.5):
+            calls.append([(image_bytes, file_ext) for image_bytes, file_ext, _ in items])
+            return [(DetectionRecord(results_data=[]), None) for _ in items]
+        return process_image_batch
+
+    def test_raw_body_upload(self):
+        calls = []
+        with mock.patch.object(api_views, 'process_image_batch', self._fake_batch(calls)), \
+                mock.patch.object(api_views, 'schedule_manual_cleanup'):
+            response = self.client.post(self.api_url, data=b'raw-image', content_type='image/png')
+            empty = self.client.post(self.api_url, data=b'', content_type='image/png')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(calls, [[(b'raw-image', '.png')]])
+        self.assertEqual(empty.status_code, 400)
+
+    def test_multipart_upload_is_chunked(self):
+        files = [
+            SimpleUploadedFile('a.jpg', b'a', content_type='image/jpeg'),
+            SimpleUploadedFile('notes.txt', b'text', content_type='text/plain'),
+            SimpleUploadedFile('b.png', b'b', content_type='image/png'),
+            SimpleUploadedFile('c.jpg', b'c', content_type='image/jpeg'),
+        ]
+        calls = []
+        with mock.patch.object(api_views, 'process_image_batch', self._fake_batch(calls)), \
+                mock.patch.object(api_views, 'schedule_manual_cleanup') as cleanup, \
+                override_settings(API_INFERENCE_CHUNK_SIZE=2):
+            response = self.client.post(self.api_url, data={'images': files}, format='multipart')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(calls, [[(b'a', '.jpg')], [(b'b', '.png'), (b'c', '.jpg')]])
+        images = response.data['images']
+        self.assertEqual([image['filename'] for image in images], ['a.jpg', 'notes.txt', 'b.png', 'c.jpg'])
+        self.assertIn('error', images[1])
+        self.assertNotIn('error', images[2])
+        cleanup.assert_called_once()
+
+        with override_settings(API_MAX_IMAGES_PER_REQUEST=1):
+            response = self.client.post(self.api_url, data={'images': files[:2]}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+
+
+class _FakeRedis:
+    """只實作 SET NX EX 的 Redis 替代品 (debounce 測試用)。"""
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        self.expiry[key] = ex
+        return True
+
+
+class ManualCleanupDebounceTest(SimpleTestCase):
+
+    @override_settings(MANUAL_CLEANUP_DEBOUNCE_SECONDS=45)
+    def test_schedules_once_per_window(self):
+        redis = _FakeRedis()
+        with mock.patch.object(tasks, 'get_redis_client', return_value=redis), \
+                mock.patch.object(tasks.cleanup_manual_records_task, 'apply_async') as apply_async:
+            self.assertTrue(tasks.schedule_manual_cleanup())
+            self.assertFalse(tasks.schedule_manual_cleanup())
+            self.assertFalse(tasks.schedule_manual_cleanup())
+        apply_async.assert_called_once_with(countdown=45)
+        self.assertEqual(redis.expiry[tasks.MANUAL_CLEANUP_DEBOUNCE_KEY], 45)
+
+        # debounce key 過期後會再排入一次
+        redis.values.clear()
+        with mock.patch.object(tasks, 'get_redis_client', return_value=redis), \
+                mock.patch.object(tasks.cleanup_manual_records_task, 'apply_async') as apply_async:
+            self.assertTrue(tasks.schedule_manual_cleanup())
+        apply_async.assert_called_once_with(countdown=45)
+
+    def test_redis_failure_is_swallowed(self):
+        with mock.patch.object(tasks, 'get_redis_client', side_effect=ConnectionError('redis down')), \
+                mock.patch.object(tasks.cleanup_manual_records_task, 'apply_async') as apply_async:
+            self.assertFalse(tasks.schedule_manual_cleanup())
+        apply_async.assert_not_called()
+
+
+@override_settings(INFERENCE_THREADS_PER_PROCESS=0)
+class SchedulerConfigTest(SimpleTestCase):
+
+    def test_auto_divides_cpus_by_concurrency(self):
+        self.assertEqual(resolve_scheduler_config(4, cpus=16),
+                         {'concurrency': 4, 'cpus': 16, 'threads': 4, 'source': 'auto'})
+        self.assertEqual(resolve_scheduler_config(3, cpus=8)['threads'], 2)
+        self.assertEqual(resolve_scheduler_config(8, cpus=4)['threads'], 1)
+
+    def test_calibration_requires_matching_cpus(self):
+        calibration = {'cpus': 8, 'threads_by_concurrency': {'2': 3}}
+        config = resolve_scheduler_config(2, cpus=8, calibration=calibration)
+        self.assertEqual((config['threads'], config['source']), (3, 'calibration'))
+        # 不同 CPU 數的主機或未量測的並行數改用自動計算
+        self.assertEqual(resolve_scheduler_config(2, cpus=16, calibration=calibration)['source'], 'auto')
+        self.assertEqual(resolve_scheduler_config(4, cpus=8, calibration=calibration)['source'], 'auto')
+
+    def test_settings_override_wins(self):
+        calibration = {'cpus': 8, 'threads_by_concurrency': {'2': 3}}
+        with override_settings(INFERENCE_THREADS_PER_PROCESS=6):
+            config = resolve_scheduler_config(2, cpus=8, calibration=calibration)
+        self.assertEqual((config['threads'], config['source']), (6, 'settings'))
+
+
+class RescoreDetectionRecordsTest(TestCase):
+
+    def test_rescore_legacy_batch_rebuilds_aggregates(self):
+        # migration 0005 之前完成的批次：有 summary_results，但累計值為 0、沒有類別統計與檢測框
+        batch = BatchDetectionJob.objects.create(
+            s3_bucket_name='bucket', s3_folder_prefix='legacy/',
+            status=BatchDetectionJob.StatusChoices.COMPLETED,
+            images_processed_successfully=2,
+            summary_results={'stats': {'總檢測框數': 3}, 'error_note': 'kept'},
+        )
+        spot = {'class': 'angular leaf spot', 'confidence_float': 0.5, 'xyxy': [0, 0, 10, 10]}
+        healthy = {'class': 'healthy', 'confidence_float': 0.9, 'xyxy': [10, 10, 20, 20]}
+        DetectionRecord.objects.create(batch_job=batch, results_data=[spot, healthy], severity_score=0.7)
+        DetectionRecord.objects.create(batch_job=batch, results_data=[spot], severity_score=0.7)
+        DetectionBox.objects.all().delete()
+
+        params = {'angular leaf spot': {'base': 0.2, 'confidence_factor': 0.2, 'per_detection_bonus': 0.0},
+                  'healthy': {'base': 0.05, 'confidence_factor': 0.05, 'per_detection_bonus': 0.0}}
+        with override_settings(DETECTOR_SEVERITY_CLASS_PARAMS=params):
+            call_command('rescore_detection_records', stdout=io.StringIO())
+
+        batch.refresh_from_db()
+        self.assertEqual((batch.total_boxes, batch.healthy_boxes, batch.severity_score_count), (3, 1, 2))
+        self.assertAlmostEqual(batch.severity_score_sum, 0.6)
+        summary = batch.summary_results
+        self.assertEqual(summary['stats']['總檢測框數'], 3)
+        self.assertEqual(summary['disease_statistics']['angular leaf spot'], {'count': 2, 'average_severity': 0.3})
+        self.assertEqual(summary['average_severity_score'], 0.3)
+        self.assertEqual(summary['error_note'], 'kept')
+        self.assertEqual(DetectionBox.objects.filter(record__batch_job=batch).count(), 3)
+
+
+class InferenceCacheKeyTest(SimpleTestCase):
+
+    def test_key_changes_with_encode_profile(self):
+        with mock.patch.object(detector_apps, 'yolo_model_weights_hash', 'a' * 64):
+            key = build_cache_key(b'image', 0.5)
+            self.assertEqual(build_cache_key(b'image', 0.5), key)
+            with override_settings(ANNOTATED_IMAGE_ENCODE_PROFILE='webp_q80'):
+                self.assertNotEqual(build_cache_key(b'image', 0.5), key)
+            with override_settings(THUMBNAIL_ENCODE_PROFILE='webp_thumb_320'):
+                self.assertNotEqual(build_cache_key(b'image', 0.5), key)
+            with override_settings(THUMBNAIL_MAX_DIMENSION=160):
+                self.assertNotEqual(build_cache_key(b'image', 0.5), key)
+            with override_settings(ANNOTATED_IMAGE_ENCODE_PROFILES={'jpeg_q80': {'format': 'jpeg', 'quality': 60}}):
+                self.assertEqual(build_cache_key(b'image', 0.5), key)  # 未使用的設定檔不影響 key
+
+
+class AsyncUploadModelLoadingTest(TestCase):
+
+    def test_web_skips_model_load_when_async(self):
+        config = DetectorConfig.create('detector')
+        with mock.patch.object(detector_apps, 'detect_process_role', return_value='web'), \
+                mock.patch('detector.cpu_scheduler.configure_inference_process'), \
+                mock.patch.object(detector_apps, 'ensure_yolo_model_loaded') as ensure_loaded:
+            with override_settings(DETECTOR_ASYNC_UPLOADS=True):
+                config.ready()
+            ensure_loaded.assert_not_called()
+            with override_settings(DETECTOR_ASYNC_UPLOADS=False):
+                config.ready()
+            ensure_loaded.assert_called_once_with(role='web')
+
+    @override_settings(DETECTOR_ASYNC_UPLOADS=True)
+    def test_detail_view_does_not_load_model_when_async(self):
+        record = DetectionRecord.objects.create(results_data=[{'class': 'healthy'}, {'class': 'angular leaf spot'}])
+        with mock.patch.object(detector_apps, 'yolo_model', None), \
+                mock.patch.object(detector_apps, 'get_yolo_model') as get_model:
+            response = self.client.get(reverse('detector:detection_detail', kwargs={'record_id': record.id}))
+        get_model.assert_not_called()
+        self.assertEqual(response.context['class_names'], ['angular leaf spot', 'healthy'])
@@ -0,0 +1,112 @@
+# detector/tiled_inference.py
+# ------------------------------------------------
+# 大尺寸畫面的分塊 (tiled) 推論：整張高解析度畫面送入模型時會被縮到 YOLO_MODEL_IMGSZ，
+# 細小的病斑會消失。開啟 YOLO_TILED_INFERENCE 後，超過 YOLO_TILED_MIN_DIMENSION 的畫面會
+# 切成互相重疊的 tile (大小 = 模型輸入尺寸，不需縮放)，分批送入模型，
+# 再把各 tile 的檢測框平移回原圖座標並以 NMS 合併 (流程見 inference_utils._run_tiled_inference)。
+#
+# 記憶體：tile 是解碼後影像的 view (不複製)；每次送入模型的 tile 數由 YOLO_TILED_MEMORY_BUDGET_MB
+# 估算上限，標註圖只在原圖複本上畫一次框，不保留每個 tile 的 plot() 結果。
+# ------------------------------------------------
+import cv2
+import numpy as np
+from django.conf import settings
+
+# 每個 tile 在推論中的估計記憶體 (相對於 tile 的 uint8 BGR 大小)：
+# letterbox 複本 + float32 輸入張量 (4 倍) + 前幾層的特徵圖，保守估計為 24 倍
+TILE_MEMORY_FACTOR = 24
+
+_BOX_COLOR = (0, 0, 255)
+
+
+def get_tiling_options():
+    """回傳分塊推論設定；未開啟時回傳 None。"""
+    if not getattr(settings, 'YOLO_TILED_INFERENCE', False):
+        return None
+    tile_size = getattr(settings, 'YOLO_TILE_SIZE', None) or getattr(settings, 'YOLO_MODEL_IMGSZ', 640)
+    overlap = min(max(float(getattr(settings, 'YOLO_TILE_OVERLAP', 0.2)), 0.0), 0.5)
+    return {
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'min_dimension': getattr(settings, 'YOLO_TILED_MIN_DIMENSION', None) or int(tile_size * 1.5),
+        'nms_iou': getattr(settings, 'YOLO_TILE_NMS_IOU', 0.5),
+        'max_tiles_in_flight': max_tiles_in_flight(tile_size, getattr(settings, 'YOLO_TILED_MEMORY_BUDGET_MB', 512)),
+    }
+
+
+def cache_variant(options=None):
+    """推論快取 key 的附加欄位 (分塊推論的結果與整張推論不同，不可共用快取)；未開啟時為空字串。"""
+    options = options if options is not None else get_tiling_options()
+    if options is None:
+        return ''
+    return f"tile{options['tile_size']}o{options['overlap']:.2f}n{options['nms_iou']:.2f}"
+
+
+def should_tile(image_shape, options):
+    return options is not None and max(image_shape[:2]) > options['min_dimension']
+
+
+def max_tiles_in_flight(tile_size, memory_budget_mb):
+    """依記憶體預算計算一次送入模型的 tile 數上限 (至少 1)。"""
+    tile_bytes = tile_size * tile_size * 3 * TILE_MEMORY_FACTOR
+    return max(1, int(memory_budget_mb * 1024 * 1024 // tile_bytes))
+
+
+def _tile_starts(length, tile_size, stride):
+    """單一方向的 tile 起點；最後一個 tile 貼齊邊緣，確保涵蓋整張畫面。"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def iter_tiles(image, tile_size, overlap):
+    """
+    將影像切成互相重疊的 tile。
+
+    Yields:
+        (x0, y0, tile)：tile 為 image 的 view (不複製)，(x0, y0) 為其左上角在原圖的座標。
+    """
+    height, width = image.shape[:2]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    for y0 in _tile_starts(height, tile_size, stride):
+        for x0 in _tile_starts(width, tile_size, stride):
+            yield x0, y0, image[y0:y0 + tile_size, x0:x0 + tile_size]
+
+
+def merge_detections(boxes, scores, class_ids, iou_threshold):
+    """
+    以各類別分開的 NMS 合併所有 tile 的檢測框 (原圖座標)。
+
+    Args:
+        boxes: (N, 4) xyxy；scores: (N,)；class_ids: (N,)。
+
+    Returns:
+        保留的索引 (依信心度由高到低)。
+    """
+    if len(boxes) == 0:
+        return []
+    boxes = np.asarray(boxes, dtype=np.float32)
+    xywh = np.column_stack([boxes[:, 0], boxes[:, 1], boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]])
+    keep = cv2.dnn.NMSBoxesBatched(xywh.tolist(), [float(s) for s in scores], [int(c) for c in class_ids],
+                                   0.0, float(iou_threshold))
+    keep = np.asarray(keep, dtype=int).reshape(-1)
+    return sorted(keep.tolist(), key=lambda i: -scores[i])
+
+
+def draw_detections(image, detections):
+    """在影像複本上畫出檢測框與標籤 (分塊推論不使用各 tile 的 plot())。"""
+    annotated = image.copy()
+    thickness = max(2, round(max(image.shape[:2]) / 640))
+    font_scale = thickness / 3
+    for detection in detections:
+        x1, y1, x2, y2 = (int(round(v)) for v in detection['xyxy'])
+        label = f"{detection['class']} {detection['confidence_str']}"
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), _BOX_COLOR, thickness)
+        (text_width, text_height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+        label_top = max(0, y1 - text_height - baseline)
+        cv2.rectangle(annotated, (x1, label_top), (x1 + text_width, label_top + text_height + baseline), _BOX_COLOR, -1)
+        cv2.putText(annotated, label, (x1, label_top + text_height), cv2.FONT_HERSHEY_SIMPLEX,
+                    font_scale, (255, 255, 255), max(1, thickness - 1), cv2.LINE_AA)
+    return annotated
@@ -0,0 +1,61 @@
+# detector/upload_pool.py
+# ------------------------------------------------
+# 每個 process 共用的上傳執行緒池：同一筆紀錄的原始圖與標註圖同時上傳，
+# 每張圖片的等待時間約少一次 S3 往返。
+# ------------------------------------------------
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_upload_pool():
+    """
+    取得此 process 的上傳執行緒池。以 pid 判斷是否在 fork 之後，fork 後重新建立
+    (prefork worker 的子 process 不會繼承父 process 的執行緒)。
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ThreadPoolExecutor(
+                max_workers=max(1, getattr(settings, 'S3_UPLOAD_POOL_WORKERS', 8)),
+                thread_name_prefix='s3-upload',
+            )
+            _pool_pid = pid
+    return _pool
+
+
+def run_concurrently(callables):
+    """
+    在共用執行緒池中同時執行多個無參數 callable，等待全部完成。
+    只有一個時直接在目前執行緒執行。
+
+    Returns:
+        與輸入等長的 list，每個元素為 (result, exception)；成功時 exception 為 None。
+    """
+    callables = list(callables)
+    if len(callables) <= 1:
+        outcomes = []
+        for fn in callables:
+            try:
+                outcomes.append((fn(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    futures = [get_upload_pool().submit(fn) for fn in callables]
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append((future.result(), None))
+        except Exception as e:
+            outcomes.append((None, e))
+    return outcomes
@@ -14,6 +14,7 @@ urlpatterns = [
 
     # 2. 自走車批次辨識歷史列表頁面
     path('batch-history/', views.batch_detection_history_view, name='batch_detection_history'),
+    path('batch-history/items/', views.batch_detection_history_items_view, name='batch_detection_history_items'),  # 無限捲動片段
 
     # 3. 手動上傳辨識歷史列表頁面
     # 我們需要一個 View 來處理這個，可以修改舊的 detection_history_view
@@ -24,8 +25,13 @@ urlpatterns = [
     # 4. 單筆"手動上傳"歷史紀錄詳情頁面 (保持不變，因為它接收 record_id)
     # 它的連結會從 manual-history 頁面過來
     path('manual-history/<uuid:record_id>/', views.detection_detail_view, name='detection_detail'), # 注意 URL name 保持為 detection_detail
+    path('manual-history/<uuid:record_id>/status/', views.detection_status_view, name='detection_status'),  # 非同步上傳的狀態輪詢 (JSON)
 
     # 5. 我們下一步 (2.2) 要創建的「批次辨識結果詳情」頁面的 URL，先預留 name
     path('batch-result/<uuid:batch_job_id>/', views.batch_detection_detail_view, name='batch_detection_detail'),
+    path('batch-result/<uuid:batch_job_id>/records/', views.batch_detection_records_view, name='batch_detection_records'),  # 無限捲動片段
+
+    # 6. 推論結果快取統計 (JSON)
+    path('inference-cache/stats/', views.inference_cache_stats_view, name='inference_cache_stats'),
 
 ]
\ No newline at end of file
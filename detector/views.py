@@ -1,17 +1,21 @@
 ## detector/views.py
+import hmac
 import os
-import uuid
-import base64
-import json
-import traceback
-from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse, HttpResponseBadRequest
-from django.views.decorators.csrf import csrf_exempt
+from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404
 from django.conf import settings
-from django.core.files.base import ContentFile
 from .models import DetectionRecord, BatchDetectionJob
-from .services import process_image_bytes
-from .retention_manager import DataRetentionManager
+from .services import process_image_bytes, store_pending_upload
+from .tasks import process_uploaded_image_task, schedule_manual_cleanup
+from .inference_cache import get_inference_cache_stats
+from .batch_aggregates import build_batch_summary
+from .media_urls import prime_media_urls
+from .metrics import render_latest
+from .pagination import (
+    paginate_batch_jobs, paginate_batch_records, InvalidCursor,
+    DEFAULT_BATCH_HISTORY_PAGE_SIZE, DEFAULT_BATCH_RECORDS_PAGE_SIZE,
+)
 import logging
 
 view_logger = logging.getLogger(__name__)
@@ -29,17 +33,22 @@ def upload_detect_view(request):
         'limit_notice': "系統僅保留最近 10 筆辨識紀錄。"
     }
 
+    # 非同步模式由 worker 推論，web process 不需要載入模型
+    async_uploads = getattr(settings, 'DETECTOR_ASYNC_UPLOADS', False)
+
     # 檢查 YOLO 模型是否載入
-    try:
-        from .apps import yolo_model
-        if yolo_model is None:
-            raise RuntimeError("YOLO model is not loaded.")
-        if hasattr(yolo_model, 'names') and isinstance(yolo_model.names, dict):
-            context['class_names'] = list(yolo_model.names.values())
-    except Exception as e:
-        view_logger.error(f"載入 YOLO 模型時出錯: {e}", exc_info=True)
-        context['error_message'] = f"載入 YOLO 模型時出錯: {e}"
-        return render(request, 'detector/upload_form.html', context)
+    if not async_uploads:
+        try:
+            from .apps import get_yolo_model
+            yolo_model = get_yolo_model()
+            if yolo_model is None:
+                raise RuntimeError("YOLO model is not loaded.")
+            if hasattr(yolo_model, 'names') and isinstance(yolo_model.names, dict):
+                context['class_names'] = list(yolo_model.names.values())
+        except Exception as e:
+            view_logger.error(f"載入 YOLO 模型時出錯: {e}", exc_info=True)
+            context['error_message'] = f"載入 YOLO 模型時出錯: {e}"
+            return render(request, 'detector/upload_form.html', context)
 
     if request.method == 'POST':
         try:
@@ -52,6 +61,11 @@ def upload_detect_view(request):
             image_bytes = uploaded_file.read()
             file_ext = os.path.splitext(uploaded_file.name)[1].lower() or '.jpg'
 
+            if async_uploads:
+                # 非同步模式：只儲存原始圖片並排入 interactive 佇列，結果頁輪詢狀態端點
+                record = _submit_async_upload(image_bytes, file_ext)
+                return redirect('detector:detection_detail', record_id=record.id)
+
             # 為手動上傳創建一個 DetectionRecord 實例 (batch_job 為 None)
             # 這個 record 實例還沒有儲存到資料庫，也沒有圖片或結果數據
             manual_record_instance = DetectionRecord() 
@@ -75,11 +89,8 @@ def upload_detect_view(request):
                 'results': record.results_data
             })
 
-            # 3. 清理舊的手動上傳記錄 (這裡可以選擇性地使用 DataRetentionManager)
-            try:
-                DataRetentionManager().run_immediate_manual_cleanup()
-            except Exception as cleanup_exc:
-                view_logger.error(f"在 View 中執行即時手動記錄清理時發生錯誤: {cleanup_exc}", exc_info=True)
+            # 3. 清理舊的手動上傳記錄：交給背景任務 (debounce，連續上傳只清理一次)，不在 request 中執行
+            schedule_manual_cleanup()
 
             return render(request, 'detector/detection_result.html', context)
 
@@ -90,29 +101,18 @@ def upload_detect_view(request):
 
     return render(request, 'detector/upload_form.html', context)
 
-@csrf_exempt 
-def api_process_view(request):
-    """API endpoint: 接收 base64 圖片，觸發 service 流程並回傳結果"""
-    if request.method != 'POST':
-        return HttpResponseBadRequest("只接受 POST 請求")
+def _submit_async_upload(image_bytes, file_ext):
+    """儲存 PENDING 紀錄並排入推論任務；排入失敗時把紀錄標記為 FAILED 後重新拋出。"""
+    record = store_pending_upload(image_bytes, file_ext)
     try:
-        payload = json.loads(request.body)
-        img_b64 = payload.get('image_base64')
-        if not img_b64:
-            return HttpResponseBadRequest("缺少 image_base64 欄位")
-
-        image_bytes = base64.b64decode(img_b64)
-        record = process_image_bytes(image_bytes, file_ext='.jpg')
-
-        return JsonResponse({
-            'record_id': str(record.id),
-            'orig_url': record.original_image.url,
-            'annotated_url': record.annotated_image.url if record.annotated_image else None,
-            'results': record.results_data
-        }, status=201)
+        process_uploaded_image_task.delay(str(record.id))
     except Exception as e:
-        view_logger.error(f"API 處理失敗: {e}\n{traceback.format_exc()}")
-        return JsonResponse({'error': str(e)}, status=500)
+        record.processing_status = DetectionRecord.ProcessingStatusChoices.FAILED
+        record.results_data = {'error': f'Failed to enqueue inference task: {e}'}
+        record.save(update_fields=['processing_status', 'results_data', 'severity_score'])
+        raise
+    view_logger.info(f"已排入非同步辨識任務，Record ID={record.id}")
+    return record
 
 def detection_history_view(request):
     """
@@ -120,6 +120,9 @@ def detection_history_view(request):
     """
     # 只查詢 batch_job 為 NULL 的 DetectionRecord
     manual_records = DetectionRecord.objects.filter(batch_job__isnull=True).order_by('-uploaded_at')[:10]
+    # 列表預覽使用縮圖 (見 templatetags/detector_media.preview_url)，URL 一次批次取得
+    prime_media_urls(manual_records, field_names=[('annotated_thumbnail', 'annotated_image',
+                                                   'original_thumbnail', 'original_image')])
     # 你可以保留或調整 [:10] 來限制數量
 
     context = {
@@ -145,20 +148,37 @@ def detection_detail_view(request, record_id):
     # 這部分邏輯你原本可能就有，如果 yolo_model 在 apps.py 中正確載入
     class_names_for_template = []
     try:
-        from .apps import yolo_model # 確保 yolo_model 能被正確引用
+        from . import apps as detector_apps # 確保 yolo_model 能被正確引用 (必要時延遲載入)
+        # 非同步模式的 web process 不載入模型：只使用已載入的模型，否則列出此紀錄出現的類別
+        if getattr(settings, 'DETECTOR_ASYNC_UPLOADS', False):
+            yolo_model = detector_apps.yolo_model
+        else:
+            yolo_model = detector_apps.get_yolo_model()
         if yolo_model and hasattr(yolo_model, 'names') and isinstance(yolo_model.names, dict):
             class_names_for_template = list(yolo_model.names.values())
+        elif isinstance(record.results_data, list):
+            class_names_for_template = sorted({item.get('class', 'unknown') for item in record.results_data})
     except ImportError:
         view_logger.warning("YOLO model could not be imported for class_names in detection_detail_view.")
     except Exception as e:
         view_logger.error(f"Error getting class_names in detection_detail_view: {e}", exc_info=True)
 
 
+    is_pending = record.processing_status in (DetectionRecord.ProcessingStatusChoices.PENDING,
+                                              DetectionRecord.ProcessingStatusChoices.PROCESSING)
+    error_message = None
+    if record.processing_status == DetectionRecord.ProcessingStatusChoices.FAILED and isinstance(record.results_data, dict):
+        error_message = record.results_data.get('error')
+
     context = {
         'record': record, # 傳遞整個 record 物件，模板中可以訪問 record.original_image.url 等
         'uploaded_image_url': record.original_image.url if record.original_image else None,
         'annotated_image_url': record.annotated_image.url if record.annotated_image else None,
-        'results': record.results_data or [],
+        'results': (record.results_data or []) if isinstance(record.results_data, list) else [],
+        'is_pending': is_pending,
+        'error_message': error_message,
+        'status_url': reverse('detector:detection_status', kwargs={'record_id': record.id}) if is_pending else None,
+        'status_poll_ms': getattr(settings, 'DETECTOR_UPLOAD_STATUS_POLL_MS', 1000),
         'record_id': record.id, # 雖然 record 物件裡有 id，但明確傳遞有時更方便
         'severity_score': record.severity_score, # <-- 新增：傳遞嚴重程度評分
         'class_names': class_names_for_template, # <-- 確保傳遞 class_names
@@ -168,57 +188,93 @@ def detection_detail_view(request, record_id):
     }
     return render(request, 'detector/detection_result.html', context)
 
+def _batch_history_page(request):
+    """取得批次歷史列表的一頁 (keyset 分頁)，回傳模板 context。"""
+    batch_jobs, next_cursor = paginate_batch_jobs(
+        BatchDetectionJob.objects.all(),
+        cursor=request.GET.get('cursor'),
+        page_size=getattr(settings, 'BATCH_HISTORY_PAGE_SIZE', DEFAULT_BATCH_HISTORY_PAGE_SIZE),
+    )
+    return {
+        'batch_jobs': batch_jobs,
+        'next_cursor': next_cursor,
+        'fragment_url': reverse('detector:batch_detection_history_items'),
+    }
+
 def batch_detection_history_view(request):
     """
-    顯示所有批次辨識任務的歷史列表。
+    顯示批次辨識任務的歷史列表。
+    以 (created_at, id) keyset 分頁，之後的頁面由 batch_detection_history_items_view 以無限捲動載入。
     """
-    # 查詢所有的 BatchDetectionJob 記錄，按創建時間倒序排列 (最新的在前面)
-    batch_jobs = BatchDetectionJob.objects.all().order_by('-created_at')
-    
-    # 也可以在這裡加入分頁邏輯，如果批次任務很多的話
-    # from django.core.paginator import Paginator
-    # paginator = Paginator(batch_jobs, 10) # 每頁顯示 10 個批次任務
-    # page_number = request.GET.get('page')
-    # page_obj = paginator.get_page(page_number)
+    try:
+        context = _batch_history_page(request)
+    except InvalidCursor:
+        return HttpResponseBadRequest("無效的分頁參數")
 
-    context = {
-        'batch_jobs': batch_jobs, # 或者 page_obj 如果使用分頁
+    context.update({
         'page_title': "批次辨識歷史紀錄", # 給模板一個頁面標題
-        'limit_notice': "顯示所有已提交的批次辨識任務。" # 可以根據需要修改提示
-    }
+        'limit_notice': "顯示所有已提交的批次辨識任務 (向下捲動載入更多)。"
+    })
     return render(request, 'detector/batch_history.html', context)
 
+def batch_detection_history_items_view(request):
+    """批次歷史列表的下一頁 HTML 片段 (無限捲動用)。"""
+    try:
+        context = _batch_history_page(request)
+    except InvalidCursor:
+        return HttpResponseBadRequest("無效的分頁參數")
+    return render(request, 'detector/partials/batch_history_items.html', context)
+
+def _batch_records_page(request, batch_job):
+    """取得批次內辨識紀錄的一頁 (keyset 分頁，按嚴重程度排序)，回傳模板 context。"""
+    detection_records, next_cursor = paginate_batch_records(
+        batch_job,
+        cursor=request.GET.get('cursor'),
+        page_size=getattr(settings, 'BATCH_DETAIL_PAGE_SIZE', DEFAULT_BATCH_RECORDS_PAGE_SIZE),
+    )
+    # 整頁的圖片 URL 一次取得 (一次 Redis MGET + 批次簽章)，模板中的 .url 直接命中記憶體快取
+    prime_media_urls(detection_records, field_names=[('original_thumbnail', 'original_image')])
+    return {
+        'batch_job': batch_job,
+        'detection_records': detection_records,
+        'next_cursor': next_cursor,
+        'fragment_url': reverse('detector:batch_detection_records', kwargs={'batch_job_id': batch_job.id}),
+    }
+
 def batch_detection_detail_view(request, batch_job_id):
     """
     顯示特定批次辨識任務的詳細結果。
-    包括批次摘要和該批次下所有圖片的辨識記錄 (按嚴重程度排序)。
+    包括批次摘要和該批次下的辨識記錄 (按嚴重程度排序，未評分的排在最後)。
+    紀錄以 keyset 分頁，每頁成本固定，其餘頁面由 batch_detection_records_view 以無限捲動載入。
     """
     # 根據傳入的 batch_job_id 獲取 BatchDetectionJob 實例，如果不存在則返回 404
     batch_job = get_object_or_404(BatchDetectionJob, pk=batch_job_id)
-
-    # 查詢所有與此 BatchDetectionJob 相關聯的 DetectionRecord 實例
-    # 使用 related_name 'detection_records' 進行反向查詢
-    # 並按照 severity_score 降序排列 (None 值排在後面或前面，取決於資料庫，通常 NULLS LAST)
-    # 為了確保 None 值排在後面，可以這樣處理 (如果 severity_score 允許 NULL):
-    # from django.db.models import F, Q, Func
-    # detection_records = batch_job.detection_records.all().order_by(
-    #     F('severity_score').desc(nulls_last=True)
-    # )
-    # 或者，如果 severity_score 不會有 NULL (例如預設為0)，可以直接：
-    detection_records = batch_job.detection_records.all().order_by('-severity_score', '-uploaded_at')
+    try:
+        context = _batch_records_page(request, batch_job)
+    except InvalidCursor:
+        return HttpResponseBadRequest("無效的分頁參數")
 
     batch_summary = batch_job.summary_results
     if not batch_summary:
-        batch_summary = {"message": "摘要資訊正在生成中，請稍後重新整理頁面。"}
+        # 批次仍在處理中：直接由累計統計產生即時摘要
+        batch_summary = build_batch_summary(batch_job)
+        batch_summary["message"] = "批次仍在處理中，以下為即時統計，請稍後重新整理頁面。"
 
-    context = {
-        'batch_job': batch_job,
-        'detection_records': detection_records,
+    context.update({
         'batch_summary': batch_summary, # 傳遞批次摘要
         'page_title': f"批次任務詳情 ({batch_job_id})",
-    }
+    })
     return render(request, 'detector/batch_detail_result.html', context)
 
+def batch_detection_records_view(request, batch_job_id):
+    """批次詳情頁圖片卡片的下一頁 HTML 片段 (無限捲動用)。"""
+    batch_job = get_object_or_404(BatchDetectionJob, pk=batch_job_id)
+    try:
+        context = _batch_records_page(request, batch_job)
+    except InvalidCursor:
+        return HttpResponseBadRequest("無效的分頁參數")
+    return render(request, 'detector/partials/batch_record_cards.html', context)
+
 def history_landing_view(request):
     """
     顯示歷史紀錄的選擇頁面 (自走車批次 vs 手動上傳)。
@@ -227,3 +283,48 @@ def history_landing_view(request):
         'page_title': "查看歷史紀錄"
     }
     return render(request, 'detector/history_landing.html', context)
+
+def detection_status_view(request, record_id):
+    """
+    非同步上傳的輕量狀態端點 (JSON)，供結果頁輪詢；只查詢狀態相關欄位。
+    """
+    record = get_object_or_404(
+        DetectionRecord.objects.only('id', 'processing_status', 'severity_score'), pk=record_id
+    )
+    return JsonResponse({
+        'record_id': str(record.id),
+        'status': record.processing_status,
+        'done': record.processing_status in (DetectionRecord.ProcessingStatusChoices.COMPLETED,
+                                             DetectionRecord.ProcessingStatusChoices.FAILED),
+        'severity_score': record.severity_score,
+    })
+
+def _has_monitoring_access(request):
+    """營運用端點 (指標、快取統計) 只允許 staff 使用者或帶有 METRICS_AUTH_TOKEN 的請求。"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_AUTH_TOKEN', '')
+    scheme, _, provided = request.headers.get('Authorization', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(provided.strip(), token)
+
+
+def inference_cache_stats_view(request):
+    """
+    回傳推論結果快取的命中/未命中統計 (JSON)。
+    """
+    if not _has_monitoring_access(request):
+        return HttpResponseForbidden("Forbidden")
+    return JsonResponse(get_inference_cache_stats())
+
+
+def metrics_view(request):
+    """
+    Prometheus 文字格式的指標 (彙總此容器所有 gunicorn worker process；見 detector/metrics.py)。
+    """
+    if not getattr(settings, 'METRICS_ENABLED', True):
+        raise Http404("Metrics are disabled.")
+    if not _has_monitoring_access(request):
+        return HttpResponseForbidden("Forbidden")
+    content, content_type = render_latest()
+    return HttpResponse(content, content_type=content_type)
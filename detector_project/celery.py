@@ -1,6 +1,7 @@
 # detector_project/celery.py
 import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init
 import django
 
 # 設定 Django 的 settings 模組給 Celery。
@@ -16,6 +17,29 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # 自動從所有已註冊的 Django app 中載入 tasks.py 檔案。
 app.autodiscover_tasks()
 
+# 任務排隊 / 執行時間指標與 worker 的 /metrics exporter (見 detector/metrics.py)
+from detector.metrics import install_celery_metrics  # noqa: E402
+install_celery_metrics()
+
+@worker_init.connect
+def record_worker_concurrency(sender=None, **kwargs):
+    """主 process 在 fork 前記錄並行數 (-c)，子 process 據此分配推論執行緒 (見 detector/cpu_scheduler.py)。"""
+    from detector.cpu_scheduler import WORKER_CONCURRENCY_ENV
+    concurrency = getattr(sender, 'concurrency', None)
+    if concurrency:
+        os.environ[WORKER_CONCURRENCY_ENV] = str(concurrency)
+
+
+@worker_process_init.connect
+def load_inference_model_in_worker_process(**kwargs):
+    """每個 prefork 子 process 啟動後設定推論執行緒數，再載入並暖機 YOLO 模型 (fork 之後才初始化 torch)。"""
+    from billiard.process import current_process
+    from detector.apps import ensure_yolo_model_loaded
+    from detector.cpu_scheduler import configure_inference_process
+    configure_inference_process('worker', child_index=getattr(current_process(), 'index', None))
+    ensure_yolo_model_loaded(role='worker')
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 from celery.schedules import crontab # 新增匯入 crontab
+from boto3.s3.transfer import TransferConfig
 
 # 1. BASE_DIR 定義
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -112,10 +113,18 @@ AWS_QUERYSTRING_AUTH = True     # 生成簽名 URL (如果 ACL 是 private)
 AWS_QUERYSTRING_EXPIRE = 3600   # 簽名 URL 過期時間 (秒)
 AWS_LOCATION = 'media'          # S3 儲存桶中媒體檔案的子目錄
 AWS_S3_FILE_OVERWRITE = False   # 不覆蓋同名檔案 (False 會在檔名後附加隨機字元)
+# 上傳設定：辨識圖片多為數百 KB 至數 MB，低於門檻時以單一 PUT 上傳；
+# use_threads=False 避免每次上傳都建立 s3transfer 執行緒，並行上傳由 detector/upload_pool.py 的共用執行緒池負責
+AWS_S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=16 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    use_threads=False,
+)
 
 STORAGES = {
     'default': {
-        'BACKEND': 'storages.backends.s3boto3.S3Boto3Storage',
+        # S3Boto3Storage + 預簽名 URL 快取 (見 detector/media_urls.py)
+        'BACKEND': 'detector.storage_backends.CachedUrlS3Storage',
         'OPTIONS': {
             'object_parameters': AWS_S3_OBJECT_PARAMETERS,
             # 'bucket_name': AWS_STORAGE_BUCKET_NAME, # 通常 django-storages 會從全域設定讀取
@@ -152,6 +161,12 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE # 【重要】讓 Celery 和 Django 使用相同的時區
 CELERY_TASK_TRACK_STARTED = True
+# 互動式 (非同步手動上傳) 任務走獨立佇列，由只監聽此佇列的 worker 消費 (docker-compose 的
+# celery_worker_interactive)，不會排在大量批次子任務之後；-Q 的佇列順序本身不提供優先權
+DETECTOR_INTERACTIVE_QUEUE = os.environ.get('DETECTOR_INTERACTIVE_QUEUE', 'interactive')
+CELERY_TASK_ROUTES = {
+    'detector.tasks.process_uploaded_image_task': {'queue': DETECTOR_INTERACTIVE_QUEUE},
+}
 
 # --- Celery Beat 設定 ---
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler' # <-- 【修改點】啟用資料庫排程器
@@ -169,6 +184,123 @@ MANUAL_RECORDS_TO_KEEP = 2  # 手動上傳記錄保留數量(數量)
 DAYS_TO_KEEP_MANUAL_RECORDS = 0  # 手動上傳記錄保留天數(時間)
 DAYS_TO_KEEP_BATCHES = 0   # 批次任務記錄保留天數(時間)
 BATCH_JOBS_TO_KEEP_BY_COUNT = 2 # 批次任務記錄保留數量(數量)
+MANUAL_CLEANUP_DEBOUNCE_SECONDS = 30  # 手動上傳後的數量清理：每 N 秒最多在背景執行一次 (Redis SET NX EX)
+RETENTION_DELETE_CHUNK_SIZE = 1000  # 清理時每段刪除的紀錄數 (每段一個 transaction)
+RETENTION_S3_DELETE_WORKERS = 8     # S3 DeleteObjects (每次 1000 個 key) 的並行執行緒數
+
+# --- 推論效能設定 ---
+# YOLO 推論後端: 'pytorch' (預設) / 'onnx' (ONNX Runtime) / 'openvino'
+# 非 pytorch 後端會在第一次載入時匯出 best.pt，並以權重 hash 快取於 yolo/ 目錄
+YOLO_INFERENCE_BACKEND = os.environ.get('YOLO_INFERENCE_BACKEND', 'pytorch')
+YOLO_MODEL_IMGSZ = int(os.environ.get('YOLO_MODEL_IMGSZ', 640))  # 模型輸入尺寸 (匯出與暖機時使用)
+# 模型載入後是否先以空白影像暖機一次，避免第一個請求承擔冷啟動成本
+YOLO_WARMUP_ON_LOAD = os.environ.get('YOLO_WARMUP_ON_LOAD', '1') == '1'
+# 明確指定 process 角色 (web / worker / beat / management)；未設定時依啟動指令自動判斷
+DETECTOR_PROCESS_ROLE = os.environ.get('DETECTOR_PROCESS_ROLE') or None
+# 縮小解碼：大尺寸 JPEG 以 DCT 縮放 (IMREAD_REDUCED_COLOR_2/4/8) 解碼到不小於 YOLO_MODEL_IMGSZ 的尺寸，
+# 檢測框座標換回原圖解析度。分塊推論開啟時不使用。
+YOLO_REDUCED_DECODE = os.environ.get('YOLO_REDUCED_DECODE', '0') == '1'
+# 縮小解碼時的標註圖：'full' = 有檢測結果時以完整解析度重新解碼並畫框 (標註圖維持原尺寸)；
+# 'reduced' = 直接畫在縮小的影像上 (省下第二次解碼，但標註圖與標註縮圖為縮小後的尺寸)
+YOLO_REDUCED_DECODE_ANNOTATION = os.environ.get('YOLO_REDUCED_DECODE_ANNOTATION', 'full')
+# 分塊推論 (detector/tiled_inference.py)：大尺寸畫面切成重疊的 tile 推論，保留細小病斑
+YOLO_TILED_INFERENCE = os.environ.get('YOLO_TILED_INFERENCE', '0') == '1'
+YOLO_TILE_SIZE = None               # tile 邊長 (像素)；None = YOLO_MODEL_IMGSZ (不需縮放)
+YOLO_TILE_OVERLAP = 0.2             # 相鄰 tile 重疊比例 (0 ~ 0.5)
+YOLO_TILED_MIN_DIMENSION = None     # 最長邊超過此值才分塊；None = tile 邊長的 1.5 倍
+YOLO_TILE_NMS_IOU = 0.5             # 合併各 tile 檢測框的 NMS IoU 閾值
+YOLO_TILED_MEMORY_BUDGET_MB = int(os.environ.get('YOLO_TILED_MEMORY_BUDGET_MB', 512))  # 每個任務同時推論的 tile 記憶體上限
+# CPU 推論排程 (detector/cpu_scheduler.py)：依 process 並行數分配 torch / OpenCV 執行緒，避免 N 個 process 各開滿核心數
+INFERENCE_SCHEDULER_ENABLED = os.environ.get('INFERENCE_SCHEDULER_ENABLED', '1') == '1'
+INFERENCE_THREADS_PER_PROCESS = int(os.environ.get('INFERENCE_THREADS_PER_PROCESS', 0))  # 0 = 校正檔或自動 (可用 CPU / 並行數)
+INFERENCE_CPU_AFFINITY = os.environ.get('INFERENCE_CPU_AFFINITY', '0') == '1'  # 每個 celery 子 process 綁定各自的 CPU
+INFERENCE_WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 4))  # gunicorn worker 數 (與 dockerfile 的 -w 相同)
+# `python manage.py calibrate_cpu_scheduler` 寫入的校正結果 (只在 CPU 數相同的主機上使用)
+INFERENCE_SCHEDULER_CONFIG_PATH = os.environ.get('INFERENCE_SCHEDULER_CONFIG_PATH', os.path.join(BASE_DIR, 'yolo', 'cpu_scheduler.json'))
+# 批次處理時，每個 Celery 子任務一次送入 YOLO 模型的圖片數 (micro-batch)
+BATCH_INFERENCE_CHUNK_SIZE = int(os.environ.get('BATCH_INFERENCE_CHUNK_SIZE', 8))
+# 網頁上傳改為非同步：request 中只儲存原始圖片並排入 interactive 佇列，結果頁輪詢狀態端點
+# (開啟時 web process 啟動時不載入模型，/api/process/ 第一次呼叫時才延遲載入)
+DETECTOR_ASYNC_UPLOADS = os.environ.get('DETECTOR_ASYNC_UPLOADS', '0') == '1'
+DETECTOR_UPLOAD_STATUS_POLL_MS = 1000  # 結果頁輪詢間隔 (毫秒)
+
+# --- 推論 API (/api/process/process/：image/* body、multipart 多檔或舊版 base64 JSON) ---
+API_MAX_IMAGE_BYTES = 20 * 1024 * 1024  # 單張圖片 (image/* body) 的大小上限
+API_MAX_IMAGES_PER_REQUEST = 32         # multipart 每次請求最多的圖片數
+API_INFERENCE_CHUNK_SIZE = 8            # multipart 每次讀入並批次推論的圖片數 (限制記憶體)
+
+# 批次子任務的管線模式：背景執行緒預取下一批圖片並在背景上傳結果，主執行緒持續推論
+BATCH_PIPELINE_ENABLED = os.environ.get('BATCH_PIPELINE_ENABLED', '0') == '1'
+BATCH_PIPELINE_MICRO_BATCH_SIZE = int(os.environ.get('BATCH_PIPELINE_MICRO_BATCH_SIZE', 4))  # 每次送入模型的圖片數
+BATCH_PIPELINE_PREFETCH_WORKERS = 4       # 下載執行緒數
+BATCH_PIPELINE_MAX_PREFETCHED = 8         # 目前 micro-batch 之外最多預先下載的圖片數 (限制記憶體)
+BATCH_PIPELINE_UPLOAD_WORKERS = 4         # 上傳執行緒數
+BATCH_PIPELINE_MAX_PENDING_UPLOADS = 8    # 最多同時等待上傳的圖片數 (限制記憶體)
+
+# 批次任務的原始圖片存放方式 (見 detector/s3_originals.py)：
+#   'upload'    : 將下載的 bytes 重新上傳到 uploads/batch_<id>/original/ (舊行為)
+#   'copy'      : 以 S3 CopyObject 在伺服器端複製到相同路徑，原始圖片不再經過 worker
+#   'reference' : original_image 直接指向來源物件 (來源須位於 AWS_STORAGE_BUCKET_NAME 的 AWS_LOCATION/ 之下，
+#                 否則改用 copy)。紀錄會標記 original_image_is_reference，刪除紀錄時不刪除來源物件
+#                 (來源物件的保留期限由上傳端或 bucket lifecycle 管理)。
+# copy / reference 失敗時會自動退回 upload。
+BATCH_ORIGINAL_IMAGE_MODE = os.environ.get('BATCH_ORIGINAL_IMAGE_MODE', 'copy')
+
+# --- Redis (detector app 自用，與 Celery broker 使用不同 DB) ---
+DETECTOR_REDIS_URL = os.environ.get('DETECTOR_REDIS_URL', 'redis://redis:6379/1')
+
+# --- 推論結果快取 (以圖片內容 sha256 + 模型權重 hash + 信心閾值為 key) ---
+# 條目含標註圖與縮圖，預設關閉；開啟時建議以 INFERENCE_CACHE_REDIS_URL 指向與 Celery broker 分開的 Redis
+INFERENCE_CACHE_ENABLED = os.environ.get('INFERENCE_CACHE_ENABLED', '0') == '1'
+INFERENCE_CACHE_REDIS_URL = os.environ.get('INFERENCE_CACHE_REDIS_URL') or None  # 未設定時使用 DETECTOR_REDIS_URL
+INFERENCE_CACHE_MAX_ENTRIES = int(os.environ.get('INFERENCE_CACHE_MAX_ENTRIES', 5000))  # 超過時淘汰最久未使用的條目
+INFERENCE_CACHE_MAX_BYTES = int(os.environ.get('INFERENCE_CACHE_MAX_MB', 256)) * 1024 * 1024  # 所有條目總大小上限，超過時依 LRU 淘汰
+INFERENCE_CACHE_MAX_ENTRY_BYTES = 2 * 1024 * 1024  # 單筆條目 (標註圖 + 縮圖) 超過此大小則不快取
+INFERENCE_CACHE_TTL = 7 * 24 * 3600  # 單筆快取最長保留時間 (秒)
+
+# --- Celery worker 的 S3 client 連線池 (每個 worker process 共用一個 client) ---
+S3_CLIENT_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_CLIENT_MAX_POOL_CONNECTIONS', 20))
+S3_CLIENT_TCP_KEEPALIVE = True
+# 每個 process 共用的上傳執行緒池大小 (同一筆紀錄的原始圖與標註圖同時上傳)
+S3_UPLOAD_POOL_WORKERS = int(os.environ.get('S3_UPLOAD_POOL_WORKERS', 8))
+
+# --- 標註圖編碼 (cv2.imencode，設定檔定義見 detector/image_encoding.py) ---
+# 'source' = 依原始副檔名 (JPEG 來源輸出 JPEG q90，其餘輸出 PNG)；
+# 其他內建設定檔: jpeg_q90, jpeg_q80, jpeg_q80_1280, webp_q80, webp_q80_1280, png
+# 可用 `python manage.py benchmark_encode_profiles` 比較各設定檔的編碼時間與檔案大小。
+ANNOTATED_IMAGE_ENCODE_PROFILE = os.environ.get('ANNOTATED_IMAGE_ENCODE_PROFILE', 'source')
+ANNOTATED_IMAGE_ENCODE_PROFILES = {}  # 自訂設定檔，例如 {'jpeg_q70': {'format': 'jpeg', 'quality': 70}}
+ANNOTATED_IMAGE_MAX_DIMENSION = None  # 標註圖最長邊上限 (像素)，None 表示維持原尺寸
+
+# --- 縮圖 (列表頁 / admin 預覽；推論時由記憶體中的影像產生) ---
+THUMBNAIL_ENCODE_PROFILE = os.environ.get('THUMBNAIL_ENCODE_PROFILE', 'jpeg_thumb_320')  # 或 'webp_thumb_320' (檔案較小，但編碼約慢 3 倍)
+THUMBNAIL_MAX_DIMENSION = 320  # 設定檔未指定 max_dimension 時的縮圖最長邊 (像素)
+
+# --- 預簽名 URL 快取 (process 記憶體 + Redis；以 storage key 為 key) ---
+PRESIGNED_URL_CACHE_ENABLED = os.environ.get('PRESIGNED_URL_CACHE_ENABLED', '1') == '1'
+PRESIGNED_URL_CACHE_TTL = None           # 快取秒數；None = AWS_QUERYSTRING_EXPIRE 的 3/4 (一定短於簽章有效時間)
+PRESIGNED_URL_LOCAL_CACHE_SIZE = 10000   # 每個 process 記憶體中最多保留的 URL 數
+
+# --- 列表分頁 (keyset 分頁，每頁筆數) ---
+BATCH_DETAIL_PAGE_SIZE = 48   # 批次詳情頁每次載入的圖片卡片數
+BATCH_HISTORY_PAGE_SIZE = 20  # 批次歷史列表每次載入的批次數
+
+# --- Prometheus 指標 (定義見 detector/metrics.py) ---
+# gunicorn / celery 皆為多 process，指標以 multiprocess 模式寫入此目錄後彙總；須在匯入 prometheus_client 之前設定。
+# 目錄在 process 重啟之間應清空 (容器啟動指令中處理)。
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/detector_prometheus')
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # 關閉時 /metrics 回傳 404
+# /metrics 與 /detector/inference-cache/stats/ 只允許 staff 登入的使用者，或帶有
+# `Authorization: Bearer <METRICS_AUTH_TOKEN>` 的請求 (Prometheus scrape_config 的 bearer_token)；未設定時不接受 token
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN', '')
+# Celery worker 在此 port 提供 /metrics (各容器的指標目錄分開，由 Prometheus 分別抓取)；0 表示不啟動
+METRICS_WORKER_PORT = int(os.environ.get('METRICS_WORKER_PORT', 9808))
+
+# --- 嚴重程度評分參數 (None 表示使用 detector/severity.py 的預設值) ---
+# 格式: {'類別名稱 (小寫)': {'base': float, 'confidence_factor': float, 'per_detection_bonus': float}, ...}
+# 調整後可執行 `python manage.py rescore_detection_records` 重新計算既有紀錄。
+DETECTOR_SEVERITY_CLASS_PARAMS = None
 
 # ... (您原有的 LOGGING 設定) ...
 LOGGING = {
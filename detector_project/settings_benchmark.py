@@ -0,0 +1,53 @@
+# detector_project/settings_benchmark.py
+# ------------------------------------------------
+# 離線基準測試用設定 (python manage.py benchmark_pipeline)：
+# 不需要 PostgreSQL、Redis、S3 或 Celery broker。
+#   - 資料庫: 工作目錄中的 sqlite
+#   - 圖片 storage: 工作目錄中的 FileSystemStorage
+#   - 來源 S3: detector/benchmarking.py 的 DirectoryS3Client (由指令替換 tasks.get_s3_client)
+#   - Celery: eager 模式，任務在同一個 process 中依序執行
+# 用法: DJANGO_SETTINGS_MODULE=detector_project.settings_benchmark python manage.py benchmark_pipeline
+# ------------------------------------------------
+import os
+import tempfile
+from .settings import *  # noqa: F401,F403
+
+DETECTOR_BENCHMARK = True  # benchmark_pipeline 只在此設定下執行 (會清空資料表)
+
+BENCHMARK_WORK_DIR = os.environ.get('BENCHMARK_WORK_DIR') or os.path.join(tempfile.gettempdir(), 'detector_benchmark')
+os.makedirs(BENCHMARK_WORK_DIR, exist_ok=True)
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BENCHMARK_WORK_DIR, 'benchmark.sqlite3'),
+    }
+}
+
+MEDIA_ROOT = os.path.join(BENCHMARK_WORK_DIR, 'media')
+MEDIA_URL = '/media/'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+CELERY_BROKER_URL = 'memory://'
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TASK_EAGER_PROPAGATES = True
+
+# 依賴 Redis 的快取全部關閉：推論快取會讓重複的合成圖片直接命中，結果無法跨 commit 比較
+INFERENCE_CACHE_ENABLED = False
+PRESIGNED_URL_CACHE_ENABLED = False
+BATCH_ORIGINAL_IMAGE_MODE = 'upload'  # FileSystemStorage 只能上傳
+YOLO_WARMUP_ON_LOAD = True
+METRICS_WORKER_PORT = 0
+# 各情境建立的紀錄留到 retention 情境一次刪除 (批次完成後的即時清理不可先刪掉)
+MANUAL_RECORDS_TO_KEEP = 10 ** 9
+BATCH_JOBS_TO_KEEP_BY_COUNT = 10 ** 9
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'root': {'handlers': ['console'], 'level': os.environ.get('BENCHMARK_LOG_LEVEL', 'WARNING')},
+}
@@ -19,6 +19,7 @@ from django.urls import path
 from django.urls import path, include
 from django.conf import settings      # <-- 新增匯入 settings
 from django.conf.urls.static import static  # <-- 新增匯入 static
+from detector.views import metrics_view
 
 
 urlpatterns = [
@@ -27,6 +28,7 @@ urlpatterns = [
     # 就把網址後面剩下的部分交給 'detector.urls' (也就是 detector/urls.py) 去處理
     path('detector/', include('detector.urls')),
     path('api/', include('detector.api.urls')),
+    path('metrics', metrics_view, name='metrics'),  # Prometheus 抓取端點
 ]
 # *** 新增以下區塊，用於在開發模式下提供媒體檔案 ***
 if settings.DEBUG: